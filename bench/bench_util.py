@@ -0,0 +1,150 @@
+"""
+Helpers shared by the benchmarks: building a throwaway application backed
+by an SQLite file and seeding it with a configurable volume of data.
+"""
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from houraiteahouse.app import create_app
+from houraiteahouse.config import TestConfig
+from houraiteahouse.storage import auth_storage, news_storage, \
+    summary_storage
+from houraiteahouse.storage.models import db, hasher, Language, \
+    NewsComment, NewsPost, User, UserPermissions
+
+PASSWORD = 'password'
+LANGUAGES = (('en_US', 'English'), ('ja', 'Japanese'), ('zh', 'Chinese'))
+
+# post_pages lists every (post ID, language) the post can be read in
+Dataset = namedtuple('Dataset', ['usernames', 'sessions', 'post_pages',
+                                 'tags', 'languages'])
+
+
+def add_volume_args(parser):
+    """
+    Adds the options controlling the volume of seeded data to a parser
+    """
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=10)
+    parser.add_argument('--tags-per-post', type=int, default=3)
+    parser.add_argument('--languages', type=int, default=2,
+                        choices=range(1, len(LANGUAGES) + 1))
+    parser.add_argument('--translations', type=float, default=0.5,
+                        help='Fraction of posts translated into every other '
+                        'language')
+    parser.add_argument('--comments', type=int, default=10,
+                        help='Comments per post')
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='bcrypt log rounds')
+    parser.add_argument('--body-store', default='filesystem',
+                        choices=('filesystem', 'database', 'object'),
+                        help='Where news bodies are kept')
+
+
+class BenchmarkEnvironment(object):
+    """
+    Temporary database, news directory and object store for a benchmark
+      run.  Use as a context manager; everything is removed on exit.
+    """
+
+    def __init__(self, rounds=4, **config):
+        self.rounds = rounds
+        self.config = config
+        self.app = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='htbench')
+
+        class BenchmarkConfig(TestConfig):
+            DEBUG = False
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                self.directory, 'bench.db')
+            BCRYPT_LOG_ROUNDS = self.rounds
+            NEWS_BODY_DIR = os.path.join(self.directory, 'news')
+            NEWS_BODY_OBJECT_STORE_URL = 'file://' + os.path.join(
+                self.directory, 'objects')
+
+        for key, value in self.config.items():
+            setattr(BenchmarkConfig, key, value)
+        self.app = create_app(BenchmarkConfig)
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.directory)
+
+
+def seed(app, users=50, posts=100, tags=10, tags_per_post=3, languages=2,
+         translations=0.5, comments=10):
+    """
+    Seeds an empty database through the storage layer, so summaries, the
+      search index and news bodies are all in place
+    :return: Identifiers of the seeded data
+    :rtype: Dataset
+    """
+    codes = [code for code, _ in LANGUAGES[:languages]]
+    with app.app_context():
+        db.create_all()
+        for code, name in LANGUAGES[:languages]:
+            db.session.add(Language(code, name))
+        permissions = UserPermissions()
+        permissions.news = True
+        db.session.add(permissions)
+        db.session.flush()
+        # Hashing every seed user would dominate the setup time, so they all
+        # share one hash computed at the configured cost
+        pw_hash = hasher.generate_password_hash(PASSWORD)
+        usernames = ['user{0}'.format(i) for i in range(users)]
+        db.session.execute(User.__table__.insert(), [{
+            'username': username,
+            'email': username + '@bench',
+            'password': pw_hash,
+            'registered_on': datetime.utcnow(),
+            'permissions_id': permissions.id
+        } for username in usernames])
+        db.session.commit()
+
+        sessions = [auth_storage.new_user_session(
+            auth_storage.get_user(username), False).session_uuid
+            for username in usernames]
+        tag_names = ['tag{0}'.format(i) for i in range(tags)]
+        post_pages = []
+        for i in range(posts):
+            post_tags = [tag_names[(i + j) % tags]
+                         for j in range(min(tags_per_post, tags))]
+            post = news_storage.post_news(
+                'Post {0}'.format(i), _body(i, codes[0]), post_tags,
+                sessions[i % users], language=codes[0])
+            post_pages.append((post['post_id'], codes[0]))
+            if i < posts * translations:
+                for code in codes[1:]:
+                    post_pages.append((post['post_id'], code))
+                    news_storage.translate_news(
+                        post['post_id'], code,
+                        'Post {0} ({1})'.format(i, code), _body(i, code))
+
+        if comments:
+            author_ids = [user.id for user in User.query.all()]
+            news_ids = [news_id for news_id, in
+                        db.session.query(NewsPost.id).all()]
+            db.session.execute(NewsComment.__table__.insert(), [{
+                'body': 'Comment {0}'.format(j),
+                'author_id': author_ids[j % len(author_ids)],
+                'news_id': news_id,
+            } for news_id in news_ids for j in range(comments)])
+            db.session.commit()
+            summary_storage.rebuild_summaries()
+        return Dataset(usernames, sessions, post_pages, tag_names, codes)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _body(index, language):
+    return ' '.join(['Body of post {0} in {1}.'.format(index, language)] * 40)
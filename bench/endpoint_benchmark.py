@@ -0,0 +1,202 @@
+"""
+Endpoint latency and throughput benchmark.
+
+Seeds a throwaway database with the requested volume of users, posts, tags,
+translations and comments, then times the hot read endpoints and logins
+through the application's test client.  Results can be saved as a baseline
+and later runs compared against it; the run exits with status 1 if any
+endpoint's median latency or throughput regressed past the threshold.
+
+Baselines are only comparable on the same machine with the same volumes.
+Run from the repository root:
+
+    PYTHONPATH=src python bench/endpoint_benchmark.py --save-baseline
+    PYTHONPATH=src python bench/endpoint_benchmark.py --compare
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from bench_util import BenchmarkEnvironment, PASSWORD, add_volume_args, \
+    percentile, seed
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines',
+                                'endpoints.json')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_volume_args(parser)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='Untimed requests per endpoint')
+    parser.add_argument('--clients', type=int, default=1,
+                        help='Concurrent clients per endpoint')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true',
+                        help='Fail if results regressed against the '
+                        'baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Tolerated fractional regression')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help='Latency changes smaller than this are noise')
+    parser.add_argument('--endpoint', action='append',
+                        help='Only run the named endpoint(s)')
+    return parser.parse_args()
+
+
+def endpoints(dataset):
+    """
+    :return: Endpoint name to a function issuing the i-th request against a
+      test client
+    :rtype: dict
+    """
+    language = dataset.languages[-1]
+
+    def pick(values, i):
+        return values[i % len(values)]
+
+    def login(client, i):
+        return client.post('/auth/login', data=json.dumps({
+            'username': pick(dataset.usernames, i),
+            'password': PASSWORD
+        }), content_type='application/json')
+
+    return {
+        'news.list': lambda client, i: client.get(
+            '/news?language=' + language),
+        'news.get': lambda client, i: client.get(
+            '/news/{0}?language={1}'.format(*pick(dataset.post_pages, i))),
+        'news.tag': lambda client, i: client.get(
+            '/news/tag/{0}?language={1}'.format(pick(dataset.tags, i),
+                                                language)),
+        'auth.login': login,
+        'auth.status': lambda client, i: client.get(
+            '/auth/status?session_id=' + pick(dataset.sessions, i)),
+    }
+
+
+def measure(app, request, requests, warmup, clients):
+    """
+    Issues requests from concurrent clients
+    :return: Latency percentiles in milliseconds, throughput and errors
+    :rtype: dict
+    """
+    client = app.test_client()
+    for i in range(warmup):
+        request(client, i)
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(offset):
+        client = app.test_client()
+        for i in range(offset, requests, clients):
+            start = time.monotonic()
+            response = request(client, i)
+            elapsed = time.monotonic() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=run, args=(offset,))
+               for offset in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    return {
+        'p50_ms': percentile(latencies, .5) * 1000,
+        'p95_ms': percentile(latencies, .95) * 1000,
+        'p99_ms': percentile(latencies, .99) * 1000,
+        'requests_per_second': len(latencies) / elapsed,
+        'errors': errors[0],
+    }
+
+
+def regressions(results, baseline, threshold, min_delta_ms=0):
+    """
+    :return: Descriptions of every endpoint that regressed past the
+      threshold
+    :rtype: list
+    """
+    found = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result['p50_ms'] > previous['p50_ms'] * (1 + threshold) and \
+                result['p50_ms'] - previous['p50_ms'] > min_delta_ms:
+            found.append('{0}: p50 {1:.2f}ms, baseline {2:.2f}ms'.format(
+                name, result['p50_ms'], previous['p50_ms']))
+        if result['requests_per_second'] < \
+                previous['requests_per_second'] * (1 - threshold) and \
+                1000 / result['requests_per_second'] - \
+                1000 / previous['requests_per_second'] > min_delta_ms:
+            found.append('{0}: {1:.1f} req/s, baseline {2:.1f} req/s'.format(
+                name, result['requests_per_second'],
+                previous['requests_per_second']))
+        if result['errors'] > previous['errors']:
+            found.append('{0}: {1} errors, baseline {2}'.format(
+                name, result['errors'], previous['errors']))
+    return found
+
+
+def main():
+    args = parse_args()
+    volumes = {name: getattr(args, name) for name in (
+        'users', 'posts', 'tags', 'tags_per_post', 'languages',
+        'translations', 'comments')}
+    with BenchmarkEnvironment(args.rounds,
+                              NEWS_BODY_STORE=args.body_store) as environment:
+        dataset = seed(environment.app, **volumes)
+        results = {}
+        for name, request in sorted(endpoints(dataset).items()):
+            if args.endpoint and name not in args.endpoint:
+                continue
+            results[name] = measure(environment.app, request, args.requests,
+                                    args.warmup, args.clients)
+
+    print('{0:<12} {1:>9} {2:>9} {3:>9} {4:>10} {5:>7}'.format(
+        'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    for name, result in sorted(results.items()):
+        print('{0:<12} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} '
+              '{requests_per_second:>10.1f} {errors:>7}'.format(
+                  name, **result))
+
+    if args.save_baseline:
+        directory = os.path.dirname(args.baseline)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'volumes': volumes, 'results': results},
+                      baseline_file, indent=2, sort_keys=True)
+        print('Saved baseline to ' + args.baseline)
+
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['volumes'] != volumes:
+            print('Baseline was recorded with different volumes: {0}'
+                  .format(baseline['volumes']))
+            return 2
+        found = regressions(results, baseline['results'], args.threshold,
+                            args.min_delta_ms)
+        for regression in found:
+            print('REGRESSION ' + regression)
+        if found:
+            return 1
+        print('No regressions past {0:.0%}'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Login throughput benchmark.
+
+Fires concurrent logins at the application while a separate set of
+clients keeps reading the news listing, then reports login throughput,
+how many logins were turned away by the password hashing queue and the
+latency of the concurrent reads.
+
+Run from the repository root:
+
+    PYTHONPATH=src python bench/login_benchmark.py --rounds 12
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from houraiteahouse.app import create_app
+from houraiteahouse.config import TestConfig
+from houraiteahouse.storage.models import db, hasher, Language, User, \
+    UserPermissions
+from houraiteahouse.util import hashing
+
+PASSWORD = 'password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--login-clients', type=int, default=8)
+    parser.add_argument('--read-clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds to run for')
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt log rounds')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Password hashing worker threads')
+    parser.add_argument('--queue-depth', type=int, default=4,
+                        help='Password hashing jobs allowed to wait')
+    return parser.parse_args()
+
+
+def build_app(args, database):
+    class BenchmarkConfig(TestConfig):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + database
+        BCRYPT_LOG_ROUNDS = args.rounds
+        PASSWORD_HASH_WORKERS = args.workers
+        PASSWORD_HASH_QUEUE_DEPTH = args.queue_depth
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Language('en_US', 'English'))
+        permissions = UserPermissions()
+        db.session.add(permissions)
+        db.session.flush()
+        # Hashing every seed user would dominate the setup time, so they all
+        # share one hash computed at the configured cost
+        pw_hash = hasher.generate_password_hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [{
+            'username': 'user{0}'.format(i),
+            'email': 'user{0}@bench'.format(i),
+            'password': pw_hash,
+            'registered_on': datetime.utcnow(),
+            'permissions_id': permissions.id
+        } for i in range(args.users)])
+        db.session.commit()
+    return app
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    args = parse_args()
+    handle, database = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        app = build_app(args, database)
+        deadline = time.monotonic() + args.duration
+        results = {'ok': 0, 'rejected': 0, 'failed': 0}
+        read_latencies = []
+        lock = threading.Lock()
+
+        def login(index):
+            client = app.test_client()
+            username = 'user{0}'.format(index % args.users)
+            while time.monotonic() < deadline:
+                response = client.post('/auth/login', data=json.dumps({
+                    'username': username,
+                    'password': PASSWORD
+                }), content_type='application/json')
+                outcome = {200: 'ok', 503: 'rejected'}.get(
+                    response.status_code, 'failed')
+                with lock:
+                    results[outcome] += 1
+
+        def read():
+            client = app.test_client()
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                client.get('/news?language=en_US')
+                with lock:
+                    read_latencies.append(time.monotonic() - start)
+
+        threads = [threading.Thread(target=login, args=(i,))
+                   for i in range(args.login_clients)]
+        threads += [threading.Thread(target=read)
+                    for _ in range(args.read_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print('bcrypt rounds:        {0}'.format(args.rounds))
+        print('logins/s:             {0:.2f}'.format(
+            results['ok'] / args.duration))
+        print('logins rejected:      {0}'.format(results['rejected']))
+        print('logins failed:        {0}'.format(results['failed']))
+        print('hash p50/p95 (ms):    {0:.1f} / {1:.1f}'.format(
+            *_histogram_percentiles(hashing.hash_latency)))
+        print('reads/s:              {0:.2f}'.format(
+            len(read_latencies) / args.duration))
+        print('read p50/p95 (ms):    {0:.1f} / {1:.1f}'.format(
+            percentile(read_latencies, .5) * 1000,
+            percentile(read_latencies, .95) * 1000))
+    finally:
+        os.remove(database)
+
+
+def _histogram_percentiles(histogram):
+    ret = []
+    for fraction in (.5, .95):
+        target = histogram.count * fraction
+        seen = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            seen += count
+            if seen >= target:
+                ret.append(bound * 1000)
+                break
+        else:
+            ret.append(float('nan'))
+    return ret
+
+
+if __name__ == '__main__':
+    main()
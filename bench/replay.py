@@ -0,0 +1,289 @@
+"""
+Replays a recorded request log against the application.
+
+The log holds one JSON object per line with the request's method, path,
+query args and JSON body, and optionally the second it was made at:
+
+    {"method": "GET", "path": "/news", "args": {"language": "en_US"}}
+    {"method": "POST", "path": "/auth/login", "time": 0.25,
+     "body": {"username": "user3", "password": "password"}}
+
+Requests are sent by a pool of concurrent clients, either straight into
+the app through its test client (--target inprocess), through a local
+HTTP server wrapping the app (--target serve), or to an already running
+server (--target http://127.0.0.1:8000).  Latency percentiles, throughput
+and error rates are reported per route.
+
+Without --config the app runs on a throwaway database seeded as for
+endpoint_benchmark.py; {post}, {language}, {tag}, {user} and {session} in
+paths, args and bodies are replaced with seeded values so synthetic logs
+can refer to data which exists.
+
+Run from the repository root:
+
+    PYTHONPATH=src python bench/replay.py requests.log --concurrency 16
+"""
+import argparse
+import http.client
+import itertools
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from werkzeug.exceptions import HTTPException
+from werkzeug.serving import make_server
+from bench_util import BenchmarkEnvironment, add_volume_args, percentile, \
+    seed
+from houraiteahouse.app import create_app
+from houraiteahouse.config import DevelopmentConfig
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('log', help='Request log, one JSON object per line')
+    parser.add_argument('--target', default='inprocess',
+                        help='inprocess, serve or the base URL of a server')
+    parser.add_argument('--config',
+                        help='JSON config of a database to replay against, '
+                        'instead of a seeded one')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Replay at this multiple of the recorded pace. '
+                        '0 replays as fast as possible')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='Times to replay the log')
+    add_volume_args(parser)
+    return parser.parse_args()
+
+
+def load_log(path):
+    with open(path) as log:
+        return [json.loads(line) for line in log if line.strip()]
+
+
+def substitute(value, fields):
+    """
+    Replaces {placeholders} in every string within a request
+    """
+    if isinstance(value, str):
+        return value.format(**fields) if '{' in value else value
+    if isinstance(value, dict):
+        return {key: substitute(item, fields) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, fields) for item in value]
+    return value
+
+
+def placeholders(dataset):
+    """
+    :return: Function returning the placeholder values for the i-th request,
+      cycling through the seeded data
+    :rtype: function
+    """
+    def fields(i):
+        post, language = dataset.post_pages[i % len(dataset.post_pages)]
+        user = i % len(dataset.usernames)
+        return {
+            'post': post,
+            'language': language,
+            'tag': dataset.tags[i % len(dataset.tags)],
+            'user': dataset.usernames[user],
+            'session': dataset.sessions[user],
+        }
+    return fields
+
+
+class TestClientTarget(object):
+    """
+    Sends requests straight into the app through its test client
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, args, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(
+            path, method=method, query_string=args,
+            data=json.dumps(body) if body is not None else None,
+            content_type='application/json')
+        return response.status_code
+
+
+class HttpTarget(object):
+    """
+    Sends requests to a server over HTTP, one connection per client thread
+    """
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self._local = threading.local()
+
+    def send(self, method, path, args, body):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = \
+                http.client.HTTPConnection(self.host, self.port)
+        url = self.prefix + path
+        if args:
+            url += '?' + urllib.parse.urlencode(args)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, url, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        return response.status
+
+
+def serve(app):
+    """
+    Serves the app on an ephemeral localhost port from a background thread
+    :return: The server, and the target sending requests to it
+    :rtype: tuple
+    """
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, HttpTarget('http://127.0.0.1:{0}'.format(
+        server.server_port))
+
+
+def route_of(adapter, method, path):
+    """
+    :return: The URL rule a request is routed to, e.g. GET /news/<post_id>
+    :rtype: basestring
+    """
+    try:
+        rule, _ = adapter.match(path, method, return_rule=True)
+        return '{0} {1}'.format(method, rule.rule)
+    except HTTPException as error:
+        return '{0} <{1}>'.format(method, error.code)
+
+
+def replay(target, requests, adapter, concurrency, speed=0, fields=None):
+    """
+    Sends every request from a pool of concurrent clients
+    :return: Per route latencies, status counts and failures, and the total
+      time taken
+    :rtype: tuple
+    """
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    counter = itertools.count()
+    start = time.monotonic()
+
+    def client():
+        while True:
+            i = next(counter)
+            if i >= len(requests):
+                return
+            entry = requests[i]
+            if fields is not None:
+                entry = substitute(entry, fields(i))
+            method = entry.get('method', 'GET').upper()
+            path = entry['path']
+            if speed and 'time' in entry:
+                delay = start + entry['time'] / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.monotonic()
+            try:
+                status = target.send(method, path, entry.get('args') or {},
+                                     entry.get('body'))
+            except (OSError, http.client.HTTPException):
+                status = 'connection error'
+            elapsed = time.monotonic() - sent
+            route = route_of(adapter, method, path)
+            with lock:
+                latencies[route].append(elapsed)
+                statuses[route][status] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.monotonic() - start
+
+
+def report(latencies, statuses, elapsed):
+    print('{0:<45} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>7}'.format(
+        'route', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    total = errors = 0
+    for route in sorted(latencies):
+        samples = latencies[route]
+        failed = sum(count for status, count in statuses[route].items()
+                     if not isinstance(status, int) or status >= 500)
+        total += len(samples)
+        errors += failed
+        print('{0:<45} {1:>7} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.1f} '
+              '{6:>6.1%}'.format(
+                  route, len(samples), percentile(samples, .5) * 1000,
+                  percentile(samples, .95) * 1000,
+                  percentile(samples, .99) * 1000, len(samples) / elapsed,
+                  failed / len(samples)))
+        client_errors = {status: count for status, count
+                         in statuses[route].items()
+                         if isinstance(status, int) and 400 <= status < 500}
+        if client_errors:
+            print('{0:<45} 4xx: {1}'.format('', ', '.join(
+                '{0}x{1}'.format(count, status)
+                for status, count in sorted(client_errors.items()))))
+    print('{0} requests in {1:.2f}s, {2:.1f} req/s, {3:.1%} errors'.format(
+        total, elapsed, total / elapsed if elapsed else 0,
+        errors / total if total else 0))
+
+
+def main():
+    args = parse_args()
+    requests = load_log(args.log) * args.loops
+    if args.config:
+        environment = None
+        app = create_app(DevelopmentConfig(args.config))
+        fields = None
+    else:
+        environment = BenchmarkEnvironment(
+            args.rounds, NEWS_BODY_STORE=args.body_store).__enter__()
+        app = environment.app
+        fields = placeholders(seed(app, **{name: getattr(args, name) for name
+                                           in ('users', 'posts', 'tags',
+                                               'tags_per_post', 'languages',
+                                               'translations', 'comments')}))
+    server = None
+    try:
+        if args.target == 'inprocess':
+            target = TestClientTarget(app)
+        elif args.target == 'serve':
+            server, target = serve(app)
+        else:
+            target = HttpTarget(args.target)
+        adapter = app.url_map.bind('localhost')
+        report(*replay(target, requests, adapter, args.concurrency,
+                       args.speed, fields))
+    finally:
+        if server is not None:
+            server.shutdown()
+        if environment is not None:
+            environment.__exit__(None, None, None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
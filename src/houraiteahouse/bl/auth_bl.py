@@ -1,13 +1,14 @@
-from flask import request
+import logging
+from flask import request, _request_ctx_stack
 from functools import wraps
 from houraiteahouse.route import request_util
 from houraiteahouse.storage import auth_storage, models
 from werkzeug.exceptions import Unauthorized, Forbidden, InternalServerError, \
     NotFound
 
+logger = logging.getLogger(__name__)
 
 # Signin/signout calls
-# TODO: Session caching for active sessions
 
 
 def start_user_session(username, password, remember_me):
@@ -33,20 +34,37 @@ def start_user_session(username, password, remember_me):
     except NotFound:
         raise error from None
     if authenticate_user(user, password):
+        if models.hasher.needs_rehash(user.password):
+            rehash_password(user, password)
         userSession = auth_storage.new_user_session(user, remember_me)
         ret = {
             'username': userSession.user.username,
             'email': userSession.user.email,
             'session_id': userSession.get_uuid(),
-            'permissions':  userSession.get_user().permissions.__dict__
+            'permissions': userSession.get_user().permissions.to_dict()
         }
-        ret['permissions'].pop('_sa_instance_state')
         if not remember_me:
             ret['expiration'] = userSession.expiration
         return ret
     raise error
 
 
+def rehash_password(user, password):
+    """
+    Upgrades a user's stored hash to the configured bcrypt cost.  Failing
+      to do so is not fatal to the login, it will be retried next time.
+    :param user: User who has just successfully authenticated
+    :type user: houraiteahouse.storage.models.User
+    :param password: The password the user authenticated with
+    :type password: basestring
+    """
+    try:
+        auth_storage.rehash_password(user, password)
+    except Exception:
+        logger.exception('Failed to rehash password for {0}'
+                         .format(user.username))
+
+
 def get_user_for_session(session_id):
     """
     Fetches the user data associated with the given session ID
@@ -104,6 +122,27 @@ def authenticate_user(user, password):
     return user and password and user.check_password(password)
 
 
+def get_request_session(session_id):
+    """
+    Resolves the given session at most once per request.  The snapshot is
+      kept on the request context so that stacked authN & authZ checks share
+      a single lookup.
+    :param session_id: The session ID to resolve
+    :type session_id: basestring
+    :return: Snapshot of the session if present
+    :rtype: houraiteahouse.storage.auth_storage.SessionInfo
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return auth_storage.get_session_info(session_id)
+    resolved = getattr(ctx, 'houraiteahouse_sessions', None)
+    if resolved is None:
+        resolved = ctx.houraiteahouse_sessions = {}
+    if session_id not in resolved:
+        resolved[session_id] = auth_storage.get_session_info(session_id)
+    return resolved[session_id]
+
+
 def authentication_check(session_id):
     """
     Validates that the given session is valid and returns session data if it is
@@ -115,16 +154,14 @@ def authentication_check(session_id):
     """
     if session_id is None:
         return {'status': False}
-    userSession = auth_storage.get_user_session(session_id)
+    userSession = get_request_session(session_id)
     if not(userSession and userSession.is_valid):
         return {'status': False}
-    ret = {
+    return {
         'status': True,
-        'permissions': userSession.user.permissions.__dict__,
+        'permissions': dict(userSession.permissions),
         'expiration': userSession.expiration
     }
-    ret['permissions'].pop('_sa_instance_state')
-    return ret
 
 
 def authenticate(func):
@@ -174,12 +211,10 @@ def authorization_check(action_type, session_id):
     """
     if session_id is None or action_type is None:
         return False
-    userSession = auth_storage.get_user_session(session_id)
+    userSession = get_request_session(session_id)
     if userSession is None or not userSession.is_valid:
         return False
-    permissions = userSession.user.permissions.__dict__
-    # 'master' implies server & db access and thus always has permission
-    return permissions['master'] or permissions[action_type]
+    return userSession.has_permission(action_type)
 
 
 # Decorator to require authorization for requests
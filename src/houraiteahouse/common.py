@@ -1,9 +1,19 @@
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
-from .storage.models import db, cache
+from .route.response_cache import response_cache
+from .storage.auth_storage import session_cache, session_reaper
+from .storage.body_cache import body_cache
+from .storage.body_store import body_store
+from .storage.language_registry import languages
+from .storage.models import db, cache, hasher
+from .storage.query_cache import cache_policy
+from .storage.static_export import static_export
+from .storage.translation_index import translations
 
 bcrypt = Bcrypt()
 cors = CORS(headers=['Content-Type'])
 
-extensions = [db, cache, bcrypt, cors]
+extensions = [db, cache, cache_policy, bcrypt, hasher, cors, body_cache,
+              body_store, session_cache, session_reaper, languages,
+              translations, response_cache, static_export]
@@ -1,6 +1,7 @@
 from houraiteahouse.route.auth_route import user
 from houraiteahouse.route.news_route import news
 from houraiteahouse.route.errors import install_error_handlers
+from houraiteahouse.route.instrumentation import install_instrumentation
 
 
 blueprints = {
@@ -8,4 +9,4 @@ blueprints = {
     '/news': news,
 }
 
-post_process_steps = [install_error_handlers]
+post_process_steps = [install_error_handlers, install_instrumentation]
@@ -122,7 +122,6 @@ def status():
 
         if 'permissions' in response:
             permissions = response['permissions']
-            permissions.pop('permissions_id')
 
             # Obscure/hide permissions the user doesn't have
             filteredPerms = {}
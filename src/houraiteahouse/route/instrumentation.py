@@ -0,0 +1,128 @@
+import atexit
+import logging
+import time
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from houraiteahouse.util import metrics
+from houraiteahouse.util.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Time spent per request in each of these is reported per endpoint
+RESOURCES = ('db', 'bcrypt', 'news_io')
+UNMATCHED_ENDPOINT = '<unmatched>'
+
+request_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling requests',
+    labels=('endpoint', 'method'))
+request_count = registry.counter(
+    'http_requests_total', 'Requests handled, by response status',
+    labels=('endpoint', 'method', 'status'))
+sql_statements = registry.counter(
+    'http_request_sql_statements_total',
+    'SQL statements executed while handling requests',
+    labels=('endpoint',))
+resource_seconds = registry.counter(
+    'http_request_resource_seconds_total',
+    'Time spent by requests in the database, bcrypt and news file I/O',
+    labels=('endpoint', 'resource'))
+
+_QUERY_START = 'houraiteahouse.query_start'
+
+_store = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info.setdefault(_QUERY_START, []).append(time.monotonic())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    start = conn.info[_QUERY_START].pop()
+    metrics.record_time('db', time.monotonic() - start)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_execute(context):
+    starts = context.connection.info.get(_QUERY_START)
+    if starts:
+        metrics.record_time('db', time.monotonic() - starts.pop())
+
+
+def install_instrumentation(app):
+    """
+    Records the latency, status, SQL statements and time spent in the
+      database, bcrypt and news file I/O of every request, per endpoint, and
+      serves them at /metrics in the Prometheus text exposition format.
+      When METRICS_DIR is set, each worker process periodically saves its
+      metrics there and /metrics reports the sum over every worker, so the
+      numbers do not depend on which uWSGI worker answers the scrape.
+    :param app: The application to instrument
+    :type app: flask.Flask
+    """
+    global _store
+    directory = app.config.get('METRICS_DIR')
+    flush_interval = app.config.get('METRICS_FLUSH_INTERVAL',
+                                    DEFAULT_FLUSH_INTERVAL)
+    _store = metrics.MultiProcessStore(directory) if directory else None
+    if _store is not None:
+        atexit.register(_flush, _store)
+    last_flush = [time.monotonic()]
+
+    @app.before_request
+    def start_timer():
+        if _store is not None:
+            _store.check_fork()
+        g.request_start = time.monotonic()
+        metrics.start_request_timings()
+
+    @app.after_request
+    def record_status(response):
+        g.response_status = response.status_code
+        return response
+
+    # Recorded on teardown, as after_request is skipped for unhandled
+    # exceptions, which are answered with a 500
+    @app.teardown_request
+    def record_request(error=None):
+        timings = metrics.stop_request_timings()
+        start = g.get('request_start')
+        if start is None or timings is None:
+            return
+        status = g.get('response_status', 500)
+        endpoint = request.endpoint or UNMATCHED_ENDPOINT
+        request_latency.observe(time.monotonic() - start, endpoint=endpoint,
+                                method=request.method)
+        request_count.inc(endpoint=endpoint, method=request.method,
+                          status=status)
+        sql_statements.inc(int(timings['db_count']), endpoint=endpoint)
+        for resource in RESOURCES:
+            resource_seconds.inc(timings[resource], endpoint=endpoint,
+                                 resource=resource)
+
+        now = time.monotonic()
+        if _store is not None and now - last_flush[0] >= flush_interval:
+            last_flush[0] = now
+            _flush(_store)
+
+    def serve_metrics():
+        if _store is None:
+            body = metrics.exposition(registry)
+        else:
+            _flush(_store)
+            body = metrics.exposition(registry, _store.collect())
+        return Response(body, content_type=metrics.CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', serve_metrics, methods=['GET'])
+
+
+def _flush(store):
+    try:
+        store.flush()
+    except OSError:
+        logger.exception('Unable to save metrics to ' + store.directory)
@@ -14,9 +14,52 @@ logger = logging.getLogger(__name__)
 @news.route('', methods=['GET'])
 @require_language('args', 'fetching news')
 def list_news():
-    news = news_storage.list_news(request.args['language'])
+    language = request.args['language']
+    cursor = request.args.get('cursor')
+    limit = request_util.get_int_arg('limit', news_storage.DEFAULT_PAGE_SIZE)
+
+    updated, count = news_storage.list_news_version(language)
+    etag = request_util.make_etag('news', language, cursor, limit, updated,
+                                  count)
+
+    return request_util.generate_conditional_response(
+        etag, updated,
+        lambda: json.dumps(news_storage.list_news(language, cursor, limit)),
+        'application/json'
+    )
+
+
+@news.route('/tags', methods=['GET'])
+def list_tags():
     return request_util.generate_success_response(
-        json.dumps(news),
+        json.dumps({'tags': news_storage.tag_counts()}),
+        'application/json'
+    )
+
+
+@news.route('/search', methods=['GET'])
+@require_language('args', 'searching news')
+def search_news():
+    language = request.args['language']
+    query = request.args.get('q', '').strip()
+    if not query:
+        return request_util.generate_error_response(
+            400,
+            'A search query must be provided as \'q\''
+        )
+    limit = request_util.get_int_arg('limit', news_storage.DEFAULT_PAGE_SIZE)
+
+    # The index is updated alongside the summaries the listing is versioned by
+    updated, count = news_storage.list_news_version(language)
+    etag = request_util.make_etag('search', query, language, limit, updated,
+                                  count)
+
+    return request_util.generate_conditional_response(
+        etag, updated,
+        lambda: json.dumps({
+            'query': query,
+            'results': news_storage.search_news(query, language, limit)
+        }),
         'application/json'
     )
 
@@ -27,13 +70,19 @@ def get_tag_wrapper(tag_name):
                       'fetching news tagged with \'{0}\''
                       .format(tag_name))
     def get_tag(tag_name):
-        news = news_storage.tagged_news(
-            tag_name,
-            request.args['language']
-        )
-
-        return request_util.generate_success_response(
-            json.dumps(news),
+        language = request.args['language']
+        cursor = request.args.get('cursor')
+        limit = request_util.get_int_arg('limit',
+                                         news_storage.DEFAULT_PAGE_SIZE)
+
+        updated, count = news_storage.tagged_news_version(tag_name, language)
+        etag = request_util.make_etag('tag', tag_name, language, cursor,
+                                      limit, updated, count)
+
+        return request_util.generate_conditional_response(
+            etag, updated,
+            lambda: json.dumps(news_storage.tagged_news(
+                tag_name, language, cursor, limit)),
             'application/json'
         )
 
@@ -48,18 +97,52 @@ def get_news_wrapper(post_id):
         callerSess = None
         if 'session_id' in request.args:
             callerSess = request.args['session_id']
-
-        news = news_storage.get_news(post_id, callerSess,
-                                     request.args['language'])
-
-        return request_util.generate_success_response(
-            json.dumps(news),
+        language = request.args['language']
+        # Clients paging through /comments can leave them out of the post
+        include_comments = request_util.get_bool_arg('comments', True)
+
+        # The caller's session is part of the tag as it determines isAuthor,
+        # and so is the language the body falls back to, which changes once
+        # the post is translated
+        updated = news_storage.news_version(post_id, language)
+        etag = None
+        if updated is not None:
+            etag = request_util.make_etag(
+                'post', post_id, language, updated, callerSess,
+                include_comments,
+                news_storage.news_body_language(post_id, language))
+
+        return request_util.generate_conditional_response(
+            etag, updated,
+            lambda: json.dumps(news_storage.get_news(
+                post_id, callerSess, language, include_comments)),
             'application/json'
         )
 
     return get_news(post_id)
 
 
+@news.route('/<post_id>/comments', methods=['GET'])
+def list_comments(post_id):
+    callerSess = request.args.get('session_id')
+    cursor = request.args.get('cursor')
+    limit = request_util.get_int_arg('limit', news_storage.DEFAULT_PAGE_SIZE)
+
+    # New and deleted comments refresh the post's summaries
+    updated = news_storage.news_version(post_id)
+    etag = None
+    if updated is not None:
+        etag = request_util.make_etag('comments', post_id, cursor, limit,
+                                      updated, callerSess)
+
+    return request_util.generate_conditional_response(
+        etag, updated,
+        lambda: json.dumps(news_storage.list_comments(
+            post_id, callerSess, cursor, limit)),
+        'application/json'
+    )
+
+
 @news.route('', methods=['POST'])
 @authorize('news')
 def create_news():
@@ -178,7 +261,7 @@ def edit_comment_wrapper(post_id, comment_id):
 
 @news.route('/<post_id>/comment/<comment_id>', methods=['DELETE'])
 @authorize('comment')
-def delete_comment(comment_id):
+def delete_comment(post_id, comment_id):
     success = news_storage.delete_comment(
         comment_id,
         request.json['session_id']
@@ -1,23 +1,135 @@
+import hashlib
 import json
 import logging
 from flask import Response, request
 from functools import wraps
+from werkzeug.exceptions import BadRequest
+from houraiteahouse.storage.language_registry import languages
+from .response_cache import SUPPORTED_ENCODINGS, compress, response_cache
 
 logger = logging.getLogger(__name__)
 
 
+def negotiate_encoding():
+    """
+    :return: The preferred content coding the client accepts, or None
+    :rtype: basestring
+    """
+    return request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+
+
+def encode_response(response, encoding):
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 def generate_response(status, responseBody, mimetype):
-    return Response(
+    encoding = None
+    if status == 200 and responseBody is not None:
+        if not isinstance(responseBody, bytes):
+            responseBody = responseBody.encode('utf-8')
+        encoding = negotiate_encoding()
+        if response_cache.should_compress(responseBody, encoding):
+            responseBody = compress(responseBody, encoding,
+                                    response_cache.level)
+        else:
+            encoding = None
+    return encode_response(Response(
         status=status,
         response=responseBody,
         mimetype=mimetype
-    )
+    ), encoding)
 
 
 def generate_success_response(responseBody, mimetype):
     return generate_response(200, responseBody, mimetype)
 
 
+def make_etag(*parts):
+    """
+    Builds a strong entity tag from the values identifying a representation
+    :param parts: Values which together identify the response content
+    :return: Hex digest usable as an ETag
+    :rtype: basestring
+    """
+    key = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(etag, last_modified=None):
+    """
+    Evaluates the current request's conditional headers.  If-None-Match
+      takes precedence over If-Modified-Since when both are present.
+    :param etag: ETag of the current representation
+    :type etag: basestring
+    :param last_modified: Modification time of the current representation
+    :type last_modified: datetime
+    :return: Whether the client's copy is still current
+    :rtype: Boolean
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= \
+            request.if_modified_since
+    return False
+
+
+def coded_etag(etag, encoding):
+    """
+    :param etag: ETag of the uncompressed representation
+    :type etag: basestring
+    :param encoding: Content coding applied to the body, or None
+    :type encoding: basestring
+    :return: ETag of the representation in the given content coding.  Each
+      coding has its own strong tag, as their bytes differ.
+    :rtype: basestring
+    """
+    return etag if encoding is None else '{0}-{1}'.format(etag, encoding)
+
+
+def generate_conditional_response(etag, last_modified, render, mimetype):
+    """
+    Generates a response honoring If-None-Match and If-Modified-Since.  The
+      body is only rendered when the client's copy is out of date.
+    :param etag: ETag of the current representation, or None if the content
+      cannot be versioned
+    :type etag: basestring
+    :param last_modified: Modification time of the current representation
+    :type last_modified: datetime
+    :param render: Callable producing the response body
+    :type render: callable
+    :param mimetype: Mimetype of the response body
+    :type mimetype: basestring
+    :return: A 304 response or a full success response
+    :rtype: flask.Response
+    """
+    if etag is None:
+        return generate_success_response(render(), mimetype)
+    encoding = negotiate_encoding()
+    current = [coded_etag(etag, encoding)]
+    if encoding is not None:
+        # Clients can always use the uncompressed representation
+        current.append(etag)
+    held = next((tag for tag in current
+                 if is_not_modified(tag, last_modified)), None)
+    if held is not None:
+        response = generate_response(304, None, mimetype)
+        response.set_etag(held)
+    else:
+        # Cached by version, so repeat reads skip rendering and compression
+        body, encoding = response_cache.payload(etag, encoding, render)
+        response = encode_response(
+            Response(status=200, response=body, mimetype=mimetype),
+            encoding)
+        response.set_etag(coded_etag(etag, encoding))
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
 def generate_error_response(status, responseText):
     return generate_response(
         status,
@@ -31,6 +143,46 @@ def generate_error_response(status, responseText):
     )
 
 
+def get_int_arg(name, default=None):
+    """
+    Reads an optional integer query parameter from the current request
+    :param name: Name of the query parameter
+    :type name: basestring
+    :param default: Value to use when the parameter is absent
+    :type default: int
+    :return: The parsed parameter value
+    :rtype: int
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(
+            '\'{0}\' must be an integer.'.format(name)) from None
+
+
+def get_bool_arg(name, default=None):
+    """
+    Reads an optional boolean query parameter from the current request
+    :param name: Name of the query parameter
+    :type name: basestring
+    :param default: Value to use when the parameter is absent
+    :type default: Boolean
+    :return: The parsed parameter value
+    :rtype: Boolean
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise BadRequest('\'{0}\' must be true or false.'.format(name))
+
+
 # Decorator to block requests missing language param that require it
 def require_language(field, internalAction, externalAction=None):
     def language_check_wrapper(func):
@@ -54,6 +206,21 @@ def require_language(field, internalAction, externalAction=None):
                     message.format(action)
                 )
 
+            # Resolved from the in-memory registry, so this costs no queries
+            if field == 'args':
+                language = request.args['language']
+            elif field == 'data':
+                language = request.data['language']
+            else:
+                language = None
+            if language is not None and language not in languages:
+                logger.debug('Unknown language {0} when {1}'
+                             .format(language, internalAction))
+                return generate_error_response(
+                    400,
+                    'Unknown language \'{0}\''.format(language)
+                )
+
             return func(*args, **kwargs)
 
         return error_on_no_language
@@ -0,0 +1,134 @@
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_MIN_COMPRESS_BYTES = 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+
+def compress(body, encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    :param body: Payload to compress
+    :type body: bytes
+    :param encoding: Content coding to apply, one of SUPPORTED_ENCODINGS
+    :type encoding: basestring
+    :param level: zlib compression level
+    :type level: int
+    :return: The compressed payload
+    :rtype: bytes
+    """
+    if encoding == 'gzip':
+        return gzip.compress(body, level)
+    return zlib.compress(body, level)
+
+
+class ResponseCache(object):
+    """
+    Bounded LRU cache of serialized response bodies, keyed by ETag and
+      content coding.  An ETag identifies a version of the content, so an
+      entry never needs invalidating: once the content changes its ETag
+      does too and the old entries age out.  Bodies smaller than min_bytes
+      are served uncompressed, as compression would gain next to nothing.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+                 min_bytes=DEFAULT_MIN_COMPRESS_BYTES,
+                 level=DEFAULT_COMPRESSION_LEVEL):
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        self.level = level
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('RESPONSE_CACHE_BYTES',
+                                        DEFAULT_MAX_BYTES)
+        self.min_bytes = app.config.get('COMPRESSION_MIN_BYTES',
+                                        DEFAULT_MIN_COMPRESS_BYTES)
+        self.level = app.config.get('COMPRESSION_LEVEL',
+                                    DEFAULT_COMPRESSION_LEVEL)
+        self.clear()
+
+    def should_compress(self, body, encoding):
+        return encoding is not None and len(body) >= self.min_bytes
+
+    def payload(self, etag, encoding, render):
+        """
+        Fetches the body of a versioned response, rendering and compressing
+          it only if no copy of this version is cached
+        :param etag: ETag of the representation
+        :type etag: basestring
+        :param encoding: Content coding negotiated with the client, or None
+        :type encoding: basestring
+        :param render: Callable producing the uncompressed body
+        :type render: callable
+        :return: The body and the content coding actually applied to it
+        :rtype: tuple
+        """
+        if encoding is not None:
+            compressed = self._get((etag, encoding))
+            if compressed is not None:
+                return compressed, encoding
+        body = self._get((etag, None))
+        if body is None:
+            body = render()
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            self._put((etag, None), body)
+        if not self.should_compress(body, encoding):
+            return body, None
+        compressed = compress(body, encoding, self.level)
+        self._put((etag, encoding), compressed)
+        return compressed, encoding
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        :return: Snapshot of the cache's counters
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
+
+    def _get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def _put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+response_cache = ResponseCache()
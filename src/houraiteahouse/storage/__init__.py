@@ -1 +1 @@
-from . import auth_storage, models, news_storage
+from . import auth_storage, models, news_storage, summary_storage
@@ -1,20 +1,211 @@
 import logging
+import os
+import threading
+import time
 
+from collections import namedtuple, OrderedDict
 from datetime import datetime
 from flask_sqlalchemy_cache import FromCache
 from sqlalchemy import inspect, exc
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.session import Session
 from houraiteahouse.storage import models
 from houraiteahouse.storage import storage_util as util
 from houraiteahouse.storage.models import db, cache
+from houraiteahouse.util.metrics import registry
 from werkzeug.exceptions import Forbidden
 
 logger = logging.getLogger(__name__)
 
 
-# TODO: Refactor to remove code duplication, add caching
+# TODO: Refactor to remove code duplication
 
+DEFAULT_SESSION_CACHE_TTL = 10
+DEFAULT_SESSION_CACHE_MAX_ENTRIES = 10000
+DEFAULT_REAP_BATCH_SIZE = 1000
+DEFAULT_SESSION_COUNT_INTERVAL = 3600
 
+sessions_reaped = registry.counter(
+    'sessions_reaped_total', 'Expired sessions deleted by the reaper')
+session_rows = registry.gauge(
+    'sessions_table_rows', 'Rows in the sessions table when last counted')
+
+
+class SessionInfo(namedtuple('SessionInfo', [
+        'session_uuid', 'user_id', 'username', 'email', 'permissions',
+        'valid_after', 'valid_before'])):
+    """
+    Immutable snapshot of a session, its user and their permissions.  Safe to
+      share between requests as it holds no database state.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_session(cls, user_session):
+        user = user_session.user
+        return cls(user_session.session_uuid, user.id, user.username,
+                   user.email, user.permissions.to_dict(),
+                   user_session.valid_after, user_session.valid_before)
+
+    @property
+    def expiration(self):
+        return None if self.valid_before is None else int(
+            time.mktime(self.valid_before.timetuple())) * 1000
+
+    @property
+    def is_valid(self):
+        now = datetime.utcnow()
+        if self.valid_before is not None and self.valid_before < now:
+            return False
+        return self.valid_after < now
+
+    def has_permission(self, action_type):
+        # 'master' implies server & db access and thus always has permission
+        return self.permissions['master'] or \
+            self.permissions.get(action_type, False)
+
+
+class SessionCache(object):
+    """
+    Short lived, process local cache of SessionInfo snapshots.  Entries are
+      dropped on logout and permission changes made by this process; the TTL
+      bounds how long other worker processes may serve a stale entry.  Holds
+      at most max_entries sessions, evicting the oldest first.
+    """
+
+    def __init__(self, ttl=DEFAULT_SESSION_CACHE_TTL,
+                 max_entries=DEFAULT_SESSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Ordered by insertion, and so by expiry as every entry shares a TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SESSION_CACHE_TTL',
+                                  DEFAULT_SESSION_CACHE_TTL)
+        self.max_entries = app.config.get('SESSION_CACHE_MAX_ENTRIES',
+                                          DEFAULT_SESSION_CACHE_MAX_ENTRIES)
+        self.clear()
+
+    def get(self, session_uuid):
+        with self._lock:
+            entry = self._entries.get(session_uuid)
+            if entry is None:
+                return None
+            expiry, info = entry
+            if expiry < time.monotonic():
+                del self._entries[session_uuid]
+                return None
+            return info
+
+    def put(self, info):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(info.session_uuid, None)
+            self._entries[info.session_uuid] = (now + self.ttl, info)
+            # Sweep expired entries, then evict until back within bounds
+            while self._entries:
+                expiry, _ = next(iter(self._entries.values()))
+                if expiry >= now and len(self._entries) <= self.max_entries:
+                    break
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def invalidate(self, session_uuid):
+        with self._lock:
+            self._entries.pop(session_uuid, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for session_uuid, (_, info) in list(self._entries.items()):
+                if info.user_id == user_id:
+                    del self._entries[session_uuid]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SessionReaper(object):
+    """
+    Periodically purges expired sessions from a background thread.  Disabled
+      unless SESSION_REAP_INTERVAL is positive.  The thread is started by
+      the first request each process handles, so every uWSGI worker runs
+      its own reaper rather than only the master it was forked from.
+      Batches are idempotent, so overlapping runs only repeat a cheap
+      indexed query.  The sessions table is counted, which scans it, at
+      most every SESSION_COUNT_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._timer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counted = None
+        self.interval = 0
+        self.batch_size = DEFAULT_REAP_BATCH_SIZE
+        self.count_interval = DEFAULT_SESSION_COUNT_INTERVAL
+
+    def init_app(self, app):
+        self.stop()
+        self._app = app
+        self.interval = app.config.get('SESSION_REAP_INTERVAL', 0)
+        self.batch_size = app.config.get('SESSION_REAP_BATCH_SIZE',
+                                         DEFAULT_REAP_BATCH_SIZE)
+        self.count_interval = app.config.get('SESSION_COUNT_INTERVAL',
+                                             DEFAULT_SESSION_COUNT_INTERVAL)
+        app.before_request(self.start)
+
+    def start(self):
+        """
+        Starts this process' reaper, if enabled and not already running
+        """
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._schedule()
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.interval, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        try:
+            with self._app.app_context():
+                reap_expired_sessions(self.batch_size)
+                if self._counted is None or time.monotonic() - \
+                        self._counted >= self.count_interval:
+                    self._counted = time.monotonic()
+                    count_sessions()
+        except Exception:
+            logger.exception('Failed to reap expired sessions')
+        finally:
+            if self._timer is not None:
+                self._schedule()
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pid = None
+
+
+session_cache = SessionCache()
+session_reaper = SessionReaper()
+
+
+@util.transactional
 def new_user_session(user, remember_me):
     """
     Opens a new session for the given user.
@@ -26,11 +217,11 @@ def new_user_session(user, remember_me):
     :rtype: models.UserSession
     """
     user_session = models.UserSession(user, remember_me)
-    uuid = user_session.session_uuid
-    util.try_add(session=user_session, logger=logger)
-    return get_user_session(uuid)
+    db.session.add(user_session)
+    return user_session
 
 
+@util.read_only
 def get_user_session(session_uuid):
     """
     Fetches the session associated with the given session ID
@@ -45,6 +236,32 @@ def get_user_session(session_uuid):
         .first()
 
 
+@util.read_only
+def get_session_info(session_uuid):
+    """
+    Fetches a snapshot of the session associated with the given session ID,
+      along with its user and their permissions, in at most one query
+    :param session_uuid: The session ID to query
+    :type session_uuid: basestring
+    :return: Snapshot of the session if present
+    :rtype: SessionInfo
+    """
+    info = session_cache.get(session_uuid)
+    if info is not None:
+        return info
+    user_session = models.UserSession.query \
+        .filter_by(session_uuid=session_uuid) \
+        .options(joinedload(models.UserSession.user)
+                 .joinedload(models.User.permissions)) \
+        .first()
+    if user_session is None:
+        return None
+    info = SessionInfo.from_session(user_session)
+    session_cache.put(info)
+    return info
+
+
+@util.transactional
 def close_all_sessions(user_id):
     """
     Closes all sessions associated with a given user
@@ -55,9 +272,10 @@ def close_all_sessions(user_id):
         .filter_by(user_id=user_id) \
         .options(FromCache(cache)) \
         .delete()
-    db.session.commit()
+    util.on_commit(lambda: session_cache.invalidate_user(user_id))
 
 
+@util.transactional
 def close_user_session(session_uuid):
     """
     Closes the session associated with the given session ID
@@ -69,7 +287,58 @@ def close_user_session(session_uuid):
         .options(FromCache(cache)) \
         .first()
     db.session.delete(userSession)
-    db.session.commit()
+    util.on_commit(lambda: session_cache.invalidate(session_uuid))
+
+
+def reap_expired_sessions(batch_size=DEFAULT_REAP_BATCH_SIZE, now=None):
+    """
+    Deletes sessions that expired before the given time.  Rows are removed
+      in batches of at most batch_size, each in its own transaction, so a
+      large backlog never holds long locks on the sessions table.
+    :param batch_size: Maximum number of sessions deleted per transaction
+    :type batch_size: int
+    :param now: Cutoff time, defaults to the current time
+    :type now: datetime
+    :return: Number of sessions deleted
+    :rtype: int
+    """
+    now = now or datetime.utcnow()
+    total = 0
+    while True:
+        with util.unit_of_work(logger):
+            expired = db.session.query(models.UserSession.id,
+                                       models.UserSession.session_uuid) \
+                .filter(models.UserSession.valid_before < now) \
+                .limit(batch_size) \
+                .all()
+            if not expired:
+                break
+            models.UserSession.query \
+                .filter(models.UserSession.id.in_(
+                    [row.id for row in expired])) \
+                .delete(synchronize_session=False)
+        for row in expired:
+            session_cache.invalidate(row.session_uuid)
+        total += len(expired)
+        sessions_reaped.inc(len(expired))
+        if len(expired) < batch_size:
+            break
+    if total:
+        logger.info('Reaped {0} expired sessions'.format(total))
+    return total
+
+
+def count_sessions():
+    """
+    Counts the rows in the sessions table, reporting them as the
+      sessions_table_rows gauge.  Scans the whole table, so should be run
+      sparingly.
+    :return: Number of sessions stored
+    :rtype: int
+    """
+    count = db.session.query(models.UserSession.id).count()
+    session_rows.set(count)
+    return count
 
 
 def get_user(username):
@@ -100,13 +369,12 @@ def get_permissions_by_username(username):
     """
     permissions = get_user(username).permissions
     if permissions is not None:
-        permissions = permissions.__dict__
-        permissions.pop('_sa_instance_state')
-        permissions.pop('id')
+        permissions = permissions.to_dict()
 
     return permissions
 
 
+@util.transactional
 def set_permissions_by_username(username, permissions, session_uuid):
     """
     Attempts to update the given permissions associated with the given
@@ -133,16 +401,19 @@ def set_permissions_by_username(username, permissions, session_uuid):
             # You MUST be a master to promote admins
             raise error
 
-    permissionsObj = models.User.get_or_die(username=username).permissions
+    user = models.User.get_or_die(username=username)
+    user_id = user.id
+    permissionsObj = user.permissions
 
     if permissionsObj.master:
         # This user's permissions cannot be set through calls!
         raise error
 
     permissionsObj.update_permissions(permissions)
-    util.try_merge(permissions=permissionsObj)
+    util.on_commit(lambda: session_cache.invalidate_user(user_id))
 
 
+@util.transactional
 def create_user(email, username, password):
     """
     Creates a new user with the given email address, username, and password
@@ -163,10 +434,11 @@ def create_user(email, username, password):
         password=password,
         permissions=permissions
     )
-    util.try_add(user=user, logger=logger)
-    util.try_add(permissions=permissions, logger=logger)
+    db.session.add(permissions)
+    db.session.add(user)
 
 
+@util.transactional
 def update_password(user, password):
     """
     Updates a user's password
@@ -179,5 +451,19 @@ def update_password(user, password):
     """
     user.change_password(password)
     # Changing passwords should the user out of all of their sessions
-    close_all_sessions(user.user_id)
-    util.try_merge(user=user, logger=logger)
+    close_all_sessions(user.id)
+    db.session.merge(user)
+
+
+@util.transactional
+def rehash_password(user, password):
+    """
+    Recomputes a user's password hash at the currently configured cost.
+      Unlike update_password, the user's sessions are left open.
+    :param user: User object to rehash the password of
+    :type user: models.User
+    :param password: The user's verified plaintext password
+    :type password: basestring
+    """
+    user.change_password(password)
+    db.session.merge(user)
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# size is the file's size, which the cache's byte budget is counted in
+_Entry = namedtuple('_Entry', ['mtime', 'size', 'body'])
+
+
+class NewsBodyCache(object):
+    """
+    Bounded LRU cache of decoded news bodies read from disk.  Entries are
+      validated against the file's mtime and size on every read, so a body
+      changed on disk is never served stale.  Bodies larger than
+      max_entry_bytes are read from disk every time rather than crowding
+      out the rest of the cache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('NEWS_BODY_CACHE_BYTES',
+                                        DEFAULT_MAX_BYTES)
+        self.max_entry_bytes = app.config.get('NEWS_BODY_MAX_ENTRY_BYTES')
+        self.clear()
+
+    def read(self, path):
+        """
+        Reads the body stored at the given path, from memory if possible
+        :param path: Path of the news body file
+        :type path: basestring
+        :return: The body text
+        :rtype: basestring
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Let open() produce the appropriate error for the caller
+            self.invalidate(path)
+            with self._lock:
+                self.misses += 1
+            with open(path, 'r') as body_file:
+                return body_file.read()
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime == stat.st_mtime_ns and \
+                    entry.size == stat.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry.body
+            self.misses += 1
+
+        entry = self._load(path, stat)
+        self._store(path, entry)
+        return entry.body
+
+    def invalidate(self, path):
+        """
+        Drops any cached body for the given path
+        :param path: Path of the news body file
+        :type path: basestring
+        """
+        with self._lock:
+            self._discard(path)
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entries):
+                self._discard(path)
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        :return: Snapshot of the cache's counters
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
+
+    def _load(self, path, stat):
+        # Bodies are replaced atomically, so the file read is at least as new
+        # as the one stat'd. At worst a newer body is cached under the older
+        # stat and read again on the next request.
+        with open(path, 'r', encoding='utf-8') as body_file:
+            body = body_file.read()
+        return _Entry(stat.st_mtime_ns, stat.st_size, body)
+
+    def _store(self, path, entry):
+        if entry.size > self.max_bytes or (
+                self.max_entry_bytes is not None and
+                entry.size > self.max_entry_bytes):
+            return
+        with self._lock:
+            self._discard(path)
+            self._entries[path] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+body_cache = NewsBodyCache()
@@ -0,0 +1,491 @@
+import abc
+import logging
+import os
+import tempfile
+import urllib.parse
+import zlib
+from houraiteahouse.storage import models
+from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage.body_cache import body_cache
+from houraiteahouse.storage.language_registry import languages
+from houraiteahouse.storage.models import db
+
+logger = logging.getLogger(__name__)
+
+FILESYSTEM = 'filesystem'
+DATABASE = 'database'
+OBJECT = 'object'
+DEFAULT_NEWS_DIR = '/var/htwebsite/news/'
+DEFAULT_COMPRESSION_LEVEL = 6
+# Bodies are served directly by nginx as well as read by the app
+FILE_MODE = 0o644
+
+
+class BodyNotFound(FileNotFoundError):
+    """
+    Raised when no body is stored for a post in a language.  An IOError, as
+      callers already expect of a missing news file.
+    """
+
+    def __init__(self, post_short, language):
+        FileNotFoundError.__init__(
+            self, 'No body for news post {0} in {1}'.format(post_short,
+                                                            language))
+
+
+class BodyStore(abc.ABC):
+    """
+    Interface of a backend storing the body of each post in each language
+      it has been written in
+    """
+
+    @abc.abstractmethod
+    def read(self, post_short, language):
+        """
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code of the body
+        :type language: basestring
+        :return: The body text
+        :rtype: basestring
+        :raises BodyNotFound: If no such body is stored
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exists(self, post_short, language):
+        """
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code of the body
+        :type language: basestring
+        :return: Whether a body is stored, checked without reading it
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write(self, post_short, language, body):
+        """
+        Creates or replaces a body
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code of the body
+        :type language: basestring
+        :param body: The body text
+        :type body: basestring
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, post_short, language):
+        """
+        Removes a body, if stored
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code of the body
+        :type language: basestring
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def keys(self):
+        """
+        :return: (short title, language code) of every stored body
+        :rtype: list
+        """
+        raise NotImplementedError
+
+
+class FileSystemBodyStore(BodyStore):
+    """
+    Stores bodies as files at `<root>/<language>/<post short title>`, read
+      through the in-memory body cache.  Only suits a single web node, or a
+      root on shared storage.
+    """
+
+    def __init__(self, root, cache=None):
+        self.root = root
+        self.cache = cache
+
+    def path_for(self, post_short, language):
+        """
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code of the body
+        :type language: basestring
+        :return: Location of the body's file
+        :rtype: basestring
+        :raises ValueError: If either would name a file outside its
+          language's directory
+        """
+        for part in (language, post_short):
+            if part in ('', '.', '..') or '/' in part or \
+                    os.sep in part or (os.altsep and os.altsep in part):
+                raise ValueError('Invalid news body key {0}/{1}'
+                                 .format(language, post_short))
+        return os.path.join(self.root, language, post_short)
+
+    def read(self, post_short, language):
+        path = self.path_for(post_short, language)
+        try:
+            if self.cache is not None:
+                return self.cache.read(path)
+            with open(path, 'r') as body_file:
+                return body_file.read()
+        except FileNotFoundError:
+            raise BodyNotFound(post_short, language)
+
+    def exists(self, post_short, language):
+        return os.path.isfile(self.path_for(post_short, language))
+
+    def write(self, post_short, language, body):
+        path = self.path_for(post_short, language)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Replaced atomically, so readers never see a partly written body
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as body_file:
+                body_file.write(body)
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._invalidate(path)
+
+    def delete(self, post_short, language):
+        path = self.path_for(post_short, language)
+        self._invalidate(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        keys = []
+        if not os.path.isdir(self.root):
+            return keys
+        for language in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, language)
+            if not os.path.isdir(directory):
+                continue
+            keys.extend((post_short, language)
+                        for post_short in sorted(os.listdir(directory))
+                        if not post_short.endswith('.tmp'))
+        return keys
+
+    def _invalidate(self, path):
+        if self.cache is not None:
+            self.cache.invalidate(path)
+
+
+class DatabaseBodyStore(BodyStore):
+    """
+    Stores bodies compressed in the newsbody table.  Writes join the
+      caller's transaction, so a body is only saved along with the post it
+      belongs to.  Posts must exist before their bodies are written.
+    """
+
+    def __init__(self, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+
+    def read(self, post_short, language):
+        body = self._lookup(models.NewsBody.body, post_short, language)
+        if body is None:
+            raise BodyNotFound(post_short, language)
+        return zlib.decompress(body).decode('utf-8')
+
+    def exists(self, post_short, language):
+        return self._lookup(models.NewsBody.news_id, post_short,
+                            language) is not None
+
+    def write(self, post_short, language, body):
+        news_id, language_id = self._ids(post_short, language)
+        if news_id is None or language_id is None:
+            raise ValueError('Unknown news post {0} or language {1}'
+                             .format(post_short, language))
+        db.session.merge(models.NewsBody(
+            news_id=news_id, language_id=language_id,
+            body=zlib.compress(body.encode('utf-8'),
+                               self.compression_level)))
+
+    def delete(self, post_short, language):
+        news_id, language_id = self._ids(post_short, language)
+        if news_id is None or language_id is None:
+            return
+        models.NewsBody.query \
+            .filter_by(news_id=news_id, language_id=language_id) \
+            .delete(synchronize_session=False)
+
+    def keys(self):
+        return db.session.query(models.NewsPost.post_short,
+                                models.Language.language_code) \
+            .join(models.NewsBody,
+                  models.NewsBody.news_id == models.NewsPost.id) \
+            .join(models.Language,
+                  models.Language.id == models.NewsBody.language_id) \
+            .order_by(models.NewsBody.news_id, models.NewsBody.language_id) \
+            .all()
+
+    def _lookup(self, column, post_short, language):
+        lang = languages.get(language)
+        if lang is None:
+            return None
+        return db.session.query(column) \
+            .join(models.NewsPost,
+                  models.NewsPost.id == models.NewsBody.news_id) \
+            .filter(models.NewsPost.post_short == post_short,
+                    models.NewsBody.language_id == lang.id) \
+            .scalar()
+
+    def _ids(self, post_short, language):
+        lang = languages.get(language)
+        news_id = db.session.query(models.NewsPost.id) \
+            .filter_by(post_short=post_short).scalar()
+        return news_id, lang.id if lang is not None else None
+
+
+class ObjectBodyStore(BodyStore):
+    """
+    Stores bodies as `<prefix><language>/<post short title>` objects in a
+      bucket shared by every web node
+    """
+
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    def key_for(self, post_short, language):
+        return '{0}{1}/{2}'.format(self.prefix, language, post_short)
+
+    def read(self, post_short, language):
+        body = self.client.get(self.key_for(post_short, language))
+        if body is None:
+            raise BodyNotFound(post_short, language)
+        return body.decode('utf-8')
+
+    def exists(self, post_short, language):
+        return self.client.exists(self.key_for(post_short, language))
+
+    def write(self, post_short, language, body):
+        self.client.put(self.key_for(post_short, language),
+                        body.encode('utf-8'))
+
+    def delete(self, post_short, language):
+        self.client.delete(self.key_for(post_short, language))
+
+    def keys(self):
+        keys = []
+        for key in self.client.list(self.prefix):
+            language, _, post_short = key[len(self.prefix):].partition('/')
+            if post_short:
+                keys.append((post_short, language))
+        return keys
+
+
+class LocalObjectClient(object):
+    """
+    Object store client keeping objects as files below a directory.  Stands
+      in for a real object store in development and tests.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, key):
+        """
+        :return: The object's contents, or None if there is no such object
+        :rtype: bytes
+        """
+        try:
+            with open(self._path(key), 'rb') as object_file:
+                return object_file.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Objects are replaced atomically, as in a real object store
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=''):
+        keys = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name),
+                                      self.directory).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def _path(self, key):
+        parts = key.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            raise ValueError('Invalid object key {0}'.format(key))
+        return os.path.join(self.directory, *parts)
+
+
+class S3ObjectClient(object):
+    """
+    Object store client for Amazon S3 and compatible stores.  Requires
+      boto3, which is only needed when this client is configured.
+    """
+
+    def __init__(self, bucket, **client_options):
+        import boto3
+        self.bucket = bucket
+        self._client = boto3.client('s3', **client_options)
+        self._missing = self._client.exceptions.NoSuchKey
+
+    def get(self, key):
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=key)
+        except self._missing:
+            return None
+        return response['Body'].read()
+
+    def exists(self, key):
+        response = self._client.list_objects_v2(Bucket=self.bucket,
+                                                Prefix=key, MaxKeys=1)
+        return any(item['Key'] == key
+                   for item in response.get('Contents', ()))
+
+    def put(self, key, data):
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix=''):
+        paginator = self._client.get_paginator('list_objects_v2')
+        return [item['Key']
+                for page in paginator.paginate(Bucket=self.bucket,
+                                               Prefix=prefix)
+                for item in page.get('Contents', ())]
+
+
+def object_store_from_url(url):
+    """
+    :param url: file:///<directory> for a local stand-in, or
+      s3://<bucket>/<prefix>
+    :type url: basestring
+    :return: Store keeping bodies in the object store at the URL
+    :rtype: ObjectBodyStore
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme == 'file':
+        return ObjectBodyStore(LocalObjectClient(parsed.path))
+    if parsed.scheme == 's3':
+        prefix = parsed.path.lstrip('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return ObjectBodyStore(S3ObjectClient(parsed.netloc), prefix)
+    raise ValueError('Unsupported object store URL {0}'.format(url))
+
+
+def create_body_store(backend, config):
+    """
+    :param backend: filesystem, database or object
+    :type backend: basestring
+    :param config: Application config holding the backend's settings
+    :type config: dict
+    :return: The configured store
+    :rtype: BodyStore
+    """
+    if backend == FILESYSTEM:
+        return FileSystemBodyStore(
+            config.get('NEWS_BODY_DIR', DEFAULT_NEWS_DIR), body_cache)
+    if backend == DATABASE:
+        return DatabaseBodyStore(config.get('NEWS_BODY_COMPRESSION_LEVEL',
+                                            DEFAULT_COMPRESSION_LEVEL))
+    if backend == OBJECT:
+        url = config.get('NEWS_BODY_OBJECT_STORE_URL')
+        if not url:
+            raise ValueError('NEWS_BODY_OBJECT_STORE_URL is not set')
+        return object_store_from_url(url)
+    raise ValueError('Unknown news body store {0}'.format(backend))
+
+
+def copy_bodies(source, destination, delete=False, batch_size=100):
+    """
+    Copies every body from one store to another, e.g. to switch backends.
+      Safe to re-run; bodies already in the destination are overwritten.
+    :param source: Store to copy from
+    :type source: BodyStore
+    :param destination: Store to copy to
+    :type destination: BodyStore
+    :param delete: Whether to remove each body from the source once copied
+    :type delete: bool
+    :param batch_size: Number of bodies to copy per transaction
+    :type batch_size: int
+    :return: Number of bodies copied
+    :rtype: int
+    """
+    keys = source.keys()
+    copied = 0
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        with util.unit_of_work(logger):
+            for post_short, language in batch:
+                destination.write(post_short, language,
+                                  source.read(post_short, language))
+                copied += 1
+        if delete:
+            with util.unit_of_work(logger):
+                for post_short, language in batch:
+                    source.delete(post_short, language)
+    logger.info('Copied {0} news bodies'.format(copied))
+    return copied
+
+
+class NewsBodyStore(BodyStore):
+    """
+    The application's body store, chosen by NEWS_BODY_STORE
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        self.backend = create_body_store(
+            app.config.get('NEWS_BODY_STORE', FILESYSTEM), app.config)
+
+    def read(self, post_short, language):
+        return self.backend.read(post_short, language)
+
+    def exists(self, post_short, language):
+        return self.backend.exists(post_short, language)
+
+    def write(self, post_short, language, body):
+        self.backend.write(post_short, language, body)
+
+    def delete(self, post_short, language):
+        self.backend.delete(post_short, language)
+
+    def keys(self):
+        return self.backend.keys()
+
+
+body_store = NewsBodyStore()
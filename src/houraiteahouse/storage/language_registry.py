@@ -0,0 +1,109 @@
+import logging
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import object_session
+from houraiteahouse.storage import models
+from houraiteahouse.storage.models import db
+
+logger = logging.getLogger(__name__)
+
+_CHANGED = 'houraiteahouse.languages_changed'
+
+LanguageInfo = namedtuple('LanguageInfo',
+                          ['id', 'language_code', 'language_name'])
+
+_Snapshot = namedtuple('_Snapshot', ['by_code', 'by_id'])
+
+
+class LanguageRegistry(object):
+    """
+    Immutable in-memory copy of the languages table, keyed by code and by
+      id.  Loaded when the app is created and replaced wholesale, never
+      mutated, whenever this process commits a change to a language.  Other
+      processes pick up changes on reload() or restart.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._snapshot = None
+        with app.app_context():
+            try:
+                self.reload()
+            except SQLAlchemyError as error:
+                # Tables may not exist yet, e.g. before the first migration
+                logger.warning('Deferring language load: {}'.format(error))
+
+    def reload(self):
+        """
+        Replaces the registry's contents with the current languages table
+        :return: Number of languages loaded
+        :rtype: int
+        """
+        languages = [LanguageInfo(*row) for row in db.session.query(
+            models.Language.id, models.Language.language_code,
+            models.Language.language_name)]
+        snapshot = _Snapshot(
+            MappingProxyType({lang.language_code: lang
+                              for lang in languages}),
+            MappingProxyType({lang.id: lang for lang in languages}))
+        with self._lock:
+            self._snapshot = snapshot
+        logger.info('Loaded {0} languages'.format(len(languages)))
+        return len(languages)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    @property
+    def _languages(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload()
+            snapshot = self._snapshot
+        return snapshot
+
+    @property
+    def by_code(self):
+        return self._languages.by_code
+
+    @property
+    def by_id(self):
+        return self._languages.by_id
+
+    def get(self, language_code):
+        return self._languages.by_code.get(language_code)
+
+    def all(self):
+        return list(self._languages.by_id.values())
+
+    def __contains__(self, language_code):
+        return language_code in self._languages.by_code
+
+
+languages = LanguageRegistry()
+
+
+@event.listens_for(models.Language, 'after_insert')
+@event.listens_for(models.Language, 'after_update')
+@event.listens_for(models.Language, 'after_delete')
+def _mark_changed(mapper, connection, target):
+    object_session(target).info[_CHANGED] = True
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _reload_if_changed(session):
+    if session.info.pop(_CHANGED, False):
+        languages.invalidate()
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop(_CHANGED, None)
@@ -1,16 +1,24 @@
+import json
 import time
 import uuid
 from datetime import datetime, timedelta
-from flask_bcrypt import Bcrypt
 from flask_cache import Cache
-from flask_sqlalchemy import SQLAlchemy
-from flask_sqlalchemy_cache import CachingQuery, FromCache
+from flask_sqlalchemy_cache import FromCache
 from sqlalchemy.orm import backref
 from werkzeug.exceptions import NotFound
-
-bcrypt = Bcrypt()
-db = SQLAlchemy(session_options={'query_cls': CachingQuery})
+from houraiteahouse.storage.query_cache import TaggedCachingQuery, \
+    track_writes
+from houraiteahouse.storage.routing import RoutingSQLAlchemy
+from houraiteahouse.util.hashing import PasswordHasher
+
+hasher = PasswordHasher()
+db = RoutingSQLAlchemy(session_options={'query_cls': TaggedCachingQuery})
+# Model.query does not use the session's query_cls, so FromCache options
+# on it would otherwise be ignored
+db.Model.query_class = TaggedCachingQuery
 cache = Cache()
+# Cached queries are invalidated whenever a table they read is committed to
+track_writes(cache)
 
 # Database model class definitions
 
@@ -28,7 +36,10 @@ tags = db.Table(
         'news_id',
         db.Integer,
         db.ForeignKey('news.id'),
-        nullable=False))
+        nullable=False),
+    # Looked up from both sides: a post's tags and a tag's posts
+    db.Index('ix_tags_news_id_tag_id', 'news_id', 'tag_id'),
+    db.Index('ix_tags_tag_id_news_id', 'tag_id', 'news_id'))
 
 
 def IdMixin(id_type=db.Integer):
@@ -96,15 +107,15 @@ class User(db.Model, HouraiTeahouseModelMixin, BaseMixin):
     def __init__(self, email, username, password, permissions):
         self.email = email
         self.username = username
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = hasher.generate_password_hash(password)
         self.permissions = permissions
         self.registered_on = datetime.utcnow()
 
     def change_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = hasher.generate_password_hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(
+        return hasher.check_password_hash(
             self.password.encode('utf-8'), password)
 
     @property
@@ -123,9 +134,9 @@ class UserSession(db.Model, HouraiTeahouseModelMixin, BaseMixin):
     session_uuid = db.Column('session_uuid', db.String(36), nullable=False,
                              unique=True)
     valid_after = db.Column(db.DateTime, nullable=False)
-    valid_before = db.Column(db.DateTime, nullable=True)
+    valid_before = db.Column(db.DateTime, nullable=True, index=True)
     user_id = db.Column('user_id', db.Integer, db.ForeignKey('htuser.id'),
-                        nullable=False)
+                        nullable=False, index=True)
     user = db.relationship('User', backref=db.backref('session',
                                                       lazy='dynamic'))
 
@@ -204,6 +215,10 @@ class UserPermissions(db.Model, HouraiTeahouseModelMixin, BaseMixin):
     def check_permission(self, permission):
         return self.is_super_user or getattr(self, permission, False)
 
+    def to_dict(self):
+        return {column.name: getattr(self, column.name)
+                for column in self.__table__.columns if column.name != 'id'}
+
     def update_permissions(self, newPermissions):
         for permType, value in newPermissions.items():
             if getattr(self, permType) != value:
@@ -226,7 +241,7 @@ class NewsPost(db.Model, HouraiTeahouseModelMixin, BaseMixin):
         db.Integer,
         db.ForeignKey('htuser.id'),
         nullable=False)
-    created = db.Column(db.DateTime, nullable=False)
+    created = db.Column(db.DateTime, nullable=False, index=True)
     author = db.relationship('User',
                              backref=db.backref('newspost', lazy='dynamic'))
     comments = db.relationship('NewsComment',
@@ -298,6 +313,10 @@ class NewsTag(db.Model, HouraiTeahouseModelMixin, BaseMixin):
 # Comments on a news post.  Many-to-one.
 class NewsComment(db.Model, HouraiTeahouseModelMixin, BaseMixin):
     __tablename__ = "newscomment"
+    # Serves a post's comments in pages, see news_storage.list_comments
+    __table_args__ = (
+        db.Index('ix_newscomment_news_id_id', 'news_id', 'id'),
+    )
 
     # Don't ask about the exact #. It's a mysql bug.
     body = db.Column(db.String(10000), nullable=False)
@@ -316,5 +335,119 @@ class NewsComment(db.Model, HouraiTeahouseModelMixin, BaseMixin):
 
     def __init__(self, body, author, news):
         self.body = body
-        self._author = author
+        self.author = author
         self.news = news
+
+
+# Denormalized per-language listing entry for a news post.  Maintained by the
+# news write paths so listings can be served without touching the other news
+# tables.
+class NewsSummary(db.Model, HouraiTeahouseModelMixin):
+    __tablename__ = "newssummary"
+    __table_args__ = (
+        db.Index('ix_newssummary_language_created',
+                 'language_id', 'created', 'news_id'),
+        db.Index('ix_newssummary_post_short_language',
+                 'post_short', 'language_id'),
+    )
+
+    news_id = db.Column(
+        db.Integer,
+        db.ForeignKey('news.id'),
+        nullable=False,
+        primary_key=True)
+    language_id = db.Column(
+        db.Integer,
+        db.ForeignKey('languages.id'),
+        nullable=False,
+        primary_key=True)
+    post_short = db.Column(db.String(64), nullable=False)
+    title = db.Column(db.String(1000), nullable=False)
+    author = db.Column(db.String(64), nullable=False)
+    # JSON encoded list of tag names
+    tag_names = db.Column(db.Text, nullable=False, default='[]')
+    media = db.Column(db.String(1024))
+    created = db.Column(db.DateTime, nullable=False)
+    lastEdit = db.Column(db.DateTime, nullable=True)
+    comment_count = db.Column(db.Integer, nullable=False, default=0)
+    # Last time anything in this summary changed
+    updated = db.Column(db.DateTime, nullable=False)
+
+    @property
+    def tags(self):
+        return json.loads(self.tag_names)
+
+    @tags.setter
+    def tags(self, names):
+        self.tag_names = json.dumps(names)
+
+    def to_dict(self):
+        summary = {
+            'author': self.author,
+            'created': str(self.created),
+            'post_id': self.post_short,
+            'tags': self.tags,
+            'title': self.title,
+            'commentCount': self.comment_count
+        }
+        if self.media:
+            summary['media'] = self.media
+        if self.lastEdit:
+            summary['lastEdit'] = str(self.lastEdit)
+        return summary
+
+    def __repr__(self):
+        return '<NewsSummary {0} {1}>'.format(self.post_short,
+                                              self.language_id)
+
+
+# Inverted index over news titles and bodies, one row per distinct term in
+# each localized post. Terms are looked up by (language_id, term), which the
+# primary key covers.
+class NewsSearchTerm(db.Model, HouraiTeahouseModelMixin):
+    __tablename__ = "newssearchterm"
+    # Reindexing a post replaces its terms
+    __table_args__ = (
+        db.Index('ix_newssearchterm_news_id_language',
+                 'news_id', 'language_id'),
+    )
+
+    language_id = db.Column(
+        db.Integer,
+        db.ForeignKey('languages.id'),
+        nullable=False,
+        primary_key=True)
+    term = db.Column(db.String(64), nullable=False, primary_key=True)
+    news_id = db.Column(
+        db.Integer,
+        db.ForeignKey('news.id'),
+        nullable=False,
+        primary_key=True)
+    # Occurrences of the term, with title occurrences counting extra
+    weight = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<NewsSearchTerm {0} {1} {2}>'.format(
+            self.term, self.news_id, self.language_id)
+
+
+# News bodies, when stored in the database rather than on disk or in an
+# object store. See body_store.DatabaseBodyStore.
+class NewsBody(db.Model, HouraiTeahouseModelMixin):
+    __tablename__ = "newsbody"
+
+    news_id = db.Column(
+        db.Integer,
+        db.ForeignKey('news.id'),
+        nullable=False,
+        primary_key=True)
+    language_id = db.Column(
+        db.Integer,
+        db.ForeignKey('languages.id'),
+        nullable=False,
+        primary_key=True)
+    # zlib compressed UTF-8 text
+    body = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return '<NewsBody {0} {1}>'.format(self.news_id, self.language_id)
@@ -1,17 +1,29 @@
 import json
 import logging
-import os
 from datetime import datetime
-from flask_sqlalchemy_cache import FromCache
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from houraiteahouse.storage import auth_storage as auth
+from houraiteahouse.storage import search_storage as search
+from houraiteahouse.storage.language_registry import languages
+from houraiteahouse.storage.static_export import static_export
 from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage import summary_storage as summaries
+from houraiteahouse.storage.translation_index import DEFAULT_LANGUAGE, \
+    language_chain, translations
+from houraiteahouse.storage.body_store import body_store
 from houraiteahouse.storage import models
 from houraiteahouse.storage.models import db, cache
+from houraiteahouse.util.metrics import timed
 from werkzeug.exceptions import Forbidden
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_LANGUAGE = 'en_US'
+DEFAULT_PAGE_SIZE = util.DEFAULT_PAGE_SIZE
+TAG_COUNTS_CACHE_KEY = 'news_tag_counts'
+# Tag counts are invalidated on write; the timeout only bounds staleness
+# should an invalidation be missed
+TAG_COUNTS_CACHE_TIMEOUT = 300
 
 
 def sanitize_body(body):
@@ -19,51 +31,293 @@ def sanitize_body(body):
 
 
 def get_language(language=DEFAULT_LANGUAGE):
-    try:
-        lang = models.Language.get(language_code=language)
-    except Exception:
+    """
+    Resolves a language code without querying the database
+    :param language: Language code to resolve
+    :type language: basestring
+    :return: The language, falling back to the default for unknown codes
+    :rtype: language_registry.LanguageInfo
+    """
+    lang = languages.get(language)
+    if lang is None and language != DEFAULT_LANGUAGE:
         logger.warning('Unrecognized language code {}'.format(language))
-        lang = models.Language.get(language_code=DEFAULT_LANGUAGE)
+        lang = languages.get(DEFAULT_LANGUAGE)
     return lang
 
 
-def list_news(language=DEFAULT_LANGUAGE):
-    news = models.NewsPost.query.order_by(models.NewsPost.created.desc()) \
-        .options(FromCache(cache)).all()
-    if news is None:
-        return None
-    return [news_to_dict(post, language=language) for post in news]
+def news_body_language(postId, language=DEFAULT_LANGUAGE):
+    """
+    :param postId: Short title of the post
+    :type postId: basestring
+    :param language: Language the post is being read in
+    :type language: basestring
+    :return: The language the post's body is served in: the first language
+      in the requested language's chain it has a body in. Should there be
+      none, the requested language, which reading fails as it always has.
+    :rtype: basestring
+    """
+    return translations.body_language(postId, language_chain(language)) or \
+        language
+
+
+@util.read_only
+def list_news(language=DEFAULT_LANGUAGE, cursor=None,
+              limit=DEFAULT_PAGE_SIZE):
+    lang = get_language(language)
+    if lang is None:
+        return {'news': [], 'next': None}
+    return summaries.list_summaries(lang, cursor, limit)
 
 
-def open_news_file(postId, language=DEFAULT_LANGUAGE, filemode='r'):
-    post_path = os.path.join('/var/htwebsite/news/', language, postId)
-    return open(post_path, filemode)
+@util.read_only
+def list_news_version(language=DEFAULT_LANGUAGE):
+    lang = get_language(language)
+    if lang is None:
+        return None, 0
+    return summaries.listing_version(lang)
 
 
-def tagged_news(tag, language=DEFAULT_LANGUAGE):
+@util.read_only
+def tagged_news_version(tag, language=DEFAULT_LANGUAGE):
+    tag = models.NewsTag.get(name=tag)
+    lang = get_language(language)
+    if tag is None or lang is None:
+        return None, 0
+    return summaries.listing_version(lang, tag)
+
+
+@util.read_only
+def news_version(postId, language=DEFAULT_LANGUAGE):
+    """
+    Fetches the last time the given post, including its comments, changed
+    :param postId: Short title of the post
+    :type postId: basestring
+    :param language: Language the post is being read in
+    :type language: basestring
+    :return: Last update time, or None if it cannot be determined
+    :rtype: datetime
+    """
+    lang = get_language(language)
+    if lang is None:
+        return None
+    return summaries.summary_version(postId, lang)
+
+
+def read_news_body(postId, language=DEFAULT_LANGUAGE):
+    with timed('news_io'):
+        return body_store.read(postId, language)
+
+
+def write_news_body(postId, language, body):
+    with timed('news_io'):
+        body_store.write(postId, language, body)
+
+
+@util.read_only
+def tag_counts():
+    """
+    Fetches every tag along with the number of posts carrying it
+    :return: Tag names and post counts, ordered by name
+    :rtype: list
+    """
+    counts = cache.get(TAG_COUNTS_CACHE_KEY)
+    if counts is None:
+        rows = db.session.query(models.NewsTag.name,
+                                func.count(models.tags.c.news_id)) \
+            .outerjoin(models.tags,
+                       models.tags.c.tag_id == models.NewsTag.id) \
+            .group_by(models.NewsTag.id, models.NewsTag.name) \
+            .order_by(models.NewsTag.name)
+        counts = [{'name': name, 'count': count} for name, count in rows]
+        if not util.reading_from_replica():
+            cache.set(TAG_COUNTS_CACHE_KEY, counts,
+                      timeout=TAG_COUNTS_CACHE_TIMEOUT)
+    return counts
+
+
+def invalidate_tag_counts():
+    """
+    Drops the cached tag counts once the current transaction commits.  Must
+      be called by anything adding or removing posts or changing their tags.
+    """
+    util.on_commit(lambda: cache.delete(TAG_COUNTS_CACHE_KEY))
+
+
+@util.read_only
+def tagged_news(tag, language=DEFAULT_LANGUAGE, cursor=None,
+                limit=DEFAULT_PAGE_SIZE):
     tag = models.NewsTag.get(name=tag)
-    if tag is None or tag.news is None:
+    if tag is None:
         return None
-    return [news_to_dict(post, language=language) for post in tag.news]
+    lang = get_language(language)
+    if lang is None:
+        return {'news': [], 'next': None}
+    return summaries.tagged_summaries(tag, lang, cursor, limit)
+
+
+@util.read_only
+def search_news(query, language=DEFAULT_LANGUAGE, limit=DEFAULT_PAGE_SIZE):
+    """
+    Searches the titles and bodies of news posts in the given language
+    :param query: Free text query
+    :type query: basestring
+    :param language: Language to search in
+    :type language: basestring
+    :param limit: Maximum number of results
+    :type limit: int
+    :return: News summaries with their score and a snippet of the body, best
+      match first
+    :rtype: list
+    """
+    lang = get_language(language)
+    if lang is None:
+        return []
+    limit = max(1, min(limit, util.MAX_PAGE_SIZE))
+    ranked = search.search(query, lang, limit)
+    summaries = {summary.news_id: summary
+                 for summary in models.NewsSummary.query.filter(
+                     models.NewsSummary.language_id == lang.id,
+                     models.NewsSummary.news_id.in_(
+                         [news_id for news_id, _ in ranked]))}
+    results = []
+    for news_id, score in ranked:
+        summary = summaries.get(news_id)
+        if summary is None:
+            continue
+        result = summary.to_dict()
+        result['score'] = round(score, 4)
+        body_language = news_body_language(summary.post_short,
+                                           lang.language_code)
+        try:
+            body = read_news_body(summary.post_short, body_language)
+            result['snippet'] = search.make_snippet(body, query)
+        except IOError:
+            logger.warning('Missing body for news post {0}'
+                           .format(summary.post_short))
+        results.append(result)
+    return results
+
+
+def rebuild_search_index(batch_size=100):
+    """
+    Reindexes every localized post from the bodies stored on disk
+    :param batch_size: Number of localized posts to index per transaction
+    :type batch_size: int
+    :return: Number of localized posts indexed
+    :rtype: int
+    """
+    rows = db.session.query(models.NewsPost.id, models.NewsPost.post_short,
+                            models.NewsTitle.language_id,
+                            models.NewsTitle.localized_title,
+                            models.Language.language_code) \
+        .join(models.NewsTitle, models.NewsTitle.id == models.NewsPost.id) \
+        .join(models.Language,
+              models.Language.id == models.NewsTitle.language_id) \
+        .order_by(models.NewsPost.id) \
+        .all()
+    indexed = 0
+    for start in range(0, len(rows), batch_size):
+        with util.unit_of_work(logger):
+            for news_id, post_short, language_id, title, code in \
+                    rows[start:start + batch_size]:
+                try:
+                    body = read_news_body(post_short, code)
+                except IOError:
+                    logger.warning('Missing body for news post {0} in {1}'
+                                   .format(post_short, code))
+                    continue
+                search.index_post(news_id, language_id, title, body)
+                indexed += 1
+    logger.info('Indexed {0} localized news posts'.format(indexed))
+    return indexed
+
+
+def export_views(news_id):
+    """
+    Queues the re-export, in every language, of the static responses a post
+      appears in: the post itself, the first page of the listing and the
+      first page of each of its tags.  All of them show the post's comment
+      count, so comments refresh them too.
+    :param news_id: ID of the post
+    :type news_id: int
+    """
+    if static_export.enabled:
+        static_export.submit(('post', news_id),
+                             lambda: _export_post_views(news_id))
+
+
+def _export_post_views(news_id):
+    post = models.NewsPost.query.get(news_id)
+    if post is None:
+        return
+    tag_names = [tag.name for tag in post.tags]
+    for lang in languages.all():
+        code = lang.language_code
+        _export('/news', code, lambda: list_news(code))
+        _export('/news/' + post.post_short, code,
+                lambda: get_news(post.post_short, None, code))
+        for name in tag_names:
+            _export('/news/tag/' + name, code,
+                    lambda: tagged_news(name, code))
+
+
+def export_all_views():
+    """
+    Exports every static response from scratch
+    :return: Number of responses exported
+    :rtype: int
+    """
+    if not static_export.enabled:
+        return 0
+    posts = db.session.query(models.NewsPost.post_short).all()
+    tag_names = [name for name, in db.session.query(models.NewsTag.name)]
+    exported = 0
+    for lang in languages.all():
+        code = lang.language_code
+        exported += _export('/news', code, lambda: list_news(code))
+        for post_short, in posts:
+            exported += _export('/news/' + post_short, code,
+                                lambda: get_news(post_short, None, code))
+        for name in tag_names:
+            exported += _export('/news/tag/' + name, code,
+                                lambda: tagged_news(name, code))
+    logger.info('Exported {0} static news views'.format(exported))
+    return exported
+
+
+def _export(uri, language, render):
+    return static_export.export(uri, language,
+                                lambda: json.dumps(render()))
+
+
+def _export_on_commit(news_id):
+    util.on_commit(lambda: export_views(news_id))
 
 
 # "postId" is a misnomer, it's actually the short title
 # (ie, [date]-shortened-title)
-def get_news(postId, session_id, language=DEFAULT_LANGUAGE):
+@util.read_only
+def get_news(postId, session_id, language=DEFAULT_LANGUAGE,
+             include_comments=True):
     news = models.NewsPost.get_or_die(post_short=postId)
     caller = None
     if session_id:
         caller = auth.get_user_session(session_id).user
 
-    ret = news_to_dict(news, caller, language)
+    ret = news_to_dict(news, caller, language, include_comments)
+    if not include_comments:
+        lang = get_language(language)
+        ret['commentCount'] = summaries.comment_count(news.id, lang) \
+            if lang is not None else 0
 
-    # TODO(james7132): Make this configurable
-    with open_news_file(postId, language=language) as news_file:
-        ret['body'] = news_file.read()
+    body_language = news_body_language(postId, language)
+    ret['body'] = read_news_body(postId, body_language)
+    ret['bodyLanguage'] = body_language
 
     return ret
 
 
+@util.transactional
 def post_news(title, body, tags, session_id, media=None,
               language=DEFAULT_LANGUAGE):
     lang = get_language(language)
@@ -78,17 +332,24 @@ def post_news(title, body, tags, session_id, media=None,
 
     created = datetime.utcnow()
     shortTitle = readDate(created) + '-' + title.replace(' ', '-')[:53]
-    with open_news_file(shortTitle, language, filemode='w') as news_file:
-        news_file.write(body)
-
     news = models.NewsPost(shortTitle, title, created, author, tagObjs, media)
 
-    postTitle = models.NewsTitle(news, lang, title)
-
-    util.try_add(news=news, logger=logger)
+    postTitle = models.NewsTitle(news, models.Language.query.get(lang.id),
+                                 title)
+
+    db.session.add(news)
+    db.session.flush()
+    # Database backed bodies refer to the post, so it must be flushed first
+    write_news_body(shortTitle, language, body)
+    summaries.refresh_summaries([news.id])
+    search.index_post(news.id, lang.id, title, body)
+    invalidate_tag_counts()
+    util.on_commit(lambda: translations.add(shortTitle, language))
+    _export_on_commit(news.id)
     return get_news(shortTitle, session_id, language)
 
 
+@util.transactional
 def edit_news(post_id, title, body, session_id, media,
               language=DEFAULT_LANGUAGE):
     news = models.NewsPost.get_or_die(post_short=post_id)
@@ -98,20 +359,27 @@ def edit_news(post_id, title, body, session_id, media,
 
     body = sanitize_body(body)
 
-    with open_news_file(news.post_short, language, filemode='w') as news_file:
-        news_file.write(body)
+    write_news_body(news.post_short, language, body)
 
     news.title = title
     news.media = media
     news.lastEdit = datetime.utcnow()
 
     ret = news_to_dict(news, caller)
-
-    util.try_merge(news=news, logger=logger)
+    summaries.refresh_summaries([news.id])
+    lang = get_language(language)
+    if lang is not None:
+        localized = models.NewsTitle.get(id=news.id, language_id=lang.id)
+        search.index_post(news.id, lang.id,
+                          localized.get_title() if localized else title, body)
+    util.on_commit(lambda: translations.add(news.post_short, language,
+                                            title=False))
+    _export_on_commit(news.id)
     ret['body'] = body
     return ret
 
 
+@util.transactional
 def translate_news(post_id, language, title, body):
     news = models.NewsPost.get_or_die(post_short=post_id)
     lang = get_language(language)
@@ -120,16 +388,22 @@ def translate_news(post_id, language, title, body):
 
     body = sanitize_body(body)
 
-    with open_news_file(news.post_short, language, filemode='w') as news_file:
-        news_file.write(body)
+    write_news_body(news.post_short, language, body)
 
     ret = False
-    title = models.NewsTitle.get(news=news, language=lang)
-    if not title:
-        title = models.NewsTitle(news, lang, title)
+    localized = models.NewsTitle.get(id=news.id, language_id=lang.id)
+    if localized:
+        localized.localized_title = title
+    else:
+        localized = models.NewsTitle(
+            news, models.Language.query.get(lang.id), title)
+        db.session.add(localized)
         ret = True
 
-    util.try_add(title=title, logger=logger)
+    summaries.refresh_summaries([news.id])
+    search.index_post(news.id, lang.id, title, body)
+    util.on_commit(lambda: translations.add(news.post_short, language))
+    _export_on_commit(news.id)
     return ret
 
 
@@ -138,13 +412,14 @@ def get_tag(name):
     return tag or create_tag(name)
 
 
+@util.transactional
 def create_tag(name):
     tag = models.NewsTag(name)
-    util.try_add(tag=tag, logger=logger)
-    # It won't be in the cache yet, so we must actually load it.
+    db.session.add(tag)
     return tag
 
 
+@util.transactional
 def post_comment(post_id, body, session_id):
     news = models.NewsPost.get_or_die(post_short=post_id)
     author = auth.get_user_session(session_id).user
@@ -155,10 +430,45 @@ def post_comment(post_id, body, session_id):
     body = sanitize_body(body)
 
     comment = models.NewsComment(body, author, news)
-    util.try_add(comment=comment, logger=logger)
+    db.session.add(comment)
+    summaries.refresh_summaries([news.id])
+    _export_on_commit(news.id)
     return ret
 
 
+@util.read_only
+def list_comments(post_id, session_id=None, cursor=None,
+                  limit=DEFAULT_PAGE_SIZE):
+    """
+    Pages through a post's comments, oldest first
+    :param post_id: Short title of the post
+    :type post_id: basestring
+    :param session_id: Session of the caller, if any, to flag their comments
+    :type session_id: basestring
+    :param cursor: Cursor returned with the previous page, if any
+    :type cursor: basestring
+    :param limit: Maximum number of comments to return
+    :type limit: int
+    :return: The page of comments and the cursor for the next page
+    :rtype: dict
+    """
+    news = models.NewsPost.get_or_die(post_short=post_id)
+    caller = None
+    if session_id:
+        caller = auth.get_user_session(session_id).user
+    comments, next_cursor = util.paginate_by_id(
+        models.NewsComment.query
+        .options(joinedload(models.NewsComment.author))
+        .filter(models.NewsComment.news_id == news.id),
+        models.NewsComment.id, cursor, limit)
+    return {
+        'comments': [comment_to_dict(comment, caller)
+                     for comment in comments],
+        'next': next_cursor
+    }
+
+
+@util.transactional
 def edit_comment(comment_id, body, session_id):
     comment = models.NewsComment.get_or_die(id=comment_id)
     caller = auth.get_user_session(session_id).user
@@ -166,52 +476,123 @@ def edit_comment(comment_id, body, session_id):
         raise Forbidden
 
     comment.body = sanitize_body(body)
-    util.try_merge(comment=comment, logger=logger)
+    # Moves the post's version on, so cached pages of comments are refreshed
+    summaries.refresh_summaries([comment.news_id])
+    _export_on_commit(comment.news_id)
 
 
+@util.transactional
 def delete_comment(comment_id, session_id):
     comment = models.NewsComment.get_or_die(id=comment_id)
     caller = auth.get_user_session(session_id).user
-    if caller != comment.get_author and not (
-            caller.get_permissions().admin or caller.get_permissions().master):
+    if caller != comment.author and not caller.permissions.is_super_user:
         raise Forbidden
 
-    util.try_delete(comment=comment, logger=logger)
+    news_id = comment.news_id
+    db.session.delete(comment)
+    summaries.refresh_summaries([news_id])
+    _export_on_commit(news_id)
     return True
 
 
-def news_to_dict(news, caller=None, language=DEFAULT_LANGUAGE):
-    lang = get_language(language)
-    newsDict = {
-        'author': news.author.username,
-        'isAuthor': caller and caller == news.get_author(),
-        'created': str(news.created),
-        'post_id': news.post_short,
-        'tags': [tag.name for tag in news.tags]
-    }
-
-    title = models.NewsTitle.get(id=news.id, language_id=lang.id)
-    newsDict['title'] = title.get_title() or news.title
-
-    if news.media:
-        newsDict['media'] = news.media
+def news_to_dict(news, caller=None, language=DEFAULT_LANGUAGE,
+                 include_comments=True):
+    return news_page_to_dicts([news], caller, language, include_comments)[0]
+
+
+def news_page_to_dicts(posts, caller=None, language=DEFAULT_LANGUAGE,
+                       include_comments=True):
+    """
+    Serializes a page of news posts.  Authors, tags, localized titles and
+    comments are fetched for the whole page at once, so the number of queries
+    issued does not depend on the number of posts.
+    :param posts: The posts to serialize
+    :type posts: list
+    :param caller: The user making the request, if any
+    :type caller: models.User
+    :param language: Language code to localize titles into
+    :type language: basestring
+    :param include_comments: Whether to embed every comment of each post.
+      Comments can instead be paged through with list_comments.
+    :type include_comments: Boolean
+    :return: One dict per post, in the same order as posts
+    :rtype: list
+    """
+    if not posts:
+        return []
+    post_ids = [post.id for post in posts]
+    caller_id = caller.id if caller else None
+
+    authors = {user.id: user.username for user in models.User.query.filter(
+        models.User.id.in_({post.author_id for post in posts}))}
+
+    post_tags = {post_id: [] for post_id in post_ids}
+    tag_rows = db.session.query(models.tags.c.news_id, models.NewsTag.name) \
+        .join(models.NewsTag, models.NewsTag.id == models.tags.c.tag_id) \
+        .filter(models.tags.c.news_id.in_(post_ids)) \
+        .order_by(models.NewsTag.name)
+    for post_id, name in tag_rows:
+        post_tags[post_id].append(name)
+
+    # Titles are localized into the first language of the fallback chain
+    # each post has been translated into
+    ranks = {}
+    for code in language_chain(language):
+        lang = languages.get(code)
+        if lang is not None:
+            ranks.setdefault(lang.id, len(ranks))
+    titles = {}
+    if ranks:
+        best = {}
+        for title in models.NewsTitle.query.filter(
+                models.NewsTitle.id.in_(post_ids),
+                models.NewsTitle.language_id.in_(list(ranks))):
+            rank = ranks[title.language_id]
+            if title.id not in best or rank < best[title.id][0]:
+                best[title.id] = (rank, title.get_title())
+        titles = {post_id: title for post_id, (_, title) in best.items()}
+
+    post_comments = {post_id: [] for post_id in post_ids}
+    if include_comments:
+        comments = models.NewsComment.query \
+            .options(joinedload(models.NewsComment.author)) \
+            .filter(models.NewsComment.news_id.in_(post_ids)) \
+            .order_by(models.NewsComment.id)
+        for comment in comments:
+            post_comments[comment.news_id].append(
+                comment_to_dict(comment, caller))
+
+    ret = []
+    for post in posts:
+        newsDict = {
+            'author': authors.get(post.author_id),
+            'isAuthor': caller_id is not None and caller_id == post.author_id,
+            'created': str(post.created),
+            'post_id': post.post_short,
+            'tags': post_tags[post.id],
+            'title': titles.get(post.id) or post.title
+        }
+
+        if post.media:
+            newsDict['media'] = post.media
+
+        if post_comments[post.id]:
+            newsDict['comments'] = post_comments[post.id]
+
+        if post.lastEdit:
+            newsDict['lastEdit'] = str(post.lastEdit)
+
+        ret.append(newsDict)
 
-    if news.comments:
-        newsDict['comments'] = [comment_to_dict(comment, caller)
-                                for comment in news.comments]
-
-    if news.lastEdit:
-        newsDict['lastEdit'] = str(news.lastEdit)
-
-    return newsDict
+    return ret
 
 
 def comment_to_dict(comment, caller=None):
     return {
-        'id': comment.comment_id,
-        'author': comment.get_author() .get_username(),
+        'id': comment.id,
+        'author': comment.author.username,
         'body': comment.body,
-        'isAuthor': caller and caller == comment.get_author()
+        'isAuthor': caller is not None and caller.id == comment.author_id
     }
 
 
@@ -0,0 +1,269 @@
+import pickle
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from flask_cache import Cache
+from flask_sqlalchemy import BaseQuery, SignallingSession
+from flask_sqlalchemy_cache import CachingQuery
+from sqlalchemy import event, inspect
+from sqlalchemy.sql.util import find_tables
+from houraiteahouse.storage.routing import RoutingSession
+from houraiteahouse.util.metrics import registry
+
+_CHANGED_TABLES = 'houraiteahouse.changed_tables'
+TAG_PREFIX = 'table-generation:'
+DEFAULT_BACKEND = 'default'
+DEFAULT_FAMILY = 'default'
+# Keys remembered per process to tell evicted entries from never-cached ones
+MAX_TRACKED_KEYS = 10000
+
+cache_hits = registry.counter(
+    'query_cache_hits_total', 'Cached query results served from the cache')
+cache_misses = registry.counter(
+    'query_cache_misses_total', 'Cached queries that had to hit the database')
+cache_evictions = registry.counter(
+    'query_cache_evictions_total',
+    'Query results stored by this process that had expired or been evicted '
+    'by the time they were next read')
+cache_bytes = registry.counter(
+    'query_cache_stored_bytes_total',
+    'Serialized bytes of query results written to the cache')
+
+Policy = namedtuple('Policy', ['enabled', 'timeout', 'backend'])
+
+
+def table_generations(flask_cache, tables):
+    """
+    Fetches the current generation of each table.  A table without one is
+      given a fresh generation, so entries cached under a generation which
+      has since been evicted can never be served again.
+    :param flask_cache: Cache holding the generations
+    :type flask_cache: flask_cache.Cache
+    :param tables: Names of the tables
+    :type tables: list
+    :return: One generation per table, in the same order
+    :rtype: list
+    """
+    keys = [TAG_PREFIX + table for table in tables]
+    generations = list(flask_cache.get_many(*keys)) if keys else []
+    for index, generation in enumerate(generations):
+        if generation is None:
+            generation = uuid.uuid4().hex
+            flask_cache.add(keys[index], generation, timeout=0)
+            generations[index] = flask_cache.get(keys[index]) or generation
+    return generations
+
+
+def bump_generations(flask_cache, tables):
+    """
+    Invalidates every cached query reading from any of the given tables
+    :param flask_cache: Cache holding the generations
+    :type flask_cache: flask_cache.Cache
+    :param tables: Names of the changed tables
+    :type tables: iterable
+    """
+    flask_cache.set_many({TAG_PREFIX + table: uuid.uuid4().hex
+                          for table in tables}, timeout=0)
+
+
+class QueryCachePolicy(object):
+    """
+    Decides, per query family, whether results are cached, for how long and
+      in which backend, and counts how each family uses the cache.  A
+      query's family is the table of the model it loads.  Policies come from
+      CACHE_POLICIES, a dict of family to any of 'enabled', 'timeout' and
+      'backend', with the 'default' entry applying to every family.
+      Backends other than the default cache are configured in
+      CACHE_BACKENDS, a dict of name to Flask-Cache settings.
+    """
+
+    def __init__(self):
+        self._policies = {}
+        self._backends = {}
+        self._resolved = {}
+        self._stored = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._policies = dict(app.config.get('CACHE_POLICIES') or {})
+        for name, config in (app.config.get('CACHE_BACKENDS') or {}).items():
+            backend = self._backends.setdefault(name, Cache())
+            backend.init_app(app, config=dict(config))
+        self._resolved = {}
+        self.clear_stats()
+
+    def policy(self, family):
+        """
+        :param family: Query family, the name of the table queried
+        :type family: basestring
+        :return: How results of the family are cached
+        :rtype: Policy
+        """
+        policy = self._resolved.get(family)
+        if policy is None:
+            settings = dict(self._policies.get(DEFAULT_FAMILY, {}))
+            settings.update(self._policies.get(family, {}))
+            policy = self._resolved[family] = Policy(
+                settings.get('enabled', True), settings.get('timeout'),
+                settings.get('backend', DEFAULT_BACKEND))
+        return policy
+
+    def backend(self, policy, default):
+        return self._backends.get(policy.backend, default)
+
+    def record_hit(self, family):
+        cache_hits.inc()
+        with self._lock:
+            self._family_stats(family)['hits'] += 1
+
+    def record_miss(self, family, key):
+        cache_misses.inc()
+        with self._lock:
+            stats = self._family_stats(family)
+            stats['misses'] += 1
+            if self._stored.pop(key, None) is not None:
+                stats['evictions'] += 1
+                cache_evictions.inc()
+
+    def record_store(self, family, key, size):
+        cache_bytes.inc(size)
+        with self._lock:
+            self._family_stats(family)['bytes'] += size
+            self._stored[key] = True
+            while len(self._stored) > MAX_TRACKED_KEYS:
+                self._stored.popitem(last=False)
+
+    def stats(self):
+        """
+        :return: Hits, misses, evictions and bytes stored per query family
+        :rtype: dict
+        """
+        with self._lock:
+            return {family: dict(stats)
+                    for family, stats in self._stats.items()}
+
+    def clear_stats(self):
+        with self._lock:
+            self._stats.clear()
+            self._stored.clear()
+
+    def _family_stats(self, family):
+        stats = self._stats.get(family)
+        if stats is None:
+            stats = self._stats[family] = {
+                'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+        return stats
+
+
+cache_policy = QueryCachePolicy()
+
+
+class TaggedCachingQuery(CachingQuery):
+    """
+    CachingQuery whose cache keys are tagged with the generation of every
+      table the query reads.  Committing a change to a table moves it to a
+      new generation, which orphans every cached result built from it, so
+      results can be cached for long periods without being served stale.
+      Queries reading tables the session has uncommitted changes to bypass
+      the cache, so a transaction always sees its own writes.  Queries
+      routed to a read replica may use results cached from the primary, but
+      never cache their own: a lagging replica's results would otherwise be
+      served as current for the rest of the generation.
+    """
+
+    def __iter__(self):
+        if not hasattr(self, '_cache'):
+            return BaseQuery.__iter__(self)
+        family = self._cache_family()
+        policy = cache_policy.policy(family)
+        tables = self._read_tables()
+        if not policy.enabled or not tables.isdisjoint(
+                _pending_tables(self.session)):
+            return BaseQuery.__iter__(self)
+        store = not (isinstance(self.session, RoutingSession) and
+                     self.session.routes_to_replica())
+        return iter(self._cached_results(family, policy, tables, store))
+
+    def key_from_query(self, qualifier=None, tables=None):
+        key = CachingQuery.key_from_query(self, qualifier)
+        if tables is None:
+            tables = self._read_tables()
+        generations = table_generations(self._cache.cache, sorted(tables))
+        return '{0}:{1}'.format(key, ':'.join(generations))
+
+    def _cached_results(self, family, policy, tables, store=True):
+        flask_cache = cache_policy.backend(policy, self._cache.cache)
+        key = self.key_from_query(tables=tables)
+        results = flask_cache.get(key)
+        if results is not None:
+            cache_policy.record_hit(family)
+            return self.merge_result(results, load=False)
+        cache_policy.record_miss(family, key)
+        results = list(BaseQuery.__iter__(self))
+        if not store:
+            return results
+        cache_policy.record_store(
+            family, key,
+            len(pickle.dumps(results, pickle.HIGHEST_PROTOCOL)))
+        flask_cache.set(key, results, timeout=policy.timeout)
+        return results
+
+    def _cache_family(self):
+        entity = self.column_descriptions[0].get('entity')
+        table = getattr(entity, '__table__', None)
+        return table.name if table is not None else DEFAULT_FAMILY
+
+    def _read_tables(self):
+        return {table.name for table in find_tables(self.statement)}
+
+
+def _changed_tables(session):
+    return session.info.setdefault(_CHANGED_TABLES, set())
+
+
+def _mapped_tables(instance):
+    mapper = inspect(instance).mapper
+    tables = {table.name for table in mapper.tables}
+    # Many-to-many rows are written as part of flushing either side
+    tables.update(prop.secondary.name for prop in mapper.relationships
+                  if prop.secondary is not None)
+    return tables
+
+
+def _pending_tables(session):
+    tables = set(session.info.get(_CHANGED_TABLES, ()))
+    for instance in session.new | session.dirty | session.deleted:
+        tables.update(_mapped_tables(instance))
+    return tables
+
+
+def track_writes(flask_cache):
+    """
+    Bumps the generation of every table written to by a session once the
+      session commits.  Covers ORM flushes and bulk query updates and
+      deletes; statements executed directly on a connection are not seen.
+    :param flask_cache: Cache holding the generations
+    :type flask_cache: flask_cache.Cache
+    """
+
+    @event.listens_for(SignallingSession, 'after_flush')
+    def record_flush(session, flush_context):
+        changed = _changed_tables(session)
+        for instance in session.new | session.dirty | session.deleted:
+            changed.update(_mapped_tables(instance))
+
+    @event.listens_for(SignallingSession, 'after_bulk_update')
+    @event.listens_for(SignallingSession, 'after_bulk_delete')
+    def record_bulk(context):
+        _changed_tables(context.session).add(context.primary_table.name)
+
+    @event.listens_for(SignallingSession, 'after_commit')
+    def invalidate(session):
+        changed = session.info.pop(_CHANGED_TABLES, None)
+        if changed:
+            bump_generations(flask_cache, changed)
+
+    @event.listens_for(SignallingSession, 'after_soft_rollback')
+    def discard(session, previous_transaction):
+        session.info.pop(_CHANGED_TABLES, None)
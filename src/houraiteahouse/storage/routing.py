@@ -0,0 +1,162 @@
+import logging
+import random
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, \
+    _EngineConnector, _EngineDebuggingSignalEvents, _record_queries
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Session.info keys
+READ_REPLICA = 'houraiteahouse.read_replica'
+PIN_PRIMARY = 'houraiteahouse.pin_primary'
+_REPLICA_BIND = 'houraiteahouse.replica_bind'
+
+PRIMARY_BIND = 'primary'
+DEFAULT_BIND = 'default'
+# Engine options which may be set per bind in SQLALCHEMY_ENGINE_OPTIONS
+ENGINE_OPTIONS = ('pool_size', 'max_overflow', 'pool_recycle',
+                  'pool_timeout', 'pre_ping')
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending reads made within storage_util.replica_reads to one of
+      the SQLALCHEMY_READ_BINDS.  Everything else goes to the primary.  Once
+      a session has written, or entered a unit of work, it is pinned to the
+      primary until it is removed at the end of the request, so a request
+      always reads its own writes.  A session sticks to one replica, so its
+      reads are consistent with each other.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and self.routes_to_replica():
+            return self._replica()
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def routes_to_replica(self):
+        """
+        :return: Whether reads are currently sent to a replica
+        :rtype: Boolean
+        """
+        return bool(self.info.get(READ_REPLICA)) and \
+            not self.info.get(PIN_PRIMARY) and self._replica() is not None
+
+    def _replica(self):
+        if _REPLICA_BIND not in self.info:
+            read_binds = self.app.config.get('SQLALCHEMY_READ_BINDS') or ()
+            self.info[_REPLICA_BIND] = random.choice(read_binds) \
+                if read_binds else None
+        bind = self.info[_REPLICA_BIND]
+        if bind is None:
+            return None
+        return self.db.get_engine(self.app, bind)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _pin_after_flush(session, flush_context):
+    session.info[PIN_PRIMARY] = True
+
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def _pin_after_bulk(context):
+    context.session.info[PIN_PRIMARY] = True
+
+
+class _BindConnector(_EngineConnector):
+    """
+    Engine connector applying the engine options configured for its bind
+    """
+
+    def get_engine(self):
+        with self._lock:
+            uri = self.get_uri()
+            echo = self._app.config['SQLALCHEMY_ECHO']
+            if (uri, echo) == self._connected_for:
+                return self._engine
+            bind_options = self._sa.bind_options(self._app, self._bind)
+            info = make_url(uri)
+            options = {'convert_unicode': True}
+            self._sa.apply_pool_defaults(self._app, options)
+            options.update((key, value) for key, value
+                           in bind_options.items() if key != 'pre_ping')
+            self._sa.apply_driver_hacks(self._app, info, options)
+            if echo:
+                options['echo'] = True
+            engine = create_engine(info, **options)
+            if _record_queries(self._app):
+                _EngineDebuggingSignalEvents(
+                    engine, self._app.import_name).register()
+            if bind_options.get('pre_ping'):
+                event.listen(engine, 'engine_connect', _ping)
+            self._engine = engine
+            self._connected_for = (uri, echo)
+            return engine
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy integration creating RoutingSessions, and engines configured
+      per bind by SQLALCHEMY_ENGINE_OPTIONS.  It is a dict of bind name to
+      any of pool_size, max_overflow, pool_recycle, pool_timeout and
+      pre_ping.  The 'default' entry applies to every bind and
+      SQLALCHEMY_DATABASE_URI is named 'primary'.
+    """
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def make_connector(self, app, bind=None):
+        return _BindConnector(self, app, bind)
+
+    def bind_options(self, app, bind):
+        """
+        :param app: Application the engine belongs to
+        :type app: flask.Flask
+        :param bind: Name of the bind, None for the primary database
+        :type bind: basestring
+        :return: Engine options configured for the bind
+        :rtype: dict
+        """
+        configured = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+        options = dict(configured.get(DEFAULT_BIND, {}))
+        options.update(configured.get(bind or PRIMARY_BIND, {}))
+        unknown = set(options) - set(ENGINE_OPTIONS)
+        if unknown:
+            raise ValueError('Unknown engine options for bind {0}: {1}'
+                             .format(bind or PRIMARY_BIND, sorted(unknown)))
+        return options
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        # SQLite files default to no pooling, which takes no pool settings
+        if 'poolclass' not in options and \
+                ('pool_size' in options or 'max_overflow' in options):
+            options['poolclass'] = QueuePool
+
+
+def _ping(connection, branch):
+    """
+    Tests connections as they are checked out of the pool, replacing those
+      the database has since closed, so requests don't fail on connections
+      dropped during a failover or an idle timeout
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as error:
+        if not error.connection_invalidated:
+            raise
+        logger.warning('Replacing stale database connection')
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter
+from sqlalchemy import func
+from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage import models
+from houraiteahouse.storage.models import db, cache
+
+# A title occurrence is worth this many body occurrences when ranking
+TITLE_WEIGHT = 5
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 10
+SNIPPET_LENGTH = 160
+# Number of posts indexed in a language, cached per language id as the
+# document count every search weighs term rarity against
+INDEXED_POSTS_CACHE_KEY = 'news_search_indexed_posts/{0}'
+INDEXED_POSTS_CACHE_TIMEOUT = 300
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'with'
+])
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def strip_markup(text):
+    return ' '.join(_TAG_RE.sub(' ', text).split())
+
+
+def tokenize(text):
+    """
+    Splits text into normalized search terms, dropping markup and stop words
+    :param text: Text to tokenize
+    :type text: basestring
+    :return: Terms in the order they appear
+    :rtype: list
+    """
+    return [word[:MAX_TERM_LENGTH]
+            for word in _WORD_RE.findall(strip_markup(text).lower())
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+@util.transactional
+def index_post(news_id, language_id, title, body):
+    """
+    Replaces the indexed terms of a post in a single language
+    :param news_id: ID of the post
+    :type news_id: int
+    :param language_id: ID of the language the title and body are in
+    :type language_id: int
+    :param title: Localized title of the post
+    :type title: basestring
+    :param body: Localized body of the post
+    :type body: basestring
+    """
+    replaced = models.NewsSearchTerm.query \
+        .filter_by(news_id=news_id, language_id=language_id) \
+        .delete(synchronize_session=False)
+    if not replaced:
+        # First time the post is indexed in this language
+        key = INDEXED_POSTS_CACHE_KEY.format(language_id)
+        util.on_commit(lambda: cache.delete(key))
+    weights = Counter(tokenize(body))
+    for term in tokenize(title):
+        weights[term] += TITLE_WEIGHT
+    db.session.add_all([
+        models.NewsSearchTerm(language_id=language_id, term=term,
+                              news_id=news_id, weight=weight)
+        for term, weight in weights.items()])
+
+
+def search(query, lang, limit):
+    """
+    Ranks the posts in a language against a query.  Each matching term adds
+      its weight in the post scaled by how rare the term is, so posts
+      matching more, and rarer, terms rank first.
+    :param query: Free text query
+    :type query: basestring
+    :param lang: Language to search in
+    :type lang: language_registry.LanguageInfo
+    :param limit: Maximum number of results
+    :type limit: int
+    :return: (news_id, score) pairs, best match first
+    :rtype: list
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    rows = db.session.query(models.NewsSearchTerm.news_id,
+                            models.NewsSearchTerm.term,
+                            models.NewsSearchTerm.weight) \
+        .filter(models.NewsSearchTerm.language_id == lang.id,
+                models.NewsSearchTerm.term.in_(terms)) \
+        .all()
+    if not rows:
+        return []
+    indexed = indexed_posts(lang.id)
+    frequency = Counter(term for _, term, _ in rows)
+    scores = Counter()
+    for news_id, term, weight in rows:
+        scores[news_id] += weight * math.log(1.0 +
+                                             indexed / frequency[term])
+    return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[
+        :limit]
+
+
+def indexed_posts(language_id):
+    """
+    :param language_id: ID of the language
+    :type language_id: int
+    :return: Number of posts indexed in the language
+    :rtype: int
+    """
+    key = INDEXED_POSTS_CACHE_KEY.format(language_id)
+    count = cache.get(key)
+    if count is None:
+        count = db.session.query(
+            func.count(func.distinct(models.NewsSearchTerm.news_id))) \
+            .filter(models.NewsSearchTerm.language_id == language_id) \
+            .scalar()
+        if not util.reading_from_replica():
+            cache.set(key, count, timeout=INDEXED_POSTS_CACHE_TIMEOUT)
+    return count
+
+
+def make_snippet(body, query, length=SNIPPET_LENGTH):
+    """
+    Extracts the part of a body surrounding the first query term it contains
+    :param body: Body of the post
+    :type body: basestring
+    :param query: Query the post matched
+    :type query: basestring
+    :param length: Approximate length of the snippet
+    :type length: int
+    :return: Plain text excerpt of the body
+    :rtype: basestring
+    """
+    text = strip_markup(body)
+    lowered = text.lower()
+    positions = [match.start() for term in tokenize(query)
+                 for match in [re.search(r'\b' + re.escape(term),
+                                         lowered, re.UNICODE)]
+                 if match]
+    start = max(0, min(positions) - length // 4) if positions else 0
+    end = start + length
+    snippet = text[start:end].strip()
+    if start > 0:
+        snippet = '...' + snippet
+    if end < len(text):
+        snippet += '...'
+    return snippet
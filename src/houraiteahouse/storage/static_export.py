@@ -0,0 +1,176 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Exported files must be readable by nginx, which runs as another user
+FILE_MODE = 0o644
+
+
+class StaticExporter(object):
+    """
+    Writes pre-rendered JSON responses below a directory nginx serves
+      directly.  A response for `<uri>?language=<code>` is stored at
+      `<root>/<uri>/<code>.json`.  Files are written to a temporary file and
+      renamed into place, so nginx never serves a partially written file.
+      Disabled unless STATIC_EXPORT_DIR is set.
+
+    Exports triggered by writes are rendered by a background thread rather
+      than the request which made the write.  Jobs are queued by key, so a
+      burst of writes to one post re-exports its views once.  The thread is
+      started by the first job a process submits, so under uWSGI each
+      worker runs its own rather than the master holding it.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self._app = None
+        self._jobs = OrderedDict()
+        self._busy = False
+        self._condition = threading.Condition()
+        self._worker = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.root = app.config.get('STATIC_EXPORT_DIR')
+        self._app = app
+
+    @property
+    def enabled(self):
+        return self.root is not None
+
+    def path_for(self, uri, language):
+        """
+        :param uri: Path of the exported route, e.g. /news/tag/james
+        :type uri: basestring
+        :param language: Language code the response is rendered in
+        :type language: basestring
+        :return: Location of the exported file
+        :rtype: basestring
+        """
+        parts = [part for part in uri.split('/') if part]
+        if any(part in ('.', '..') for part in parts + [language]):
+            raise ValueError('Refusing to export outside of the export root')
+        return os.path.join(self.root, *(parts + [language + '.json']))
+
+    def write(self, uri, language, payload):
+        """
+        Atomically replaces the exported response for a route
+        :param uri: Path of the exported route
+        :type uri: basestring
+        :param language: Language code the response is rendered in
+        :type language: basestring
+        :param payload: Serialized response body
+        :type payload: basestring
+        """
+        path = self.path_for(uri, language)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as temp_file:
+                temp_file.write(payload)
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def remove(self, uri, language):
+        """
+        Removes an exported response, so requests for it reach the app again
+        :param uri: Path of the exported route
+        :type uri: basestring
+        :param language: Language code the response is rendered in
+        :type language: basestring
+        """
+        try:
+            os.unlink(self.path_for(uri, language))
+        except FileNotFoundError:
+            pass
+
+    def export(self, uri, language, render):
+        """
+        Renders and writes the response for a route.  A response which fails
+          to render is removed instead, so nginx falls back to the app rather
+          than serving it stale.
+        :param uri: Path of the exported route
+        :type uri: basestring
+        :param language: Language code the response is rendered in
+        :type language: basestring
+        :param render: Callable producing the serialized response body
+        :type render: callable
+        :return: Whether the response was exported
+        :rtype: Boolean
+        """
+        try:
+            self.write(uri, language, render())
+            return True
+        except Exception:
+            logger.exception('Failed to export {0} in {1}'
+                             .format(uri, language))
+        try:
+            self.remove(uri, language)
+        except OSError:
+            logger.exception('Failed to remove stale export {0} in {1}'
+                             .format(uri, language))
+        return False
+
+    def submit(self, key, job):
+        """
+        Queues a job for the background export thread.  A job still queued
+          under the same key is replaced.
+        :param key: Identifies the views the job exports
+        :type key: hashable
+        :param job: Callable exporting views, run within an app context
+        :type job: callable
+        """
+        with self._condition:
+            self._jobs.pop(key, None)
+            self._jobs[key] = job
+            self._start()
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until every queued job has run
+        :param timeout: Seconds to wait at most, or None to wait forever
+        :type timeout: float
+        :return: Whether the queue was drained
+        :rtype: Boolean
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._jobs and not self._busy, timeout)
+
+    def _start(self):
+        # A thread started before a fork does not exist in the child
+        if self._worker is not None and self._pid == os.getpid() and \
+                self._worker.is_alive():
+            return
+        self._pid = os.getpid()
+        self._busy = False
+        self._worker = threading.Thread(target=self._run,
+                                        name='static-export', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._jobs)
+                _, job = self._jobs.popitem(last=False)
+                self._busy = True
+                app = self._app
+            try:
+                with app.app_context():
+                    job()
+            except Exception:
+                logger.exception('Static export job failed')
+
+
+static_export = StaticExporter()
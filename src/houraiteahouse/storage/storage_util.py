@@ -1,29 +1,300 @@
+import base64
 import logging
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from flask_sqlalchemy_cache import FromCache
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import DBAPIError
 from houraiteahouse.storage.models import db, cache
+from houraiteahouse.storage.routing import PIN_PRIMARY, READ_REPLICA, \
+    RoutingSession
+from werkzeug.exceptions import BadRequest
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
-def try_action(action):
-    db_action = getattr(db.session, action)
+CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
-    def try_action(**kwargs):
-        for name, value in kwargs.items():
+MAX_RETRIES = 3
+# PostgreSQL serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = frozenset(['40001', '40P01'])
+
+_UNIT_OF_WORK = 'houraiteahouse.unit_of_work'
+_ON_COMMIT = 'houraiteahouse.on_commit'
+
+
+def is_serialization_failure(error):
+    """
+    :param error: Error raised by the database driver
+    :type error: sqlalchemy.exc.DBAPIError
+    :return: Whether the transaction lost a serialization conflict or
+      deadlock and may succeed if retried
+    :rtype: Boolean
+    """
+    pgcode = getattr(getattr(error, 'orig', None), 'pgcode', None)
+    return pgcode in RETRYABLE_PGCODES
+
+
+@contextmanager
+def unit_of_work(logger=None):
+    """
+    Groups every add, merge and delete made in the block into a single
+      transaction, flushed and committed once on exit and rolled back if the
+      block raises.  Nested units of work join the outermost one, so only it
+      commits.  Callbacks registered with on_commit run once the unit of
+      work has ended, so any writes they make are their own transaction, and
+      their failures are logged rather than failing the committed write.
+    :param logger: Logger to report failures to
+    :type logger: logging.Logger
+    :return: The session to stage changes on
+    :rtype: sqlalchemy.orm.Session
+    """
+    session = db.session()
+    if session.info.get(_UNIT_OF_WORK):
+        yield session
+        return
+    session.info[_UNIT_OF_WORK] = True
+    session.info[_ON_COMMIT] = []
+    # Reads feeding a write must not see a lagging replica
+    session.info[PIN_PRIMARY] = True
+    try:
+        yield session
+        session.commit()
+    except Exception as error:
+        (logger or logging).exception('Transaction failed: {}'.format(error))
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(_UNIT_OF_WORK, None)
+        callbacks = session.info.pop(_ON_COMMIT, None) or []
+    for callback in list(callbacks):
+        try:
+            callback()
+        except Exception as error:
+            (logger or logging).exception(
+                'Post-commit callback failed: {}'.format(error))
+
+
+def in_unit_of_work():
+    return bool(db.session().info.get(_UNIT_OF_WORK))
+
+
+def on_commit(callback):
+    """
+    Defers the callback until the current unit of work commits, or runs it
+      immediately outside of one.  Callbacks are dropped on rollback.
+    :param callback: Function taking no arguments
+    :type callback: callable
+    """
+    session = db.session()
+    if session.info.get(_UNIT_OF_WORK):
+        session.info[_ON_COMMIT].append(callback)
+    else:
+        callback()
+
+
+def transactional(func):
+    """
+    Runs the decorated function inside a unit of work.  If the outermost
+      transaction fails with a serialization failure, the whole function is
+      retried up to MAX_RETRIES times.
+    :param func: Storage function to wrap
+    :type func: callable
+    :return: Wrapped function
+    :rtype: callable
+    """
+    logger = logging.getLogger(func.__module__)
+
+    @wraps(func)
+    def run_in_transaction(*args, **kwargs):
+        outermost = not in_unit_of_work()
+        attempt = 0
+        while True:
             try:
-                if name == 'logger':
-                    continue
-                db_action(value)
-                db.session.commit()
-                db.session.close()
-            except Exception as error:
-                logger = logging
-                if 'logger' in kwargs:
-                    logger = kwargs['logger']
-                logger.exception('Failed to {} {}: {}'.format(action, name,
-                                                              error))
-                db.session.close()
-                raise
+                with unit_of_work(logger):
+                    return func(*args, **kwargs)
+            except DBAPIError as error:
+                if not outermost or attempt >= MAX_RETRIES or \
+                        not is_serialization_failure(error):
+                    raise
+                attempt += 1
+                logger.warning('Retrying {0} after serialization failure '
+                               '({1}/{2})'.format(func.__name__, attempt,
+                                                  MAX_RETRIES))
+    return run_in_transaction
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets reads made in the block go to a read replica, unless the session
+      has already written or is in a unit of work
+    """
+    info = db.session().info
+    info[READ_REPLICA] = info.get(READ_REPLICA, 0) + 1
+    try:
+        yield
+    finally:
+        info[READ_REPLICA] -= 1
+
+
+def reading_from_replica():
+    """
+    :return: Whether the session's reads currently go to a read replica.
+      Results read from one may lag the primary, so must not be cached
+      where other requests would take them as current.
+    :rtype: Boolean
+    """
+    session = db.session()
+    return isinstance(session, RoutingSession) and \
+        session.routes_to_replica()
+
+
+def read_only(func):
+    """
+    Runs the decorated function's reads against a read replica, see
+      replica_reads.  Only for functions which never write and whose callers
+      can tolerate replication lag.
+    :param func: Storage function to wrap
+    :type func: callable
+    :return: Wrapped function
+    :rtype: callable
+    """
+    @wraps(func)
+    def read_from_replica(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+    return read_from_replica
+
+
+def try_action(action):
+    def try_action(**kwargs):
+        logger = kwargs.pop('logger', None)
+        with unit_of_work(logger) as session:
+            for value in kwargs.values():
+                getattr(session, action)(value)
     return try_action
 
 
+# Single statement shorthands for unit_of_work
 try_add = try_action('add')
 try_delete = try_action('delete')
 try_merge = try_action('merge')
+
+
+def encode_cursor(created, row_id):
+    """
+    Builds an opaque pagination cursor pointing just past the given row
+    :param created: Sort timestamp of the last row of the current page
+    :type created: datetime
+    :param row_id: ID of the last row of the current page
+    :type row_id: int
+    :return: URL-safe cursor string
+    :rtype: basestring
+    """
+    raw = '{0}|{1}'.format(created.strftime(CURSOR_DATE_FORMAT), row_id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Parses a cursor produced by encode_cursor
+    :param cursor: Cursor provided by the client
+    :type cursor: basestring
+    :return: The (created, id) position the cursor points at
+    :rtype: tuple
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created, row_id = raw.split('|')
+        return datetime.strptime(created, CURSOR_DATE_FORMAT), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise BadRequest('Invalid pagination cursor.') from None
+
+
+def paginate(query, created_column, id_column, cursor=None, limit=None):
+    """
+    Applies keyset pagination over (created, id), newest first
+    :param query: Query to paginate
+    :type query: sqlalchemy.orm.Query
+    :param created_column: Timestamp column to sort on
+    :param id_column: Unique column used to break ties
+    :param cursor: Cursor returned with the previous page, if any
+    :type cursor: basestring
+    :param limit: Maximum number of rows to return
+    :type limit: int
+    :return: The rows in this page and the cursor for the next one
+    :rtype: tuple
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    if cursor:
+        created, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_column < created,
+            and_(created_column == created, id_column < row_id)))
+    rows = query.order_by(created_column.desc(), id_column.desc()) \
+        .limit(limit + 1) \
+        .options(FromCache(cache)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_column.key),
+                                    getattr(last, id_column.key))
+    return rows, next_cursor
+
+
+def encode_id_cursor(row_id):
+    """
+    Builds an opaque pagination cursor pointing just past the given row
+    :param row_id: ID of the last row of the current page
+    :type row_id: int
+    :return: URL-safe cursor string
+    :rtype: basestring
+    """
+    return base64.urlsafe_b64encode(str(row_id).encode('utf-8')) \
+        .decode('ascii')
+
+
+def decode_id_cursor(cursor):
+    """
+    Parses a cursor produced by encode_id_cursor
+    :param cursor: Cursor provided by the client
+    :type cursor: basestring
+    :return: The ID the cursor points at
+    :rtype: int
+    """
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii'))
+                   .decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        raise BadRequest('Invalid pagination cursor.') from None
+
+
+def paginate_by_id(query, id_column, cursor=None, limit=None):
+    """
+    Applies keyset pagination over a unique ID, oldest first.  Combined with
+      an equality filter, e.g. on a parent's ID, each page is a single range
+      scan of an index over (parent ID, ID), however deep into the results
+      the page is.
+    :param query: Query to paginate
+    :type query: sqlalchemy.orm.Query
+    :param id_column: Unique column to sort on
+    :param cursor: Cursor returned with the previous page, if any
+    :type cursor: basestring
+    :param limit: Maximum number of rows to return
+    :type limit: int
+    :return: The rows in this page and the cursor for the next one
+    :rtype: tuple
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    if cursor:
+        query = query.filter(id_column > decode_id_cursor(cursor))
+    rows = query.order_by(id_column).limit(limit + 1) \
+        .options(FromCache(cache)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_id_cursor(getattr(rows[-1], id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,195 @@
+import logging
+from datetime import datetime
+from sqlalchemy import func
+from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage.language_registry import languages
+from houraiteahouse.storage.translation_index import language_chain
+from houraiteahouse.storage import models
+from houraiteahouse.storage.models import db
+
+logger = logging.getLogger(__name__)
+
+
+def list_summaries(lang, cursor=None, limit=None):
+    """
+    Fetches a page of news summaries in the given language
+    :param lang: Language to list summaries for
+    :type lang: language_registry.LanguageInfo
+    :param cursor: Cursor returned with the previous page, if any
+    :type cursor: basestring
+    :param limit: Maximum number of summaries to return
+    :type limit: int
+    :return: Envelope containing the page and the cursor for the next one
+    :rtype: dict
+    """
+    return _page(models.NewsSummary.query.filter_by(language_id=lang.id),
+                 cursor, limit)
+
+
+def tagged_summaries(tag, lang, cursor=None, limit=None):
+    """
+    Fetches a page of news summaries with the given tag
+    :param tag: Tag to filter summaries by
+    :type tag: models.NewsTag
+    :param lang: Language to list summaries for
+    :type lang: language_registry.LanguageInfo
+    :param cursor: Cursor returned with the previous page, if any
+    :type cursor: basestring
+    :param limit: Maximum number of summaries to return
+    :type limit: int
+    :return: Envelope containing the page and the cursor for the next one
+    :rtype: dict
+    """
+    query = models.NewsSummary.query \
+        .join(models.tags,
+              models.tags.c.news_id == models.NewsSummary.news_id) \
+        .filter(models.NewsSummary.language_id == lang.id,
+                models.tags.c.tag_id == tag.id)
+    return _page(query, cursor, limit)
+
+
+def summary_version(post_short, lang):
+    """
+    Fetches the time the given post last changed in the given language
+    :param post_short: Short title of the post
+    :type post_short: basestring
+    :param lang: Language the post is being read in
+    :type lang: language_registry.LanguageInfo
+    :return: Last update time, or None if the post has no summary
+    :rtype: datetime
+    """
+    row = db.session.query(models.NewsSummary.updated) \
+        .filter_by(post_short=post_short, language_id=lang.id).first()
+    return row and row.updated
+
+
+def comment_count(news_id, lang):
+    """
+    :param news_id: ID of the post
+    :type news_id: int
+    :param lang: Language the post is being read in
+    :type lang: language_registry.LanguageInfo
+    :return: Number of comments on the post, without counting them
+    :rtype: int
+    """
+    row = db.session.query(models.NewsSummary.comment_count) \
+        .filter_by(news_id=news_id, language_id=lang.id).first()
+    return row.comment_count if row else 0
+
+
+def listing_version(lang, tag=None):
+    """
+    Fetches values which change whenever a listing's content does
+    :param lang: Language of the listing
+    :type lang: language_registry.LanguageInfo
+    :param tag: Tag the listing is filtered by, if any
+    :type tag: models.NewsTag
+    :return: Latest update time among the listed posts and their count
+    :rtype: tuple
+    """
+    query = db.session.query(func.max(models.NewsSummary.updated),
+                             func.count(models.NewsSummary.news_id)) \
+        .filter(models.NewsSummary.language_id == lang.id)
+    if tag is not None:
+        query = query.join(
+            models.tags,
+            models.tags.c.news_id == models.NewsSummary.news_id) \
+            .filter(models.tags.c.tag_id == tag.id)
+    return query.one()
+
+
+def _page(query, cursor, limit):
+    summaries, next_cursor = util.paginate(
+        query, models.NewsSummary.created, models.NewsSummary.news_id,
+        cursor, limit)
+    return {
+        'news': [summary.to_dict() for summary in summaries],
+        'next': next_cursor
+    }
+
+
+@util.transactional
+def refresh_summaries(post_ids):
+    """
+    Recomputes the summaries of the given posts in every language.  All
+      posts are refreshed with a fixed number of queries.
+    :param post_ids: IDs of the posts whose summaries are stale
+    :type post_ids: list
+    """
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    posts = models.NewsPost.query.filter(models.NewsPost.id.in_(post_ids))
+
+    authors = dict(db.session.query(models.User.id, models.User.username)
+                   .join(models.NewsPost,
+                         models.NewsPost.author_id == models.User.id)
+                   .filter(models.NewsPost.id.in_(post_ids)))
+
+    post_tags = {post_id: [] for post_id in post_ids}
+    tag_rows = db.session.query(models.tags.c.news_id, models.NewsTag.name) \
+        .join(models.NewsTag, models.NewsTag.id == models.tags.c.tag_id) \
+        .filter(models.tags.c.news_id.in_(post_ids)) \
+        .order_by(models.NewsTag.name)
+    for post_id, name in tag_rows:
+        post_tags[post_id].append(name)
+
+    titles = {(title.id, title.language_id): title.get_title()
+              for title in models.NewsTitle.query.filter(
+                  models.NewsTitle.id.in_(post_ids))}
+
+    comment_counts = dict(
+        db.session.query(models.NewsComment.news_id,
+                         func.count(models.NewsComment.id))
+        .filter(models.NewsComment.news_id.in_(post_ids))
+        .group_by(models.NewsComment.news_id))
+
+    existing = {(summary.news_id, summary.language_id): summary
+                for summary in models.NewsSummary.query.filter(
+                    models.NewsSummary.news_id.in_(post_ids))}
+
+    # Titles are localized into the first language of each language's
+    # fallback chain the post has been translated into
+    chains = []
+    for lang in languages.all():
+        chain = [languages.get(code)
+                 for code in language_chain(lang.language_code)]
+        chains.append((lang, [fallback.id for fallback in chain
+                              if fallback is not None]))
+
+    now = datetime.utcnow()
+    for post in posts:
+        for lang, chain in chains:
+            summary = existing.get((post.id, lang.id))
+            if summary is None:
+                summary = models.NewsSummary(news_id=post.id,
+                                             language_id=lang.id)
+                db.session.add(summary)
+            summary.post_short = post.post_short
+            summary.title = next(
+                (titles[(post.id, language_id)] for language_id in chain
+                 if titles.get((post.id, language_id))), post.title)
+            summary.author = authors[post.author_id]
+            summary.tags = post_tags[post.id]
+            summary.media = post.media
+            summary.created = post.created
+            summary.lastEdit = post.lastEdit
+            summary.comment_count = comment_counts.get(post.id, 0)
+            summary.updated = now
+
+
+def rebuild_summaries(batch_size=100):
+    """
+    Regenerates every news summary.  Required after adding a new language.
+    :param batch_size: Number of posts to refresh per transaction
+    :type batch_size: int
+    :return: Number of posts refreshed
+    :rtype: int
+    """
+    post_ids = [post_id for post_id, in
+                db.session.query(models.NewsPost.id)
+                .order_by(models.NewsPost.id)]
+    for start in range(0, len(post_ids), batch_size):
+        refresh_summaries(post_ids[start:start + batch_size])
+    logger.info('Rebuilt news summaries for {0} posts'.format(len(post_ids)))
+    return len(post_ids)
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from houraiteahouse.storage import models
+from houraiteahouse.storage.body_store import body_store
+from houraiteahouse.storage.language_registry import languages
+from houraiteahouse.storage.models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = 'en_US'
+DEFAULT_TTL = 300
+
+# Per post short title, the language codes it has a body and a localized
+# title in
+Translations = namedtuple('Translations', ['bodies', 'titles'])
+
+_EMPTY = Translations(frozenset(), frozenset())
+
+
+class TranslationIndex(object):
+    """
+    In-memory index of the languages each post has a body and a localized
+      title in, so a request for an untranslated language can fall back
+      without trying to read a body which does not exist.  Built by scanning
+      the body store and newstitle table once, then kept up to date by this
+      process' writes.  Posts written by other processes are looked up the
+      first time they are requested, and the whole index is rebuilt every
+      TRANSLATION_INDEX_TTL seconds to pick up their translations.  Only
+      one thread rebuilds an expired index; the others keep using the old
+      one in the meantime.
+    """
+
+    def __init__(self):
+        self.ttl = DEFAULT_TTL
+        # Language code to the codes to try, in order, when a post has not
+        # been translated into it
+        self.fallbacks = {}
+        self._posts = None
+        self._built = None
+        # Writes recorded while a rebuild is scanning, which it may miss
+        self._added = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('TRANSLATION_INDEX_TTL', DEFAULT_TTL)
+        self.fallbacks = app.config.get('LANGUAGE_FALLBACKS', {})
+        self.invalidate()
+
+    def reload(self):
+        """
+        Replaces the index's contents with a scan of the body store and
+          the newstitle table
+        :return: Number of posts indexed
+        :rtype: int
+        """
+        with self._lock:
+            self._added = []
+        bodies = {}
+        for post_short, code in body_store.keys():
+            bodies.setdefault(post_short, set()).add(code)
+        titles = {}
+        rows = db.session.query(models.NewsPost.post_short,
+                                models.NewsTitle.language_id) \
+            .join(models.NewsTitle,
+                  models.NewsTitle.id == models.NewsPost.id)
+        for post_short, language_id in rows:
+            lang = languages.by_id.get(language_id)
+            if lang is not None:
+                titles.setdefault(post_short, set()).add(lang.language_code)
+        posts = {post_short: Translations(
+            frozenset(bodies.get(post_short, ())),
+            frozenset(titles.get(post_short, ())))
+            for post_short in set(bodies) | set(titles)}
+        with self._lock:
+            for post_short, language, body, title in self._added:
+                _record(posts, post_short, language, body, title)
+            self._added = None
+            self._posts = posts
+            self._built = time.monotonic()
+        logger.info('Indexed translations of {0} news posts'
+                    .format(len(posts)))
+        return len(posts)
+
+    def invalidate(self):
+        with self._lock:
+            self._posts = None
+            self._built = None
+
+    def get(self, post_short):
+        """
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :return: The languages the post has been translated into
+        :rtype: Translations
+        """
+        translations = self._current().get(post_short)
+        if translations is None:
+            translations = self._load(post_short)
+        return translations
+
+    def add(self, post_short, language, body=True, title=True):
+        """
+        Records that a post has been written in a language.  Must be called
+          once the write has committed.
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param language: Language code written
+        :type language: basestring
+        :param body: Whether a body was written
+        :type body: bool
+        :param title: Whether a localized title was written
+        :type title: bool
+        """
+        posts = self._current()
+        with self._lock:
+            _record(posts, post_short, language, body, title)
+            if self._added is not None:
+                self._added.append((post_short, language, body, title))
+
+    def body_language(self, post_short, chain):
+        """
+        :param post_short: Short title of the post
+        :type post_short: basestring
+        :param chain: Language codes in order of preference
+        :type chain: list
+        :return: The first language in the chain the post has a body in, or
+          None if it has none of them
+        :rtype: basestring
+        """
+        bodies = self.get(post_short).bodies
+        for code in chain:
+            if code in bodies:
+                return code
+        return None
+
+    def _current(self):
+        posts, built = self._posts, self._built
+        if posts is None:
+            # Nothing to serve until the first build completes
+            with self._reload_lock:
+                if self._posts is None:
+                    self.reload()
+                return self._posts
+        if self.ttl is not None and time.monotonic() - built > self.ttl and \
+                self._reload_lock.acquire(blocking=False):
+            try:
+                if self._built == built:
+                    self.reload()
+            finally:
+                self._reload_lock.release()
+            posts = self._posts
+        return posts
+
+    def _load(self, post_short):
+        # Written by another process since the index was built
+        titles = frozenset(
+            languages.by_id[language_id].language_code
+            for language_id, in db.session.query(models.NewsTitle.language_id)
+            .join(models.NewsPost, models.NewsPost.id == models.NewsTitle.id)
+            .filter(models.NewsPost.post_short == post_short)
+            if language_id in languages.by_id)
+        bodies = frozenset(lang.language_code for lang in languages.all()
+                           if body_store.exists(post_short,
+                                                lang.language_code))
+        translations = Translations(bodies, titles)
+        if bodies or titles:
+            with self._lock:
+                if self._posts is not None:
+                    self._posts[post_short] = translations
+        return translations
+
+
+def _record(posts, post_short, language, body, title):
+    current = posts.get(post_short, _EMPTY)
+    posts[post_short] = Translations(
+        current.bodies | {language} if body else current.bodies,
+        current.titles | {language} if title else current.titles)
+
+
+translations = TranslationIndex()
+
+
+def language_chain(language=DEFAULT_LANGUAGE):
+    """
+    :param language: Language code requested
+    :type language: basestring
+    :return: The language followed by its configured fallbacks, ending with
+      the default language
+    :rtype: list
+    """
+    chain = [language]
+    for code in list(translations.fallbacks.get(language, ())) + \
+            [DEFAULT_LANGUAGE]:
+        if code not in chain:
+            chain.append(code)
+    return chain
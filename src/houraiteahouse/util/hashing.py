@@ -0,0 +1,189 @@
+import bcrypt
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask_bcrypt import Bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+from .metrics import registry, timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_LATENCY_BUDGET_MS = 250
+DEFAULT_MIN_LOG_ROUNDS = 10
+DEFAULT_MAX_LOG_ROUNDS = 16
+
+hash_latency = registry.histogram(
+    'password_hash_seconds', 'Time spent computing bcrypt hashes')
+queue_wait = registry.histogram(
+    'password_hash_queue_seconds',
+    'Time bcrypt jobs spent waiting for a hashing worker')
+rejected = registry.counter(
+    'password_hash_rejected_total',
+    'bcrypt jobs rejected because the hashing queue was full')
+
+
+class PasswordHasher(object):
+    """
+    Runs bcrypt on a dedicated, size limited pool of worker threads.  The
+      request thread submitting a job still waits for its result; the pool
+      caps how many hashes run at once, and jobs beyond its queue depth are
+      rejected with a 503 instead of piling up behind one another.  The
+      queue can only fill when a worker process handles more requests at
+      once than it admits hashing jobs, so under uWSGI the jobs admitted
+      are capped below its request threads, leaving at least one free for
+      other requests.
+    """
+
+    def __init__(self):
+        self._bcrypt = Bcrypt()
+        self._executor = None
+        self._slots = None
+
+    def init_app(self, app):
+        self._bcrypt.init_app(app)
+        workers = app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+        queue_depth = app.config.get('PASSWORD_HASH_QUEUE_DEPTH',
+                                     DEFAULT_QUEUE_DEPTH)
+        slots = workers + queue_depth
+        threads = request_threads()
+        if threads is not None and slots >= threads:
+            slots = max(threads - 1, 1)
+            logger.warning(
+                'Only {0} request threads per process, admitting {1} '
+                'password hashing jobs at once instead of {2}'
+                .format(threads, slots, workers + queue_depth))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=min(workers, slots))
+        self._slots = threading.BoundedSemaphore(slots)
+
+    @property
+    def log_rounds(self):
+        return self._bcrypt._log_rounds
+
+    def needs_rehash(self, pw_hash):
+        """
+        :param pw_hash: Stored bcrypt hash
+        :type pw_hash: basestring
+        :return: Whether the hash was computed at a lower cost than is
+          currently configured.  Stronger hashes are kept, so hosts briefly
+          configured with different costs do not rehash back and forth.
+        :rtype: Boolean
+        """
+        return hash_log_rounds(pw_hash) < self.log_rounds
+
+    def generate_password_hash(self, password):
+        """
+        :param password: Plaintext password to hash
+        :type password: basestring
+        :return: bcrypt hash of the password
+        :rtype: basestring
+        """
+        return self._run(self._bcrypt.generate_password_hash,
+                         password).decode('utf-8')
+
+    def check_password_hash(self, pw_hash, password):
+        """
+        :param pw_hash: Stored bcrypt hash
+        :type pw_hash: basestring
+        :param password: Plaintext password to check against the hash
+        :type password: basestring
+        :return: Whether the password matches
+        :rtype: Boolean
+        """
+        return self._run(self._bcrypt.check_password_hash, pw_hash, password)
+
+    def _run(self, func, *args):
+        with timed('bcrypt'):
+            return self._submit(func, *args)
+
+    def _submit(self, func, *args):
+        if self._executor is None:
+            return _timed(func, *args)
+        if not self._slots.acquire(blocking=False):
+            rejected.inc()
+            logger.warning('Password hashing queue is full, rejecting job')
+            raise ServiceUnavailable(
+                'The server is handling too many logins right now, please '
+                'try again shortly.')
+        try:
+            submitted = time.monotonic()
+
+            def job():
+                queue_wait.observe(time.monotonic() - submitted)
+                return _timed(func, *args)
+
+            return self._executor.submit(job).result()
+        finally:
+            self._slots.release()
+
+
+def request_threads():
+    """
+    :return: Number of threads each uWSGI worker process handles requests
+      on, or None when not running under uWSGI
+    :rtype: int
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    return int(uwsgi.opt.get('threads', 1))
+
+
+def hash_log_rounds(pw_hash):
+    """
+    :param pw_hash: bcrypt hash, formatted as $2b$<rounds>$<salt+digest>
+    :type pw_hash: basestring
+    :return: The cost the hash was computed with
+    :rtype: int
+    """
+    return int(pw_hash.split('$')[2])
+
+
+def calibrate_log_rounds(budget_ms=DEFAULT_LATENCY_BUDGET_MS,
+                         min_rounds=DEFAULT_MIN_LOG_ROUNDS,
+                         max_rounds=DEFAULT_MAX_LOG_ROUNDS, samples=3):
+    """
+    Measures bcrypt on this host and picks the highest cost whose hash time
+      fits within the given budget.  Each extra round doubles the cost, so
+      measuring stops at the first cost over budget.
+    :param budget_ms: Acceptable time for a single hash, in milliseconds
+    :type budget_ms: float
+    :param min_rounds: Lowest cost to ever select
+    :type min_rounds: int
+    :param max_rounds: Highest cost to ever select
+    :type max_rounds: int
+    :param samples: Number of hashes to time per cost
+    :type samples: int
+    :return: The selected number of log rounds
+    :rtype: int
+    """
+    selected = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings = []
+        for _ in range(samples):
+            start = time.monotonic()
+            bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+            timings.append(time.monotonic() - start)
+        elapsed_ms = statistics.median(timings) * 1000
+        logger.debug('bcrypt cost {0} takes {1:.1f}ms'
+                     .format(rounds, elapsed_ms))
+        if elapsed_ms > budget_ms:
+            break
+        selected = rounds
+    logger.info('Calibrated bcrypt to {0} log rounds for a {1}ms budget'
+                .format(selected, budget_ms))
+    return selected
+
+
+def _timed(func, *args):
+    start = time.monotonic()
+    try:
+        return func(*args)
+    finally:
+        hash_latency.observe(time.monotonic() - start)
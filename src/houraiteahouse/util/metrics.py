@@ -0,0 +1,388 @@
+import bisect
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5,
+                   5.0, 7.5, 10.0, float('inf'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric(object):
+    """
+    Base of all metrics.  A metric declared with label names keeps a
+      separate value for every combination of label values it is updated
+      with.
+    """
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError('{0} expects labels {1}, got {2}'.format(
+                self.name, self.label_names, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self):
+        """
+        :return: A copy of the metric's values, keyed by label values
+        :rtype: dict
+        """
+        with self._lock:
+            return {key: self._copy(value)
+                    for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @property
+    def value(self):
+        return self._values.get((), 0)
+
+
+class Gauge(Metric):
+    """
+    Value that may go up or down, such as the size of a table
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @property
+    def value(self):
+        return self._values.get((), 0)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed cumulative buckets
+    """
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS,
+                 labels=()):
+        Metric.__init__(self, name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._empty()
+            if index < len(self.buckets):
+                state['counts'][index] += 1
+            state['count'] += 1
+            state['sum'] += value
+
+    def _empty(self):
+        return {'counts': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+
+    def _copy(self, value):
+        return {'counts': list(value['counts']), 'count': value['count'],
+                'sum': value['sum']}
+
+    @property
+    def counts(self):
+        return self._values.get((), self._empty())['counts']
+
+    @property
+    def count(self):
+        return self._values.get((), self._empty())['count']
+
+    @property
+    def sum(self):
+        return self._values.get((), self._empty())['sum']
+
+
+class Registry(object):
+    """
+    Collection of the application's named metrics
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter, name, description, labels=labels)
+
+    def gauge(self, name, description, labels=()):
+        return self._register(Gauge, name, description, labels=labels)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS,
+                  labels=()):
+        return self._register(Histogram, name, description, buckets,
+                              labels=labels)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def metrics(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: m.name)
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def snapshot(self):
+        """
+        :return: JSON serializable copy of every metric's current values
+        :rtype: dict
+        """
+        return {metric.name: [[list(key), value] for key, value
+                              in metric.snapshot().items()]
+                for metric in self.metrics()}
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+
+registry = Registry()
+
+
+class MultiProcessStore(object):
+    """
+    Shares metrics between worker processes through files in a directory.
+      Each process periodically writes a snapshot of its registry to
+      `<directory>/<pid>-<token>.json`; reading merges every snapshot.
+      Counters and histograms are summed, including those of processes which
+      have since exited, so totals never go backwards when uWSGI recycles a
+      worker.  Gauges are only kept for live processes and gain a `pid`
+      label.  The directory should be emptied whenever the server starts.
+    """
+
+    def __init__(self, directory, metrics_registry=registry):
+        self.directory = directory
+        self.registry = metrics_registry
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def check_fork(self):
+        """
+        Detects running in a process forked after the store was created, as
+          uWSGI workers are forked from the master.  Values inherited from
+          the parent are dropped, as the parent reports them itself, and the
+          child is given its own snapshot file.
+        """
+        if os.getpid() == self._pid:
+            return
+        with self._lock:
+            if os.getpid() != self._pid:
+                self.registry.reset()
+                self._pid = os.getpid()
+                self._token = uuid.uuid4().hex
+
+    def flush(self):
+        self.check_fork()
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as temp_file:
+                json.dump(self.registry.snapshot(), temp_file)
+            os.replace(temp_path, os.path.join(
+                self.directory, '{0}-{1}.json'.format(self._pid, self._token)))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def collect(self):
+        """
+        :return: Values of every metric across all processes, keyed by
+          metric name then by label values
+        :rtype: dict
+        """
+        merged = defaultdict(dict)
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            pid = int(name.split('-', 1)[0])
+            try:
+                with open(os.path.join(self.directory, name)) as snapshot:
+                    values = json.load(snapshot)
+            except (OSError, ValueError):
+                # Being replaced or removed by its process, skip this time
+                continue
+            for metric_name, samples in values.items():
+                metric = self.registry.get(metric_name)
+                if metric is None:
+                    continue
+                if metric.type == 'gauge' and not _is_alive(pid):
+                    continue
+                for key, value in samples:
+                    if metric.type == 'gauge':
+                        key = key + [str(pid)]
+                    _merge(metric, merged[metric_name], tuple(key), value)
+        return merged
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(metric, values, key, value):
+    current = values.get(key)
+    if current is None or metric.type == 'gauge':
+        values[key] = metric._copy(value) if metric.type == 'histogram' \
+            else value
+    elif metric.type == 'histogram':
+        current['counts'] = [a + b for a, b in
+                             zip(current['counts'], value['counts'])]
+        current['count'] += value['count']
+        current['sum'] += value['sum']
+    else:
+        values[key] = current + value
+
+
+def exposition(metrics_registry=registry, values=None):
+    """
+    Renders metrics in the Prometheus text exposition format
+    :param metrics_registry: Registry declaring the metrics
+    :type metrics_registry: Registry
+    :param values: Values to render, as returned by
+      MultiProcessStore.collect, or None to render this process' values
+    :type values: dict
+    :return: The exposition text
+    :rtype: basestring
+    """
+    lines = []
+    for metric in metrics_registry.metrics():
+        samples = metric.snapshot() if values is None \
+            else values.get(metric.name, {})
+        label_names = metric.label_names
+        if values is not None and metric.type == 'gauge':
+            label_names += ('pid',)
+        lines.append('# HELP {0} {1}'.format(metric.name,
+                                             _escape(metric.description)))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+        for key, value in sorted(samples.items()):
+            labels = list(zip(label_names, key))
+            if metric.type != 'histogram':
+                lines.append(_sample(metric.name, labels, value))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value['counts']):
+                cumulative += count
+                lines.append(_sample(metric.name + '_bucket',
+                                     labels + [('le', _format(bound))],
+                                     cumulative))
+            if not math.isinf(metric.buckets[-1]):
+                lines.append(_sample(metric.name + '_bucket',
+                                     labels + [('le', '+Inf')],
+                                     value['count']))
+            lines.append(_sample(metric.name + '_sum', labels, value['sum']))
+            lines.append(_sample(metric.name + '_count', labels,
+                                 value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join('{0}="{1}"'.format(label, _escape(str(v)))
+                               for label, v in labels) + '}'
+    return '{0} {1}'.format(name, _format(value))
+
+
+def _format(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+# Time spent per resource by the request being handled on this thread
+_request_timings = threading.local()
+
+
+def start_request_timings():
+    _request_timings.current = defaultdict(float)
+    return _request_timings.current
+
+
+def stop_request_timings():
+    timings = getattr(_request_timings, 'current', None)
+    _request_timings.current = None
+    return timings
+
+
+def record_time(resource, seconds, count=1):
+    """
+    Attributes time spent on a resource, e.g. the database, to the request
+      being handled on this thread, if any
+    :param resource: Name of the resource
+    :type resource: basestring
+    :param seconds: Time spent
+    :type seconds: float
+    :param count: Number of operations the time was spent on
+    :type count: int
+    """
+    timings = getattr(_request_timings, 'current', None)
+    if timings is not None:
+        timings[resource] += seconds
+        timings[resource + '_count'] += count
+
+
+@contextmanager
+def timed(resource):
+    """
+    Attributes the time spent in the block to a resource, see record_time
+    :param resource: Name of the resource
+    :type resource: basestring
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_time(resource, time.monotonic() - start)
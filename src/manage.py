@@ -3,7 +3,11 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from houraiteahouse.config import DevelopmentConfig
 from houraiteahouse.app import create_app
+from houraiteahouse.storage import auth_storage, body_store, news_storage, \
+    summary_storage
 from houraiteahouse.storage.models import db
+from houraiteahouse.util import hashing
+from houraiteahouse.util.file_utils import load_json_file, store_json_to_file
 
 # Flask migrate scripting for SQLAlchemy
 
@@ -48,6 +52,64 @@ def create_admin():
     db.session.commit()
 
 
+@manager.command
+def calibrate_bcrypt(budget_ms=None, save=False):
+    # Run once per deployment rather than in every worker, as workers timing
+    # bcrypt separately can settle on different costs. --save stores the
+    # result as bcryptLogRounds in the config file.
+    budget_ms = float(budget_ms or app.config['BCRYPT_LATENCY_BUDGET_MS'])
+    rounds = hashing.calibrate_log_rounds(
+        budget_ms, app.config['BCRYPT_MIN_LOG_ROUNDS'],
+        app.config['BCRYPT_MAX_LOG_ROUNDS'])
+    print('bcrypt cost for a {0}ms budget on this host: {1}'
+          .format(budget_ms, rounds))
+    if save:
+        config = load_json_file(app.config['CONFIG_FILE'])
+        config['bcryptLogRounds'] = rounds
+        store_json_to_file(config, app.config['CONFIG_FILE'])
+        print('Saved to {0}'.format(app.config['CONFIG_FILE']))
+
+
+@manager.command
+def reap_sessions(batch_size=auth_storage.DEFAULT_REAP_BATCH_SIZE):
+    # Safe to run from cron alongside the in-process reaper
+    count = auth_storage.reap_expired_sessions(int(batch_size))
+    print('Reaped {0} expired sessions, {1} remain'
+          .format(count, auth_storage.count_sessions()))
+
+
+@manager.command
+def rebuild_news_summaries():
+    # Needed whenever a language is added, as summaries are per language
+    count = summary_storage.rebuild_summaries()
+    print('Rebuilt summaries for {0} news posts'.format(count))
+
+
+@manager.command
+def rebuild_search_index():
+    # Builds the news search index from the bodies stored on disk
+    count = news_storage.rebuild_search_index()
+    print('Indexed {0} localized news posts'.format(count))
+
+
+@manager.command
+def export_static_news():
+    # Exports every pre-rendered news view for nginx to serve
+    count = news_storage.export_all_views()
+    print('Exported {0} static news views'.format(count))
+
+
+@manager.command
+def migrate_news_bodies(source, destination, delete=False):
+    # Copies every news body between the filesystem, database and object
+    # stores. Switch newsBodyStore to the destination once it completes.
+    count = body_store.copy_bodies(
+        body_store.create_body_store(source, app.config),
+        body_store.create_body_store(destination, app.config), delete)
+    print('Copied {0} news bodies from {1} to {2}'
+          .format(count, source, destination))
+
+
 @manager.command
 def create_data():
     pass
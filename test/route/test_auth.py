@@ -52,6 +52,42 @@ class AuthTest(HouraiTeahouseTestCase):
                             })
         self.assert200(response)
 
+    def test_authorization_resolves_session_once(self):
+        session = self.register_and_login('admin', 'password')
+        self.adminify('admin')
+        self.register('user@user', 'user', 'password')
+        with self.count_queries() as queries:
+            response = self.get('/auth/user/permissions', session=session)
+        self.assert200(response)
+        session_queries = [q for q in queries if 'FROM sessions' in q]
+        self.assertEqual(len(session_queries), 1)
+
+        # The session is now cached for subsequent requests
+        with self.count_queries() as queries:
+            response = self.get('/auth/user/permissions', session=session)
+        self.assert200(response)
+        self.assertFalse([q for q in queries if 'FROM sessions' in q])
+
+    def test_permission_changes_invalidate_cached_sessions(self):
+        admin = self.register_and_login('admin', 'password')
+        self.adminify('admin')
+        user = self.register_and_login('user', 'password')
+        response = self.client.get('/auth/status?session_id=' + user)
+        self.assertNotIn('team', response.json['permissions'])
+
+        self.put('/auth/user/permissions', session=admin,
+                 data={'permissions': {'team': True}})
+        response = self.client.get('/auth/status?session_id=' + user)
+        self.assertTrue(response.json['permissions']['team'])
+
+    def test_logout_invalidates_cached_session(self):
+        session = self.register_and_login('admin', 'password')
+        self.assertTrue(self.client.get(
+            '/auth/status?session_id=' + session).json['status'])
+        self.post('/auth/logout', session=session)
+        self.assertFalse(self.client.get(
+            '/auth/status?session_id=' + session).json['status'])
+
     def test_get_permissions_requires_authentication(self):
         self.register('user@user', 'user', 'password')
         response = self.get('/auth/user/permissions')
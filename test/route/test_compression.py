@@ -0,0 +1,106 @@
+import gzip
+import json
+import unittest
+import zlib
+from unittest.mock import mock_open, patch
+from test_util import HouraiTeahouseTestCase
+from houraiteahouse.route.response_cache import response_cache
+from houraiteahouse.storage import news_storage
+from houraiteahouse.storage.models import db, Language
+
+USERNAME = 'news'
+
+
+class CompressionTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.session = self.register_and_login(USERNAME, 'password')
+        self.adminify(USERNAME)
+        db.session.add(Language('en_US', 'English'))
+        db.session.commit()
+        response_cache.min_bytes = 256
+        for i in range(5):
+            with patch('builtins.open', mock_open(), create=True):
+                self.post('/news', session=self.session, data={
+                    'title': 'Local Man Drinks {0}'.format(i),
+                    'body': 'Test post pls ignore',
+                    'tags': ['james', 'mountain dew', 'local man']
+                })
+
+    def get_news(self, encoding=None):
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        return self.client.get('/news?language=en_US', headers=headers)
+
+    def test_gzip_is_negotiated(self):
+        plain = self.get_news()
+        response = self.get_news('gzip, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertNotEqual(response.headers['ETag'], plain.headers['ETag'])
+
+    def test_etags_are_per_coding(self):
+        plain = self.get_news()
+        gzipped = self.get_news('gzip')
+        deflated = self.get_news('deflate')
+        self.assertEqual(len({plain.headers['ETag'], gzipped.headers['ETag'],
+                              deflated.headers['ETag']}), 3)
+        # Clients may revalidate either copy they hold, but not a coding
+        # they no longer accept
+        for held, encoding, status in [
+                (gzipped, 'gzip', 304), (plain, 'gzip', 304),
+                (deflated, 'deflate', 304), (gzipped, None, 200),
+                (gzipped, 'deflate', 200)]:
+            headers = {'If-None-Match': held.headers['ETag']}
+            if encoding:
+                headers['Accept-Encoding'] = encoding
+            response = self.client.get('/news?language=en_US',
+                                       headers=headers)
+            self.assertEqual(response.status_code, status)
+            if status == 304:
+                self.assertEqual(response.headers['ETag'],
+                                 held.headers['ETag'])
+
+    def test_deflate_is_negotiated(self):
+        plain = self.get_news()
+        response = self.get_news('deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = self.get_news()
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(len(json.loads(response.data.decode())['news']), 5)
+
+    def test_small_responses_are_not_compressed(self):
+        response_cache.min_bytes = 1024 * 1024
+        response = self.get_news('gzip')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_repeat_reads_skip_rendering(self):
+        first = self.get_news('gzip')
+        with patch.object(news_storage, 'list_news') as list_news:
+            second = self.get_news('gzip')
+            plain = self.get_news()
+        self.assertFalse(list_news.called)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(gzip.decompress(second.data), plain.data)
+
+    def test_new_versions_are_rendered(self):
+        etag = self.get_news('gzip').headers['ETag']
+        with patch('builtins.open', mock_open(), create=True):
+            self.post('/news', session=self.session, data={
+                'title': 'Local Man Drinks Tea',
+                'body': 'Test post pls ignore',
+                'tags': ['james']
+            })
+        response = self.get_news('gzip')
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(
+            len(json.loads(gzip.decompress(response.data).decode())['news']),
+            6)
+
+
+if __name__ == "__main__":
+    unittest.main()
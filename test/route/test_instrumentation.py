@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import mock_open, patch
+from test_util import HouraiTeahouseTestCase
+from houraiteahouse.route import instrumentation
+from houraiteahouse.storage.models import db, hasher, Language
+from houraiteahouse.util import metrics
+
+USERNAME = 'news'
+
+
+class InstrumentationTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        db.session.add(Language('en_US', 'English'))
+        db.session.commit()
+
+    def sample(self, name, **labels):
+        metric = instrumentation.registry.get(name)
+        return metric.snapshot().get(
+            tuple(str(labels[label]) for label in metric.label_names), 0)
+
+    def test_requests_are_recorded_per_endpoint(self):
+        requests = self.sample('http_requests_total',
+                               endpoint='news.list_news', method='GET',
+                               status=200)
+        statements = self.sample('http_request_sql_statements_total',
+                                 endpoint='news.list_news')
+        with self.count_queries() as queries:
+            self.get('/news?language=en_US')
+        self.assertEqual(
+            self.sample('http_requests_total', endpoint='news.list_news',
+                        method='GET', status=200), requests + 1)
+        self.assertEqual(
+            self.sample('http_request_sql_statements_total',
+                        endpoint='news.list_news'), statements + len(queries))
+        self.assertGreater(
+            self.sample('http_request_resource_seconds_total',
+                        endpoint='news.list_news', resource='db'), 0)
+
+    def test_unhandled_errors_are_recorded(self):
+        def fail():
+            raise RuntimeError
+        self.app.add_url_rule('/fail', 'fail', fail)
+        requests = self.sample('http_requests_total', endpoint='fail',
+                               method='GET', status=500)
+        latency = instrumentation.request_latency.snapshot()
+        with self.assertRaises(RuntimeError):
+            self.client.get('/fail')
+        self.assertEqual(
+            self.sample('http_requests_total', endpoint='fail', method='GET',
+                        status=500), requests + 1)
+        self.assertNotEqual(instrumentation.request_latency.snapshot(),
+                            latency)
+        self.assertIsNone(metrics.stop_request_timings())
+
+    def test_file_io_is_timed(self):
+        session = self.register_and_login(USERNAME, 'password')
+        self.adminify(USERNAME)
+        with patch('builtins.open', mock_open(), create=True):
+            self.post('/news', session=session, data={
+                'title': 'Local Man Drinks Tea', 'body': 'Tea',
+                'tags': ['tea']})
+        self.assertGreater(
+            self.sample('http_request_resource_seconds_total',
+                        endpoint='news.create_news', resource='news_io'), 0)
+
+    def test_bcrypt_is_timed(self):
+        timings = metrics.start_request_timings()
+        try:
+            hasher.generate_password_hash('password')
+        finally:
+            metrics.stop_request_timings()
+        self.assertEqual(timings['bcrypt_count'], 1)
+        self.assertGreater(timings['bcrypt'], 0)
+
+    def test_metrics_are_exposed(self):
+        self.get('/news/missing?language=en_US')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode('utf-8')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('status="404"', text)
+
+    def test_metrics_are_shared_through_a_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        instrumentation._store = metrics.MultiProcessStore(directory)
+        self.addCleanup(setattr, instrumentation, '_store', None)
+        text = self.client.get('/metrics').data.decode('utf-8')
+        self.assertIn('http_requests_total{', text)
+        self.assertTrue(os.listdir(directory))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,8 @@
 import unittest
+from flask import json
+from houraiteahouse.storage import auth_storage
+from houraiteahouse.storage.models import hasher
+from houraiteahouse.util.hashing import hash_log_rounds
 from test_util import HouraiTeahouseTestCase
 
 
@@ -28,5 +32,20 @@ class LoginTest(HouraiTeahouseTestCase):
         })
         self.assert403(response)
 
+    def test_login_rehashes_outdated_password(self):
+        self.register('ad@min', 'admin', 'password')
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        hasher.init_app(self.app)
+
+        response = self.client.post('/auth/login', data=json.dumps({
+            'username': 'admin',
+            'password': 'password'
+        }), content_type='application/json')
+        self.assert200(response)
+
+        user = auth_storage.get_user('admin')
+        self.assertEqual(hash_log_rounds(user.password), 5)
+        self.assertTrue(user.check_password('password'))
+
 if __name__ == "__main__":
     unittest.main()
@@ -15,11 +15,12 @@ class NewsTest(HouraiTeahouseTestCase):
         db.session.add(lang)
         db.session.commit()
 
-    def post_test_news(self, session_id=None):
+    def post_test_news(self, session_id=None,
+                       title='Local Man Drinks Mountain Dew'):
         # TODO(james7132): Add file read/write checks
         m = mock_open()
         data = {
-            'title': 'Local Man Drinks Mountain Dew',
+            'title': title,
             'body': 'Test post pls ignore',
             'tags': [
                 'james', 'mountain dew', 'local man'
@@ -32,10 +33,134 @@ class NewsTest(HouraiTeahouseTestCase):
         response = self.client.get('/news')
         self.assert400(response)
 
+    def test_list_fails_on_unknown_language(self):
+        response = self.client.get('/news?language=xx')
+        self.assert400(response)
+
     def test_list_doesnt_fail_on_empty_news(self):
         response = self.client.get('/news?language=en_US')
         self.assert200(response)
 
+    def test_list_is_paginated(self):
+        self.adminify(USERNAME)
+        for i in range(3):
+            response = self.post_test_news(
+                self.session, 'Local Man Drinks {0}'.format(i))
+            self.assert200(response)
+
+        response = self.client.get('/news?language=en_US&limit=2')
+        self.assert200(response)
+        self.assertEqual(
+            [post['title'] for post in response.json['news']],
+            ['Local Man Drinks 2', 'Local Man Drinks 1'])
+        self.assertIsNotNone(response.json['next'])
+
+        response = self.client.get('/news?language=en_US&limit=2&cursor=' +
+                                   response.json['next'])
+        self.assert200(response)
+        self.assertEqual(
+            [post['title'] for post in response.json['news']],
+            ['Local Man Drinks 0'])
+        self.assertIsNone(response.json['next'])
+
+    def test_list_fails_on_invalid_cursor(self):
+        response = self.client.get('/news?language=en_US&cursor=garbage')
+        self.assert400(response)
+
+    def test_list_fails_on_invalid_limit(self):
+        response = self.client.get('/news?language=en_US&limit=ten')
+        self.assert400(response)
+
+    def test_tagged_list_is_paginated(self):
+        self.adminify(USERNAME)
+        for i in range(3):
+            self.post_test_news(self.session, 'Local Man Drinks {0}'.format(i))
+
+        response = self.client.get('/news/tag/james?language=en_US&limit=2')
+        self.assert200(response)
+        self.assertEqual(len(response.json['news']), 2)
+        response = self.client.get('/news/tag/james?language=en_US&limit=2'
+                                   '&cursor=' + response.json['next'])
+        self.assertEqual(len(response.json['news']), 1)
+        self.assertIsNone(response.json['next'])
+
+    def test_get_supports_conditional_requests(self):
+        self.adminify(USERNAME)
+        post_id = self.post_test_news(self.session).json['post_id']
+        uri = '/news/{0}?language=en_US'.format(post_id)
+
+        with patch('builtins.open', mock_open(read_data='Test post')):
+            response = self.client.get(uri)
+        self.assert200(response)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        m = mock_open()
+        with patch('builtins.open', m):
+            response = self.client.get(uri, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(
+                uri, headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+        self.assertFalse(m.called)
+
+    def test_get_is_modified_by_new_comments(self):
+        self.adminify(USERNAME)
+        post_id = self.post_test_news(self.session).json['post_id']
+        uri = '/news/{0}?language=en_US'.format(post_id)
+        with patch('builtins.open', mock_open()):
+            etag = self.client.get(uri).headers['ETag']
+            self.post('/news/{0}/comment'.format(post_id),
+                      session=self.session, data={'body': 'Hello World'})
+            response = self.client.get(uri, headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_list_supports_conditional_requests(self):
+        self.adminify(USERNAME)
+        self.post_test_news(self.session)
+        response = self.client.get('/news?language=en_US')
+        etag = response.headers['ETag']
+
+        response = self.client.get('/news?language=en_US',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.post_test_news(self.session, 'Local Man Drinks Tea')
+        response = self.client.get('/news?language=en_US',
+                                   headers={'If-None-Match': etag})
+        self.assert200(response)
+
+    def test_tags_lists_post_counts(self):
+        self.adminify(USERNAME)
+        self.post_test_news(self.session)
+        response = self.client.get('/news/tags')
+        self.assert200(response)
+        self.assertEqual(response.json['tags'], [
+            {'name': 'james', 'count': 1},
+            {'name': 'local man', 'count': 1},
+            {'name': 'mountain dew', 'count': 1}
+        ])
+
+    def test_search_finds_posts(self):
+        self.adminify(USERNAME)
+        self.post_test_news(self.session)
+        self.post_test_news(self.session, 'Local Man Drinks Tea')
+
+        response = self.client.get('/news/search?language=en_US&q=tea')
+        self.assert200(response)
+        self.assertEqual(
+            [post['title'] for post in response.json['results']],
+            ['Local Man Drinks Tea'])
+
+    def test_search_requires_query(self):
+        response = self.client.get('/news/search?language=en_US')
+        self.assert400(response)
+
+    def test_search_fails_without_language(self):
+        response = self.client.get('/news/search?q=tea')
+        self.assert400(response)
+
     def test_get_fails_without_language(self):
         response = self.client.get('/news/1')
         self.assert400(response)
@@ -108,6 +233,49 @@ class NewsTest(HouraiTeahouseTestCase):
         response = self.post('/news/1/translate', session=self.session)
         self.assert403(response)
 
+    def test_comments_are_paginated(self):
+        self.adminify(USERNAME)
+        post_id = self.post_test_news(self.session).json['post_id']
+        uri = '/news/{0}/comments'.format(post_id)
+        with patch('builtins.open', mock_open()):
+            for i in range(3):
+                self.post('/news/{0}/comment'.format(post_id),
+                          session=self.session,
+                          data={'body': 'Comment {0}'.format(i)})
+
+        response = self.client.get(uri + '?limit=2')
+        self.assert200(response)
+        self.assertEqual([c['body'] for c in response.json['comments']],
+                         ['Comment 0', 'Comment 1'])
+        response = self.client.get(uri + '?limit=2&cursor=' +
+                                   response.json['next'])
+        self.assertEqual([c['body'] for c in response.json['comments']],
+                         ['Comment 2'])
+        self.assertIsNone(response.json['next'])
+
+    def test_comments_fail_on_missing_post(self):
+        self.assert404(self.client.get('/news/missing/comments'))
+
+    def test_comments_fail_on_invalid_cursor(self):
+        self.adminify(USERNAME)
+        post_id = self.post_test_news(self.session).json['post_id']
+        self.assert400(self.client.get(
+            '/news/{0}/comments?cursor=garbage'.format(post_id)))
+
+    def test_get_can_leave_out_comments(self):
+        self.adminify(USERNAME)
+        post_id = self.post_test_news(self.session).json['post_id']
+        uri = '/news/{0}?language=en_US'.format(post_id)
+        with patch('builtins.open', mock_open()):
+            self.post('/news/{0}/comment'.format(post_id),
+                      session=self.session, data={'body': 'Hello World'})
+            full = self.client.get(uri)
+            response = self.client.get(uri + '&comments=false')
+        self.assertIn('comments', full.json)
+        self.assertNotIn('comments', response.json)
+        self.assertEqual(response.json['commentCount'], 1)
+        self.assertNotEqual(response.headers['ETag'], full.headers['ETag'])
+
     def test_comment_post_fails_on_missing_post(self):
         response = self.post('/news/1/comment', session=self.session,
                              data={'body': 'Hello World'})
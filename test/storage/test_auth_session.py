@@ -0,0 +1,101 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from houraiteahouse.storage import auth_storage
+from houraiteahouse.storage.models import db, UserSession
+from test_util import HouraiTeahouseTestCase
+
+
+class AuthSessionStorageTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.user = self.register('test@test', 'test', 'test')
+
+    def open_session(self, valid_before):
+        session = UserSession(self.user)
+        session.valid_before = valid_before
+        db.session.add(session)
+        db.session.commit()
+        return session.session_uuid
+
+    def test_reap_deletes_only_expired_sessions(self):
+        now = datetime.utcnow()
+        expired = self.open_session(now - timedelta(minutes=1))
+        active = self.open_session(now + timedelta(days=1))
+        remembered = self.open_session(None)
+
+        self.assertEqual(auth_storage.reap_expired_sessions(now=now), 1)
+        self.assertIsNone(auth_storage.get_session_info(expired))
+        self.assertIsNotNone(auth_storage.get_session_info(active))
+        self.assertIsNotNone(auth_storage.get_session_info(remembered))
+        self.assertEqual(auth_storage.count_sessions(), 2)
+        self.assertEqual(auth_storage.session_rows.value, 2)
+
+    def test_reaping_does_not_count_sessions(self):
+        self.open_session(datetime.utcnow() - timedelta(minutes=1))
+        with self.count_queries() as statements:
+            auth_storage.reap_expired_sessions()
+        self.assertFalse([statement for statement in statements
+                          if 'count(' in statement])
+
+    def test_reaper_starts_with_first_request(self):
+        reaper = auth_storage.SessionReaper()
+        self.app.config['SESSION_REAP_INTERVAL'] = 3600
+        reaper.init_app(self.app)
+        self.addCleanup(reaper.stop)
+        self.assertIsNone(reaper._timer)
+        self.client.get('/news?language=en_US')
+        timer = reaper._timer
+        self.assertTrue(timer.is_alive())
+        self.client.get('/news?language=en_US')
+        self.assertIs(reaper._timer, timer)
+
+    def test_reap_works_in_batches(self):
+        now = datetime.utcnow()
+        for i in range(5):
+            self.open_session(now - timedelta(minutes=i + 1))
+        reaped = auth_storage.sessions_reaped.value
+
+        self.assertEqual(
+            auth_storage.reap_expired_sessions(batch_size=2, now=now), 5)
+        self.assertEqual(UserSession.query.count(), 0)
+        self.assertEqual(auth_storage.sessions_reaped.value, reaped + 5)
+
+    def test_reap_evicts_cached_sessions(self):
+        now = datetime.utcnow()
+        session_uuid = self.open_session(now + timedelta(minutes=1))
+        self.assertIsNotNone(auth_storage.get_session_info(session_uuid))
+
+        later = now + timedelta(minutes=2)
+        self.assertEqual(auth_storage.reap_expired_sessions(now=later), 1)
+        self.assertIsNone(auth_storage.session_cache.get(session_uuid))
+
+
+class SessionCacheTest(unittest.TestCase):
+
+    def info(self, session_uuid):
+        return auth_storage.SessionInfo(session_uuid, 1, 'test', 'test@test',
+                                        {'master': False}, datetime.utcnow(),
+                                        None)
+
+    def test_oldest_entries_are_evicted(self):
+        cache = auth_storage.SessionCache(max_entries=2)
+        for session_uuid in ('a', 'b', 'c'):
+            cache.put(self.info(session_uuid))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_expired_entries_are_swept_on_put(self):
+        cache = auth_storage.SessionCache(ttl=10)
+        with patch('time.monotonic', return_value=100):
+            cache.put(self.info('a'))
+            cache.put(self.info('b'))
+        with patch('time.monotonic', return_value=115):
+            cache.put(self.info('c'))
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
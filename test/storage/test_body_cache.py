@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from houraiteahouse.storage.body_cache import NewsBodyCache
+
+
+class NewsBodyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, body, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(body)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_repeated_reads_hit(self):
+        cache = NewsBodyCache()
+        path = self.write('post', 'Hello World')
+        self.assertEqual(cache.read(path), 'Hello World')
+        self.assertEqual(cache.read(path), 'Hello World')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_modified_file_is_reread(self):
+        cache = NewsBodyCache()
+        path = self.write('post', 'Hello World', mtime=time.time() - 60)
+        cache.read(path)
+        self.write('post', 'Goodbye World')
+        self.assertEqual(cache.read(path), 'Goodbye World')
+        self.assertEqual(cache.hits, 0)
+
+    def test_invalidate_drops_entry(self):
+        cache = NewsBodyCache()
+        path = self.write('post', 'Hello World')
+        cache.read(path)
+        cache.invalidate(path)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = NewsBodyCache(max_bytes=10)
+        first = self.write('first', '12345')
+        second = self.write('second', '12345')
+        third = self.write('third', '12345')
+        cache.read(first)
+        cache.read(second)
+        cache.read(first)
+        cache.read(third)
+        self.assertEqual(cache.evictions, 1)
+        cache.read(first)
+        self.assertEqual(cache.hits, 2)
+        cache.read(second)
+        self.assertEqual(cache.misses, 4)
+
+    def test_oversized_bodies_are_not_cached(self):
+        cache = NewsBodyCache(max_bytes=4)
+        path = self.write('post', 'Hello World')
+        self.assertEqual(cache.read(path), 'Hello World')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_large_bodies_are_not_cached(self):
+        cache = NewsBodyCache(max_entry_bytes=4)
+        path = self.write('post', 'Hello World')
+        self.assertEqual(cache.read(path), 'Hello World')
+        self.assertEqual(cache.read(path), 'Hello World')
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_hits_do_not_reread(self):
+        cache = NewsBodyCache()
+        path = self.write('post', 'Hello World')
+        body = cache.read(path)
+        with patch('builtins.open', side_effect=AssertionError):
+            self.assertIs(cache.read(path), body)
+
+    def test_replaced_file_is_reread(self):
+        cache = NewsBodyCache()
+        path = self.write('post', 'Hello World')
+        cache.read(path)
+        temp = self.write('post.tmp', 'Goodbye World!')
+        os.replace(temp, path)
+        self.assertEqual(cache.read(path), 'Goodbye World!')
+
+    def test_missing_file_raises(self):
+        cache = NewsBodyCache()
+        with self.assertRaises(OSError):
+            cache.read(os.path.join(self.directory, 'missing'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from houraiteahouse.storage import news_storage
+from houraiteahouse.storage.body_cache import NewsBodyCache
+from houraiteahouse.storage.body_store import body_store, copy_bodies, \
+    create_body_store, BodyNotFound, BodyStore, DatabaseBodyStore, \
+    FileSystemBodyStore, LocalObjectClient, ObjectBodyStore
+from houraiteahouse.storage.models import db, Language, NewsBody, NewsPost
+from test_util import HouraiTeahouseTestCase
+
+BODY = 'Tea is green. ' * 100
+
+
+class BodyStoreContract(object):
+    """
+    Behaviour every body store must share.  Subclasses set self.store.
+    """
+
+    def test_round_trip(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        self.assertEqual(self.store.read('Post-1', 'en_US'), BODY)
+        self.store.write('Post-1', 'en_US', 'Edited')
+        self.assertEqual(self.store.read('Post-1', 'en_US'), 'Edited')
+
+    def test_missing_body(self):
+        with self.assertRaises(BodyNotFound):
+            self.store.read('Post-1', 'en_US')
+        # Callers handle missing bodies as missing files
+        with self.assertRaises(IOError):
+            self.store.read('Post-1', 'en_US')
+
+    def test_keys(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        self.store.write('Post-1', 'ja', BODY)
+        self.store.write('Post-2', 'en_US', BODY)
+        self.assertEqual(sorted(self.store.keys()),
+                         [('Post-1', 'en_US'), ('Post-1', 'ja'),
+                          ('Post-2', 'en_US')])
+
+    def test_delete(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        self.store.delete('Post-1', 'en_US')
+        self.store.delete('Post-1', 'en_US')
+        with self.assertRaises(BodyNotFound):
+            self.store.read('Post-1', 'en_US')
+        self.assertEqual(list(self.store.keys()), [])
+
+
+class FileSystemBodyStoreTest(BodyStoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = NewsBodyCache()
+        self.store = FileSystemBodyStore(self.directory, self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_are_cached(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        self.store.read('Post-1', 'en_US')
+        self.store.read('Post-1', 'en_US')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_failed_writes_keep_old_body(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        with patch('os.replace', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.store.write('Post-1', 'en_US', 'Edited')
+        self.assertEqual(self.store.read('Post-1', 'en_US'), BODY)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'en_US')),
+                         ['Post-1'])
+
+    def test_rejects_keys_outside_directory(self):
+        for post_short, language in [('../escape', 'en_US'),
+                                     ('..', 'en_US'),
+                                     ('Post-1', '..'),
+                                     ('Post-1', 'en_US/..'),
+                                     ('', 'en_US')]:
+            with self.assertRaises(ValueError):
+                self.store.write(post_short, language, BODY)
+            with self.assertRaises(ValueError):
+                self.store.read(post_short, language)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_interface_is_abstract(self):
+        class PartialStore(BodyStore):
+            def read(self, post_short, language):
+                return BODY
+
+        with self.assertRaises(TypeError):
+            PartialStore()
+
+
+class ObjectBodyStoreTest(BodyStoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = LocalObjectClient(self.directory)
+        self.store = ObjectBodyStore(self.client, 'news/')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_keys_are_prefixed(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        self.client.put('other/object', b'data')
+        self.assertEqual(self.client.list(),
+                         ['news/en_US/Post-1', 'other/object'])
+        self.assertEqual(self.store.keys(), [('Post-1', 'en_US')])
+
+    def test_rejects_keys_outside_directory(self):
+        with self.assertRaises(ValueError):
+            self.client.put('news/../../escape', b'data')
+
+    def test_from_url(self):
+        store = create_body_store('object', {
+            'NEWS_BODY_OBJECT_STORE_URL': 'file://' + self.directory})
+        store.write('Post-1', 'en_US', BODY)
+        self.assertEqual(self.store.client.get('en_US/Post-1'),
+                         BODY.encode('utf-8'))
+
+
+class DatabaseBodyStoreTest(BodyStoreContract, HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        author = self.register('news@news', 'news', 'password')
+        db.session.add_all([Language('en_US', 'English'),
+                            Language('ja', 'Japanese')])
+        for post_short in ('Post-1', 'Post-2'):
+            db.session.add(NewsPost(post_short, post_short,
+                                    datetime.utcnow(), author, []))
+        db.session.commit()
+        self.store = DatabaseBodyStore()
+
+    def test_bodies_are_compressed(self):
+        self.store.write('Post-1', 'en_US', BODY)
+        db.session.commit()
+        self.assertLess(len(NewsBody.query.one().body), len(BODY) // 10)
+
+    def test_unknown_post(self):
+        with self.assertRaises(ValueError):
+            self.store.write('Post-3', 'en_US', BODY)
+        with self.assertRaises(ValueError):
+            self.store.write('Post-1', 'xx', BODY)
+
+    def test_news_storage_uses_store(self):
+        session = self.login('news', 'password').session_uuid
+        with patch.object(body_store, 'backend', self.store), \
+                patch('builtins.open', side_effect=AssertionError):
+            post = news_storage.post_news('Title', 'Body', [], session)
+            self.assertEqual(post['body'], 'Body')
+            news_storage.translate_news(post['post_id'], 'ja', 'Taitoru',
+                                        'Honbun')
+            self.assertEqual(news_storage.get_news(post['post_id'], None,
+                                                   'ja')['body'], 'Honbun')
+
+
+class CopyBodiesTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        author = self.register('news@news', 'news', 'password')
+        db.session.add(Language('en_US', 'English'))
+        db.session.add(NewsPost('Post-1', 'Post 1', datetime.utcnow(),
+                                author, []))
+        db.session.commit()
+
+    def tearDown(self):
+        HouraiTeahouseTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_moves_between_every_store(self):
+        files = FileSystemBodyStore(self.directory + '/files')
+        database = DatabaseBodyStore()
+        objects = ObjectBodyStore(LocalObjectClient(self.directory +
+                                                    '/objects'))
+        files.write('Post-1', 'en_US', BODY)
+
+        self.assertEqual(copy_bodies(files, database, delete=True), 1)
+        self.assertEqual(files.keys(), [])
+        db.session.remove()
+        self.assertEqual(database.read('Post-1', 'en_US'), BODY)
+
+        self.assertEqual(copy_bodies(database, objects, delete=True), 1)
+        self.assertEqual(database.keys(), [])
+        self.assertEqual(objects.read('Post-1', 'en_US'), BODY)
+
+        self.assertEqual(copy_bodies(objects, files), 1)
+        self.assertEqual(files.read('Post-1', 'en_US'), BODY)
+        self.assertEqual(objects.keys(), [('Post-1', 'en_US')])
+
+
+if __name__ == "__main__":
+    unittest.main()
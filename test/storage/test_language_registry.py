@@ -0,0 +1,55 @@
+import unittest
+from houraiteahouse.storage import news_storage
+from houraiteahouse.storage.language_registry import languages
+from houraiteahouse.storage.models import db, Language
+from test_util import HouraiTeahouseTestCase
+
+
+class LanguageRegistryTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        db.session.add(Language('en_US', 'English'))
+        db.session.commit()
+
+    def test_resolving_languages_costs_no_queries(self):
+        languages.get('en_US')
+        with self.count_queries() as queries:
+            self.assertEqual(news_storage.get_language('en_US').language_code,
+                             'en_US')
+            self.assertEqual(news_storage.get_language('xx').language_code,
+                             'en_US')
+            self.assertIn('en_US', languages)
+        self.assertEqual(len(queries), 0)
+
+    def test_registry_is_immutable(self):
+        with self.assertRaises(TypeError):
+            languages.by_code['ja'] = None
+
+    def test_committed_languages_are_picked_up(self):
+        self.assertNotIn('ja', languages)
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.commit()
+        self.assertEqual(languages.get('ja').language_name, 'Japanese')
+        self.assertEqual(languages.by_id[languages.get('ja').id].language_code,
+                         'ja')
+
+    def test_rolled_back_languages_are_ignored(self):
+        self.assertNotIn('ja', languages)
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertNotIn('ja', languages)
+
+    def test_reload_replaces_contents(self):
+        self.assertNotIn('ja', languages)
+        # Bypasses the ORM, so the registry is not told about the change
+        db.session.execute(Language.__table__.insert().values(
+            language_code='ja', language_name='Japanese'))
+        self.assertNotIn('ja', languages)
+        self.assertEqual(languages.reload(), 2)
+        self.assertIn('ja', languages)
+
+
+if __name__ == "__main__":
+    unittest.main()
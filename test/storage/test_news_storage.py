@@ -0,0 +1,182 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import mock_open, patch
+from werkzeug.contrib.cache import SimpleCache
+from houraiteahouse.storage import news_storage, summary_storage
+from houraiteahouse.storage.models import cache, db, Language, \
+    NewsComment, NewsPost, NewsTag, NewsTitle
+from houraiteahouse.storage.translation_index import translations
+from test_util import HouraiTeahouseTestCase
+
+
+class NewsStorageTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.author = self.register('news@news', 'news', 'password')
+        self.commenter = self.register('comment@news', 'commenter',
+                                       'password')
+        self.language = Language('en_US', 'English')
+        db.session.add(self.language)
+        db.session.commit()
+        self.post_count = 0
+
+    def create_posts(self, count, comments=2):
+        tag = NewsTag.query.filter_by(name='test').first() or NewsTag('test')
+        start = datetime.utcnow()
+        for i in range(count):
+            self.post_count += 1
+            title = 'Post {0}'.format(self.post_count)
+            post = NewsPost(title.replace(' ', '-'), title,
+                            start + timedelta(seconds=i), self.author, [tag])
+            db.session.add(post)
+            db.session.add(NewsTitle(post, self.language, title))
+            for j in range(comments):
+                db.session.add(NewsComment('Comment {0}'.format(j),
+                                           self.commenter, post))
+        db.session.commit()
+
+    def serialize_all(self):
+        posts = NewsPost.query.order_by(NewsPost.created.desc()).all()
+        return news_storage.news_page_to_dicts(posts, language='en_US')
+
+    def test_serializes_page(self):
+        self.create_posts(2)
+        news = self.serialize_all()
+        self.assertEqual([post['title'] for post in news],
+                         ['Post 2', 'Post 1'])
+        for post in news:
+            self.assertEqual(post['author'], 'news')
+            self.assertEqual(post['tags'], ['test'])
+            self.assertEqual([c['author'] for c in post['comments']],
+                             ['commenter', 'commenter'])
+
+    def test_serialization_query_count_is_constant(self):
+        self.create_posts(2)
+        db.session.expire_all()
+        with self.count_queries() as small_page:
+            self.serialize_all()
+
+        self.create_posts(8)
+        db.session.expire_all()
+        with self.count_queries() as large_page:
+            self.assertEqual(len(self.serialize_all()), 10)
+
+        self.assertEqual(len(small_page), len(large_page))
+
+    def test_list_news_is_served_from_summaries(self):
+        self.create_posts(2)
+        summary_storage.rebuild_summaries()
+        with self.count_queries() as queries:
+            news = news_storage.list_news('en_US')['news']
+        self.assertEqual([post['title'] for post in news],
+                         ['Post 2', 'Post 1'])
+        self.assertEqual(news[0]['commentCount'], 2)
+        self.assertEqual(news[0]['tags'], ['test'])
+        self.assertEqual(news[0]['author'], 'news')
+        # Languages are resolved in memory, leaving only the page itself
+        self.assertEqual(len(queries), 1)
+
+    def test_summaries_track_translations(self):
+        self.create_posts(1)
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.commit()
+        summary_storage.rebuild_summaries()
+        self.assertEqual(news_storage.list_news('ja')['news'][0]['title'],
+                         'Post 1')
+
+        with patch('builtins.open', mock_open(), create=True):
+            news_storage.translate_news('Post-1', 'ja', 'Toukou 1', 'Honbun')
+
+        self.assertEqual(news_storage.list_news('ja')['news'][0]['title'],
+                         'Toukou 1')
+        self.assertEqual(news_storage.list_news('en_US')['news'][0]['title'],
+                         'Post 1')
+
+    def test_summary_titles_follow_fallbacks(self):
+        self.create_posts(1)
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.add(Language('zh', 'Chinese'))
+        db.session.commit()
+        with patch.object(translations, 'fallbacks', {'zh': ['ja']}):
+            summary_storage.rebuild_summaries()
+            self.assertEqual(
+                news_storage.list_news('zh')['news'][0]['title'], 'Post 1')
+
+            news_storage.translate_news('Post-1', 'ja', 'Toukou 1',
+                                        'Honbun')
+
+            self.assertEqual(
+                news_storage.list_news('zh')['news'][0]['title'],
+                'Toukou 1')
+        self.assertEqual(news_storage.list_news('en_US')['news'][0]['title'],
+                         'Post 1')
+
+    def test_summaries_track_comments(self):
+        self.create_posts(1, comments=0)
+        summary_storage.rebuild_summaries()
+        session = self.login('commenter', 'password').session_uuid
+
+        news_storage.post_comment('Post-1', 'First', session)
+
+        news = news_storage.list_news('en_US')['news']
+        self.assertEqual(news[0]['commentCount'], 1)
+
+    def test_comments_are_paginated(self):
+        self.create_posts(1, comments=5)
+        page = news_storage.list_comments('Post-1', limit=2)
+        self.assertEqual([comment['body'] for comment in page['comments']],
+                         ['Comment 0', 'Comment 1'])
+        bodies = []
+        while page['next']:
+            page = news_storage.list_comments('Post-1', cursor=page['next'],
+                                              limit=2)
+            bodies += [comment['body'] for comment in page['comments']]
+        self.assertEqual(bodies, ['Comment 2', 'Comment 3', 'Comment 4'])
+
+    def test_post_can_leave_out_comments(self):
+        self.create_posts(1, comments=3)
+        summary_storage.rebuild_summaries()
+        with patch.object(news_storage, 'read_news_body', return_value=''):
+            with self.count_queries() as with_comments:
+                news_storage.get_news('Post-1', None)
+            db.session.remove()
+            with self.count_queries() as without_comments:
+                news = news_storage.get_news('Post-1', None,
+                                             include_comments=False)
+        self.assertNotIn('comments', news)
+        self.assertEqual(news['commentCount'], 3)
+        self.assertFalse(any('newscomment' in statement
+                             for statement in without_comments))
+        self.assertTrue(any('newscomment' in statement
+                            for statement in with_comments))
+
+    def test_tag_counts_use_a_single_query(self):
+        self.create_posts(3)
+        db.session.add(NewsTag('unused'))
+        db.session.commit()
+        with self.count_queries() as queries:
+            counts = news_storage.tag_counts()
+        self.assertEqual(counts, [{'name': 'test', 'count': 3},
+                                  {'name': 'unused', 'count': 0}])
+        self.assertEqual(len(queries), 1)
+
+    def test_tag_counts_are_cached_until_news_is_posted(self):
+        self.create_posts(1)
+        session = self.login('news', 'password').session_uuid
+        with patch.dict(self.app.extensions['cache'], {cache: SimpleCache()}):
+            news_storage.tag_counts()
+            with self.count_queries() as queries:
+                news_storage.tag_counts()
+            self.assertEqual(len(queries), 0)
+
+            with patch('builtins.open', mock_open(), create=True):
+                news_storage.post_news('Post 2', 'Body', ['test', 'new'],
+                                       session)
+            self.assertEqual(news_storage.tag_counts(),
+                             [{'name': 'new', 'count': 1},
+                              {'name': 'test', 'count': 2}])
+
+
+if __name__ == "__main__":
+    unittest.main()
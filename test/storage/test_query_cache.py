@@ -0,0 +1,131 @@
+import unittest
+from houraiteahouse.storage import auth_storage
+from houraiteahouse.storage.models import cache, db, Language, NewsTag
+from houraiteahouse.storage.query_cache import cache_policy
+from test_util import HouraiTeahouseTestCase
+
+
+class QueryCacheTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        db.session.add(NewsTag('tea'))
+        db.session.commit()
+        # Start every read from a clean identity map, as a new request would
+        db.session.remove()
+
+    def assert_cached(self, read):
+        read()
+        db.session.remove()
+        with self.count_queries() as queries:
+            result = read()
+        self.assertEqual(len(queries), 0)
+        return result
+
+    def test_reads_are_cached(self):
+        self.assertEqual(self.assert_cached(
+            lambda: NewsTag.get(name='tea')).name, 'tea')
+
+    def test_updates_invalidate_cached_reads(self):
+        self.assert_cached(lambda: NewsTag.get(name='tea'))
+        tag = NewsTag.query.filter_by(name='tea').first()
+        tag.name = 'coffee'
+        db.session.commit()
+        db.session.remove()
+
+        self.assertIsNone(NewsTag.get(name='tea'))
+        self.assertIsNotNone(NewsTag.get(name='coffee'))
+
+    def test_bulk_deletes_invalidate_cached_reads(self):
+        user_id = self.register('test@test', 'test', 'test').id
+        session_uuid = self.login('test', 'test').session_uuid
+        self.assert_cached(
+            lambda: auth_storage.get_user_session(session_uuid))
+
+        auth_storage.close_all_sessions(user_id)
+        db.session.remove()
+        self.assertIsNone(auth_storage.get_user_session(session_uuid))
+
+    def test_writes_to_other_tables_keep_entries(self):
+        self.assert_cached(lambda: NewsTag.get(name='tea'))
+        db.session.add(Language('en_US', 'English'))
+        db.session.commit()
+        db.session.remove()
+        with self.count_queries() as queries:
+            NewsTag.get(name='tea')
+        self.assertEqual(len(queries), 0)
+
+    def test_rolled_back_writes_keep_entries(self):
+        self.assert_cached(lambda: NewsTag.get(name='tea'))
+        db.session.add(NewsTag('coffee'))
+        db.session.flush()
+        db.session.rollback()
+        db.session.remove()
+        with self.count_queries() as queries:
+            NewsTag.get(name='tea')
+        self.assertEqual(len(queries), 0)
+
+    def test_transactions_see_their_own_writes(self):
+        self.assertIsNone(NewsTag.get(name='coffee'))
+        db.session.add(NewsTag('coffee'))
+        db.session.flush()
+        self.assertIsNotNone(NewsTag.get(name='coffee'))
+        db.session.rollback()
+
+    def test_rolled_back_writes_are_never_cached(self):
+        db.session.add(NewsTag('coffee'))
+        db.session.flush()
+        NewsTag.get(name='coffee')
+        db.session.rollback()
+        db.session.remove()
+        self.assertIsNone(NewsTag.get(name='coffee'))
+
+    def set_policies(self, policies, backends=None):
+        self.app.config['CACHE_POLICIES'] = policies
+        self.app.config['CACHE_BACKENDS'] = backends or {}
+        cache_policy.init_app(self.app)
+
+    def test_policies_can_disable_caching(self):
+        self.set_policies({'newstag': {'enabled': False}})
+        NewsTag.get(name='tea')
+        db.session.remove()
+        with self.count_queries() as queries:
+            NewsTag.get(name='tea')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('newstag', cache_policy.stats())
+
+    def test_default_policy_applies_to_every_family(self):
+        self.set_policies({'default': {'enabled': False},
+                           'newstag': {'timeout': 60}})
+        self.assertFalse(cache_policy.policy('languages').enabled)
+        self.assertEqual(cache_policy.policy('newstag'),
+                         (False, 60, 'default'))
+
+    def test_policies_can_choose_a_backend(self):
+        self.set_policies({'newstag': {'backend': 'local'}},
+                          {'local': {'CACHE_TYPE': 'simple'}})
+        local = cache_policy.backend(cache_policy.policy('newstag'), cache)
+        self.assert_cached(lambda: NewsTag.get(name='tea'))
+        self.assertTrue(any(not key.startswith('table-generation')
+                            for key in local.cache._cache))
+        self.assertFalse(any(not key.startswith('table-generation')
+                             for key in cache.cache._cache))
+
+    def test_usage_is_counted_per_family(self):
+        self.set_policies({'newstag': {'backend': 'local'}},
+                          {'local': {'CACHE_TYPE': 'simple'}})
+        local = cache_policy.backend(cache_policy.policy('newstag'), cache)
+        self.assert_cached(lambda: NewsTag.get(name='tea'))
+        local.clear()
+        db.session.remove()
+        NewsTag.get(name='tea')
+
+        stats = cache_policy.stats()['newstag']
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertGreater(stats['bytes'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
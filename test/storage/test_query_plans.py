@@ -0,0 +1,147 @@
+import re
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import event
+from houraiteahouse.storage import auth_storage, news_storage, \
+    search_storage, summary_storage
+from houraiteahouse.storage.models import db, Language, NewsComment, \
+    NewsPost, NewsTag, NewsTitle
+from houraiteahouse.storage.translation_index import translations
+from test_util import HouraiTeahouseTestCase
+
+# Matches a step reading a whole table rather than searching an index.
+# Walking an index in order is still a scan of every row, unless the
+# statement stops after a bounded number of them
+FULL_SCAN = re.compile(
+    r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$')
+BOUNDED = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+class QueryPlanTest(HouraiTeahouseTestCase):
+    """
+    Runs storage functions and checks the plan SQLite chooses for every
+      statement they issue.  A full table scan on a hot path means a query
+      has lost the index it relies on.
+    """
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.author = self.register('news@news', 'news', 'password')
+        self.author_id = self.author.id
+        self.session = self.login('news', 'password').session_uuid
+        language = Language('en_US', 'English')
+        db.session.add(language)
+        tag = NewsTag('tea')
+        start = datetime.utcnow()
+        for i in range(3):
+            post = NewsPost('Post-{0}'.format(i), 'Post {0}'.format(i),
+                            start + timedelta(seconds=i), self.author, [tag])
+            db.session.add(post)
+            db.session.add(NewsTitle(post, language, 'Post {0}'.format(i)))
+            db.session.add(NewsComment('Comment', self.author, post))
+        db.session.commit()
+        summary_storage.rebuild_summaries()
+        # Built once per process, not on the request path
+        translations.reload()
+        self.post_id = NewsPost.query.first().id
+        db.session.remove()
+
+    @contextmanager
+    def capture_plans(self):
+        """
+        Yields a list which will contain the statement and query plan of
+          every statement issued within the block
+        """
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            if not executemany:
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        plans = []
+        try:
+            yield plans
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        cursor = db.session.connection().connection.cursor()
+        for statement, parameters in statements:
+            if statement.lstrip().upper().startswith('INSERT'):
+                continue
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plans.append((statement, [row[-1] for row in cursor.fetchall()]))
+
+    def assert_indexed(self, call, allow=()):
+        """
+        Fails if a statement issued by call scans an entire table
+        :param call: Function running the queries to check
+        :param allow: Tables which may be scanned, as reading every row is
+          the point of the query
+        """
+        with self.capture_plans() as plans:
+            call()
+        self.assertTrue(plans, 'No statements were issued')
+        for statement, plan in plans:
+            for step in plan:
+                match = FULL_SCAN.match(step)
+                if not match or match.group(1) in allow:
+                    continue
+                if not match.group(2) or not BOUNDED.search(statement):
+                    self.fail('Full scan of {0}:\n{1}\n{2}'.format(
+                        match.group(1), statement, '\n'.join(plan)))
+
+    def test_list_news(self):
+        self.assert_indexed(lambda: news_storage.list_news('en_US'))
+        self.assert_indexed(
+            lambda: news_storage.list_news_version('en_US'))
+
+    def test_tagged_news(self):
+        self.assert_indexed(lambda: news_storage.tagged_news('tea', 'en_US'))
+        self.assert_indexed(
+            lambda: news_storage.tagged_news_version('tea', 'en_US'))
+
+    def test_get_news(self):
+        self.assert_indexed(lambda: news_storage.news_version('Post-1'))
+        with patch.object(news_storage, 'read_news_body', return_value=''):
+            self.assert_indexed(
+                lambda: news_storage.get_news('Post-1', self.session))
+
+    def test_list_comments(self):
+        self.assert_indexed(lambda: news_storage.list_comments('Post-1'))
+
+    def test_post_comment(self):
+        self.assert_indexed(lambda: news_storage.post_comment(
+            'Post-1', 'Hello', self.session))
+
+    def test_search(self):
+        lang = news_storage.get_language('en_US')
+        self.assert_indexed(
+            lambda: search_storage.index_post(self.post_id, lang.id,
+                                              'Green tea', 'Tea is green'))
+        self.assert_indexed(lambda: search_storage.search('tea', lang, 10))
+
+    def test_refresh_summaries(self):
+        self.assert_indexed(
+            lambda: summary_storage.refresh_summaries([self.post_id]))
+
+    def test_sessions(self):
+        self.assert_indexed(
+            lambda: auth_storage.get_user_session(self.session))
+        self.assert_indexed(
+            lambda: auth_storage.close_all_sessions(self.author_id))
+        self.assert_indexed(lambda: auth_storage.reap_expired_sessions())
+
+    def test_translation_index_may_scan_titles(self):
+        # Rebuilding the index reads every localized title
+        self.assert_indexed(translations.reload, allow=('newstitle',))
+
+    def test_tag_counts_may_scan_tags(self):
+        # Every tag is listed, but posts must be counted through the index
+        self.assert_indexed(news_storage.tag_counts, allow=('newstag',))
+
+
+if __name__ == "__main__":
+    unittest.main()
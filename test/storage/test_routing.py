@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import unittest
+from flask_sqlalchemy_cache import FromCache
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from flask_testing import TestCase
+from houraiteahouse.app import create_app
+from houraiteahouse.config import TestConfig
+from houraiteahouse.storage import auth_storage, news_storage, \
+    search_storage
+from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage.models import db, cache, Language, NewsTag, \
+    User, UserPermissions
+from houraiteahouse.storage.routing import _ping
+
+
+class ReplicaTestCase(TestCase):
+    """
+    Routes reads between two SQLite files standing in for a primary and a
+      replica which is not being replicated to, so the database a query was
+      answered from shows in its result.
+    """
+    cache_type = 'null'
+
+    def create_app(self):
+        self.directory = tempfile.mkdtemp(prefix='htrouting')
+        cache_type = self.cache_type
+
+        class RoutingConfig(TestConfig):
+            CACHE_TYPE = cache_type
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                self.directory, 'primary.db')
+            SQLALCHEMY_BINDS = {
+                'replica0': 'sqlite:///' + os.path.join(self.directory,
+                                                        'replica.db')
+            }
+            SQLALCHEMY_READ_BINDS = ['replica0']
+            SQLALCHEMY_ENGINE_OPTIONS = {
+                'default': {'pool_recycle': 600},
+                'primary': {'pre_ping': True},
+                'replica0': {'pool_size': 3, 'max_overflow': 2,
+                             'pool_recycle': 60},
+            }
+
+        return create_app(RoutingConfig)
+
+    def setUp(self):
+        self.replica = db.get_engine(self.app, 'replica0')
+        db.create_all()
+        db.Model.metadata.create_all(bind=self.replica)
+        db.session.add(Language('en_US', 'English'))
+        db.session.commit()
+        self.replica.execute(Language.__table__.insert(),
+                             language_code='ja', language_name='Japanese')
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.Model.metadata.drop_all(bind=self.replica)
+        shutil.rmtree(self.directory)
+
+    def language_codes(self):
+        return [lang.language_code for lang in
+                db.session.query(Language).options(FromCache(cache))]
+
+
+class ReplicaRoutingTest(ReplicaTestCase):
+
+    def test_reads_default_to_primary(self):
+        self.assertEqual(self.language_codes(), ['en_US'])
+
+    def test_replica_reads(self):
+        with util.replica_reads():
+            self.assertEqual(self.language_codes(), ['ja'])
+            with util.replica_reads():
+                self.assertEqual(self.language_codes(), ['ja'])
+            self.assertEqual(self.language_codes(), ['ja'])
+        self.assertEqual(self.language_codes(), ['en_US'])
+
+    def test_read_only(self):
+        read = util.read_only(self.language_codes)
+        self.assertEqual(read(), ['ja'])
+        self.assertEqual(read.__name__, 'language_codes')
+
+    def test_pinned_after_write(self):
+        db.session.add(Language('zh', 'Chinese'))
+        db.session.commit()
+        with util.replica_reads():
+            self.assertEqual(sorted(self.language_codes()), ['en_US', 'zh'])
+        db.session.remove()
+        with util.replica_reads():
+            self.assertEqual(self.language_codes(), ['ja'])
+
+    def test_pinned_in_unit_of_work(self):
+        with util.unit_of_work():
+            with util.replica_reads():
+                self.assertEqual(self.language_codes(), ['en_US'])
+
+    def test_read_after_write(self):
+        perms = UserPermissions()
+        user = User('user@user', 'user', 'password', perms)
+        db.session.add_all([user, perms])
+        db.session.commit()
+        session_uuid = auth_storage.new_user_session(
+            user, False).session_uuid
+        # The session was written to the primary and has not replicated
+        self.assertIsNotNone(auth_storage.get_user_session(session_uuid))
+        db.session.remove()
+        self.assertIsNone(auth_storage.get_user_session(session_uuid))
+
+    def test_engine_options(self):
+        pool = self.replica.pool
+        self.assertIsInstance(pool, QueuePool)
+        self.assertEqual(pool.size(), 3)
+        self.assertEqual(pool._max_overflow, 2)
+        self.assertEqual(pool._recycle, 60)
+        self.assertFalse(event.contains(self.replica, 'engine_connect',
+                                        _ping))
+        self.assertEqual(db.engine.pool._recycle, 600)
+        self.assertTrue(event.contains(db.engine, 'engine_connect', _ping))
+        self.assertEqual(db.session.execute('SELECT 1').scalar(), 1)
+
+    def test_unknown_engine_option(self):
+        options = self.app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'replica0': {'pool_sise': 3}}
+        try:
+            with self.assertRaises(ValueError):
+                db.bind_options(self.app, 'replica0')
+        finally:
+            self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+class CachedReplicaRoutingTest(ReplicaTestCase):
+    """
+    Routes reads with the query cache enabled, which must never hold
+      results read from a replica.
+    """
+    cache_type = 'simple'
+
+    def test_replica_results_are_not_cached(self):
+        with util.replica_reads():
+            self.assertEqual(self.language_codes(), ['ja'])
+            self.assertEqual(self.language_codes(), ['ja'])
+        self.assertEqual(self.language_codes(), ['en_US'])
+
+    def test_replicas_use_results_cached_from_primary(self):
+        self.assertEqual(self.language_codes(), ['en_US'])
+        db.session.remove()
+        with util.replica_reads():
+            self.assertEqual(self.language_codes(), ['en_US'])
+
+    def test_pinned_reads_after_write(self):
+        with util.replica_reads():
+            self.assertEqual(self.language_codes(), ['ja'])
+        db.session.add(Language('zh', 'Chinese'))
+        db.session.commit()
+        with util.replica_reads():
+            self.assertEqual(sorted(self.language_codes()), ['en_US', 'zh'])
+        db.session.remove()
+        self.assertEqual(sorted(self.language_codes()), ['en_US', 'zh'])
+
+    def test_replica_counts_are_not_cached(self):
+        db.session.add(NewsTag('tea'))
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(news_storage.tag_counts(), [])
+        with util.replica_reads():
+            self.assertEqual(search_storage.indexed_posts(1), 0)
+        db.session.remove()
+        # Pinned to the primary, which must not be served the replica's count
+        with util.unit_of_work():
+            self.assertEqual(news_storage.tag_counts(),
+                             [{'name': 'tea', 'count': 0}])
+        self.assertIsNone(cache.get(search_storage.INDEXED_POSTS_CACHE_KEY
+                                    .format(1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
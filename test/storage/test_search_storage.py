@@ -0,0 +1,109 @@
+import unittest
+from datetime import datetime
+from unittest.mock import mock_open, patch
+from houraiteahouse.storage import news_storage, search_storage, \
+    summary_storage
+from houraiteahouse.storage.models import db, Language, NewsPost, \
+    NewsSearchTerm, NewsTitle
+from test_util import HouraiTeahouseTestCase
+
+BODIES = {
+    'Mountain-Dew': 'Local man drinks <br />a whole crate of mountain dew',
+    'Tea-Party': 'The teahouse hosts a tea party. Dew is not served.',
+    'Mountain-Hike': 'A hike up the mountain'
+}
+
+
+class SearchStorageTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.author = self.register('news@news', 'news', 'password')
+        self.language = Language('en_US', 'English')
+        db.session.add(self.language)
+        for post_short in sorted(BODIES):
+            title = post_short.replace('-', ' ')
+            post = NewsPost(post_short, title, datetime.utcnow(),
+                            self.author, [])
+            db.session.add(post)
+            db.session.add(NewsTitle(post, self.language, title))
+        db.session.commit()
+        summary_storage.rebuild_summaries()
+
+        def read_body(post_short, language):
+            return BODIES[post_short]
+        patcher = patch.object(news_storage, 'read_news_body', read_body)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        news_storage.rebuild_search_index()
+
+    def search(self, query):
+        return [result['post_id']
+                for result in news_storage.search_news(query, 'en_US')]
+
+    def test_tokenize_drops_markup_and_stop_words(self):
+        self.assertEqual(search_storage.tokenize('The <b>Tea</b> of Dew!'),
+                         ['tea', 'dew'])
+
+    def test_search_ranks_title_matches_first(self):
+        self.assertEqual(self.search('mountain'),
+                         ['Mountain-Hike', 'Mountain-Dew'])
+        self.assertEqual(self.search('dew'), ['Mountain-Dew', 'Tea-Party'])
+
+    def test_search_prefers_posts_matching_more_terms(self):
+        self.assertEqual(self.search('mountain dew')[0], 'Mountain-Dew')
+
+    def test_search_ignores_unknown_and_empty_queries(self):
+        self.assertEqual(self.search('coffee'), [])
+        self.assertEqual(self.search('the'), [])
+
+    def test_search_returns_snippets(self):
+        result = news_storage.search_news('crate', 'en_US')[0]
+        self.assertEqual(result['snippet'],
+                         'Local man drinks a whole crate of mountain dew')
+        self.assertEqual(result['title'], 'Mountain Dew')
+
+    def test_index_is_updated_by_translations(self):
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.commit()
+        summary_storage.rebuild_summaries()
+        with patch('builtins.open', mock_open(), create=True):
+            news_storage.translate_news('Tea-Party', 'ja', 'Ocha Kai',
+                                        'Ocha wo nomu')
+        self.assertEqual(
+            [result['post_id']
+             for result in news_storage.search_news('ocha', 'ja')],
+            ['Tea-Party'])
+        self.assertEqual(self.search('ocha'), [])
+
+    def test_reindexing_replaces_terms(self):
+        post = NewsPost.query.filter_by(post_short='Tea-Party').first()
+        search_storage.index_post(post.id, self.language.id, 'Tea Party',
+                                  'Biscuits')
+        self.assertEqual(self.search('dew'), ['Mountain-Dew'])
+        self.assertEqual(self.search('biscuits'), ['Tea-Party'])
+        self.assertEqual(
+            NewsSearchTerm.query.filter_by(news_id=post.id).count(), 3)
+
+    def test_indexed_post_count_is_cached(self):
+        self.search('dew')
+        with self.count_queries() as statements:
+            self.search('dew')
+        self.assertFalse([statement for statement in statements
+                          if 'count(distinct' in statement])
+        self.assertEqual(search_storage.indexed_posts(self.language.id), 3)
+
+    def test_indexing_new_posts_updates_count(self):
+        self.assertEqual(search_storage.indexed_posts(self.language.id), 3)
+        post = NewsPost('Tea-Time', 'Tea Time', datetime.utcnow(),
+                        self.author, [])
+        db.session.add(post)
+        db.session.flush()
+        search_storage.index_post(post.id, self.language.id, 'Tea Time',
+                                  'Biscuits')
+        db.session.commit()
+        self.assertEqual(search_storage.indexed_posts(self.language.id), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from houraiteahouse.storage import news_storage
+from houraiteahouse.storage.models import db, Language
+from houraiteahouse.storage.static_export import static_export
+from test_util import HouraiTeahouseTestCase
+
+
+class StaticExportTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        static_export.root = self.root
+        self.register('news@news', 'news', 'password')
+        self.session = self.login('news', 'password').session_uuid
+        db.session.add(Language('en_US', 'English'))
+        db.session.add(Language('ja', 'Japanese'))
+        db.session.commit()
+
+    def post_news(self, title='Local Man Drinks Tea'):
+        post_id = news_storage.post_news(title, 'Body', ['tea'],
+                                         self.session)['post_id']
+        self.assertTrue(static_export.wait(5))
+        return post_id
+
+    def read_export(self, *parts):
+        with open(os.path.join(self.root, *parts)) as export_file:
+            return json.load(export_file)
+
+    def test_posting_exports_views_in_every_language(self):
+        post_id = self.post_news()
+        for language in ('en_US', 'ja'):
+            self.assertEqual(self.read_export('news', language + '.json'),
+                             news_storage.list_news(language))
+            self.assertEqual(
+                self.read_export('news', 'tag', 'tea', language + '.json'),
+                news_storage.tagged_news('tea', language))
+            self.assertEqual(
+                self.read_export('news', post_id, language + '.json')
+                ['title'], 'Local Man Drinks Tea')
+
+    def test_comments_refresh_exports(self):
+        post_id = self.post_news()
+        news_storage.post_comment(post_id, 'First', self.session)
+        self.assertTrue(static_export.wait(5))
+        self.assertEqual(
+            self.read_export('news', 'en_US.json')['news'][0]['commentCount'],
+            1)
+        self.assertEqual(
+            self.read_export('news', post_id, 'en_US.json')['comments'][0]
+            ['body'], 'First')
+
+    def test_failed_renders_remove_stale_exports(self):
+        post_id = self.post_news()
+        with patch.object(news_storage, 'get_news', side_effect=IOError):
+            news_storage.export_all_views()
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, 'news', post_id, 'en_US.json')))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, 'news', 'en_US.json')))
+
+    def test_exports_are_world_readable_and_complete(self):
+        self.post_news()
+        directory = os.path.join(self.root, 'news')
+        self.assertEqual(
+            stat.S_IMODE(os.stat(os.path.join(directory,
+                                              'en_US.json')).st_mode),
+            0o644)
+        self.assertFalse([name for name in os.listdir(directory)
+                          if name.endswith('.tmp')])
+
+    def test_export_all_views(self):
+        self.post_news()
+        shutil.rmtree(os.path.join(self.root, 'news'))
+        # Listing, post and tag page in two languages
+        self.assertEqual(news_storage.export_all_views(), 6)
+
+    def test_nothing_is_exported_when_disabled(self):
+        static_export.root = None
+        self.post_news()
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_exports_are_rendered_off_the_request_thread(self):
+        threads = []
+        list_news = news_storage.list_news
+
+        def render(language):
+            threads.append(threading.current_thread())
+            return list_news(language)
+
+        with patch.object(news_storage, 'list_news', side_effect=render):
+            self.post_news()
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_queued_exports_of_a_post_are_coalesced(self):
+        post_id = self.post_news()
+        # Keep the export thread busy while the comments are posted
+        started, release = threading.Event(), threading.Event()
+        static_export.submit('busy', lambda: started.set() or release.wait(5))
+        self.assertTrue(started.wait(5))
+        try:
+            for body in ('First', 'Second', 'Third'):
+                news_storage.post_comment(post_id, body, self.session)
+            jobs = list(static_export._jobs)
+        finally:
+            release.set()
+        self.assertEqual([kind for kind, _ in jobs], ['post'])
+        self.assertTrue(static_export.wait(5))
+        self.assertEqual(
+            len(self.read_export('news', post_id, 'en_US.json')['comments']),
+            3)
+
+    def test_failed_jobs_do_not_fail_writes(self):
+        with patch.object(news_storage, '_export_post_views',
+                          side_effect=RuntimeError), \
+                self.assertLogs('houraiteahouse.storage.static_export',
+                                level='ERROR'):
+            post_id = self.post_news()
+        self.assertIsNotNone(news_storage.get_news(post_id, None))
+
+    def test_paths_cannot_escape_the_root(self):
+        with self.assertRaises(ValueError):
+            static_export.path_for('/news/../../etc', 'en_US')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from houraiteahouse.storage import storage_util as util
+from houraiteahouse.storage.models import db, Language, NewsTag
+from test_util import HouraiTeahouseTestCase
+
+
+class SerializationFailure(Exception):
+    pgcode = '40001'
+
+
+def serialization_failure():
+    return DBAPIError('COMMIT', {}, SerializationFailure())
+
+
+class UnitOfWorkTest(HouraiTeahouseTestCase):
+
+    def test_unit_of_work_commits_once(self):
+        commits = []
+        event.listen(db.session(), 'after_commit',
+                     lambda session: commits.append(session))
+        with util.unit_of_work() as session:
+            session.add(NewsTag('first'))
+            util.try_add(tag=NewsTag('second'))
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(NewsTag.query.count(), 2)
+
+    def test_unit_of_work_rolls_back_on_error(self):
+        with self.assertRaises(ValueError):
+            with util.unit_of_work() as session:
+                session.add(NewsTag('first'))
+                raise ValueError
+        self.assertEqual(NewsTag.query.count(), 0)
+        self.assertFalse(util.in_unit_of_work())
+
+    def test_nested_units_of_work_join_outermost(self):
+        with self.assertRaises(ValueError):
+            with util.unit_of_work() as session:
+                util.try_add(tag=NewsTag('first'))
+                session.add(NewsTag('second'))
+                raise ValueError
+        self.assertEqual(NewsTag.query.count(), 0)
+
+    def test_on_commit_waits_for_commit(self):
+        calls = []
+        with util.unit_of_work():
+            util.on_commit(lambda: calls.append('committed'))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, ['committed'])
+
+    def test_on_commit_is_dropped_on_rollback(self):
+        calls = []
+        with self.assertRaises(ValueError):
+            with util.unit_of_work():
+                util.on_commit(lambda: calls.append('committed'))
+                raise ValueError
+        self.assertEqual(calls, [])
+
+    def test_on_commit_callbacks_run_outside_unit_of_work(self):
+        calls = []
+
+        @util.transactional
+        def add_tag():
+            db.session.add(NewsTag('later'))
+
+        def callback():
+            calls.append(util.in_unit_of_work())
+            add_tag()
+            # Runs immediately, as there is no transaction left to wait for
+            util.on_commit(lambda: calls.append('nested'))
+
+        with util.unit_of_work() as session:
+            session.add(NewsTag('first'))
+            util.on_commit(callback)
+        self.assertEqual(calls, [False, 'nested'])
+        db.session.remove()
+        self.assertEqual(NewsTag.query.count(), 2)
+
+    def test_failing_on_commit_callbacks_are_logged(self):
+        calls = []
+
+        def fails():
+            raise RuntimeError
+
+        with self.assertLogs(level='ERROR'):
+            with util.unit_of_work() as session:
+                session.add(NewsTag('first'))
+                util.on_commit(fails)
+                util.on_commit(lambda: calls.append('committed'))
+        self.assertEqual(calls, ['committed'])
+        self.assertEqual(NewsTag.query.count(), 1)
+
+    def test_transactional_retries_serialization_failures(self):
+        attempts = []
+
+        @util.transactional
+        def add_language():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise serialization_failure()
+            db.session.add(Language('en_US', 'English'))
+
+        add_language()
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(Language.query.count(), 1)
+
+    def test_transactional_gives_up_after_max_retries(self):
+        attempts = []
+
+        @util.transactional
+        def always_fails():
+            attempts.append(1)
+            raise serialization_failure()
+
+        with self.assertRaises(DBAPIError):
+            always_fails()
+        self.assertEqual(len(attempts), util.MAX_RETRIES + 1)
+
+    def test_transactional_does_not_retry_other_errors(self):
+        attempts = []
+
+        @util.transactional
+        def fails():
+            attempts.append(1)
+            raise DBAPIError('INSERT', {}, Exception())
+
+        with self.assertRaises(DBAPIError):
+            fails()
+        self.assertEqual(len(attempts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
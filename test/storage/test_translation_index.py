@@ -0,0 +1,160 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from houraiteahouse.storage import news_storage
+from houraiteahouse.storage.body_store import body_store, \
+    FileSystemBodyStore
+from houraiteahouse.storage.models import db, Language, NewsPost, NewsTitle
+from houraiteahouse.storage.translation_index import translations
+from test_util import HouraiTeahouseTestCase
+
+
+class TranslationIndexTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.store = FileSystemBodyStore(self.directory)
+        patcher = patch.object(body_store, 'backend', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.author = self.register('news@news', 'news', 'password')
+        self.session = self.login('news', 'password').session_uuid
+        db.session.add_all([Language('en_US', 'English'),
+                            Language('ja', 'Japanese'),
+                            Language('zh', 'Chinese')])
+        db.session.commit()
+        self.post_id = news_storage.post_news(
+            'Post', 'Body', [], self.session)['post_id']
+
+    def tearDown(self):
+        HouraiTeahouseTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def get_news(self, language):
+        db.session.remove()
+        with patch.object(self.store, 'read', wraps=self.store.read) as read:
+            news = news_storage.get_news(self.post_id, None, language)
+        return news, [call[0][1] for call in read.call_args_list]
+
+    def test_untranslated_posts_fall_back_without_reading(self):
+        news, reads = self.get_news('ja')
+        self.assertEqual(news['body'], 'Body')
+        self.assertEqual(news['bodyLanguage'], 'en_US')
+        self.assertEqual(news['title'], 'Post')
+        self.assertEqual(reads, ['en_US'])
+
+    def test_translations_are_indexed(self):
+        news_storage.translate_news(self.post_id, 'ja', 'Toukou', 'Honbun')
+        self.assertEqual(translations.get(self.post_id).bodies,
+                         {'en_US', 'ja'})
+        news, reads = self.get_news('ja')
+        self.assertEqual((news['title'], news['body']), ('Toukou', 'Honbun'))
+        self.assertEqual(reads, ['ja'])
+
+    def test_fallback_chain(self):
+        news_storage.translate_news(self.post_id, 'ja', 'Toukou', 'Honbun')
+        with patch.object(translations, 'fallbacks', {'zh': ['ja']}):
+            self.assertEqual(news_storage.language_chain('zh'),
+                             ['zh', 'ja', 'en_US'])
+            news, reads = self.get_news('zh')
+        self.assertEqual((news['title'], news['body']), ('Toukou', 'Honbun'))
+        self.assertEqual(news['bodyLanguage'], 'ja')
+        self.assertEqual(reads, ['ja'])
+
+    def test_fallback_costs_no_extra_queries(self):
+        news_storage.translate_news(self.post_id, 'ja', 'Toukou', 'Honbun')
+        self.get_news('en_US')
+        with self.count_queries() as translated:
+            self.get_news('ja')
+        with self.count_queries() as untranslated:
+            self.get_news('zh')
+        self.assertEqual(len(untranslated), len(translated))
+
+    def test_finds_posts_written_elsewhere(self):
+        translations.get(self.post_id)
+        post = NewsPost('Elsewhere', 'Elsewhere', datetime.utcnow(),
+                        self.author, [])
+        db.session.add(post)
+        db.session.add(NewsTitle(post, Language.query.filter_by(
+            language_code='ja').one(), 'Yoso'))
+        db.session.commit()
+        self.store.write('Elsewhere', 'ja', 'Honbun')
+        found = translations.get('Elsewhere')
+        self.assertEqual((found.bodies, found.titles), ({'ja'}, {'ja'}))
+
+    def test_rebuilt_after_ttl(self):
+        translations.get(self.post_id)
+        self.store.write(self.post_id, 'ja', 'Honbun')
+        self.assertEqual(translations.get(self.post_id).bodies, {'en_US'})
+        with patch.object(translations, 'ttl', 0):
+            self.assertEqual(translations.get(self.post_id).bodies,
+                             {'en_US', 'ja'})
+
+    def test_one_thread_rebuilds_while_others_use_old_index(self):
+        translations.get(self.post_id)
+        self.store.write(self.post_id, 'ja', 'Honbun')
+        started, finish = threading.Event(), threading.Event()
+        reload = translations.reload
+
+        def slow_reload():
+            started.set()
+            finish.wait(5)
+            return reload()
+
+        def rebuild():
+            with self.app.app_context():
+                translations.get(self.post_id)
+
+        with patch.object(translations, 'ttl', 0), \
+                patch.object(translations, 'reload',
+                             side_effect=slow_reload) as reloads:
+            thread = threading.Thread(target=rebuild)
+            thread.start()
+            self.assertTrue(started.wait(5))
+            self.assertEqual(translations.get(self.post_id).bodies,
+                             {'en_US'})
+            finish.set()
+            thread.join()
+        self.assertEqual(reloads.call_count, 1)
+        self.assertEqual(translations.get(self.post_id).bodies,
+                         {'en_US', 'ja'})
+
+    def test_writes_during_rebuild_are_kept(self):
+        translations.get(self.post_id)
+        keys = self.store.keys()
+
+        def scan():
+            # Committed elsewhere after the scan has passed the post
+            translations.add(self.post_id, 'ja')
+            return keys
+
+        with patch.object(body_store, 'keys', side_effect=scan):
+            translations.reload()
+        self.assertEqual(translations.get(self.post_id).bodies,
+                         {'en_US', 'ja'})
+
+    def test_post_etag_follows_body_language(self):
+        uri = '/news/{0}?language=ja'.format(self.post_id)
+        etag = self.client.get(uri).headers['ETag']
+        # Body written without editing the post, as by migrate_news_bodies
+        self.store.write(self.post_id, 'ja', 'Honbun')
+        translations.add(self.post_id, 'ja', title=False)
+        response = self.client.get(uri, headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertEqual(response.json['body'], 'Honbun')
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        with patch.object(news_storage.search, 'index_post',
+                          side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                news_storage.translate_news(self.post_id, 'ja', 'Toukou',
+                                            'Honbun')
+        self.assertEqual(translations.get(self.post_id).titles, {'en_US'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,10 @@
 import unittest
 import logging
+import shutil
+import tempfile
+from contextlib import contextmanager
 from flask import json
+from sqlalchemy import event
 from flask_testing import TestCase
 from houraiteahouse.config import TestConfig
 from houraiteahouse.app import create_app
@@ -12,7 +16,12 @@ class HouraiTeahouseTestCase(TestCase):
 
     def create_app(self):
         self.db = db
-        return create_app(TestConfig)
+        news_dir = self.news_dir = tempfile.mkdtemp(prefix='htnews')
+
+        class Config(TestConfig):
+            NEWS_BODY_DIR = news_dir
+
+        return create_app(Config)
 
     def setUp(self):
         db.create_all()
@@ -21,6 +30,7 @@ class HouraiTeahouseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(self.news_dir, ignore_errors=True)
 
     def get(self, uri, data={}, session=None):
         return self.send('GET', uri, data, session)
@@ -82,6 +92,23 @@ class HouraiTeahouseTestCase(TestCase):
         db.session.commit()
         return user
 
+    @contextmanager
+    def count_queries(self):
+        """
+            Counts the SQL statements issued within the block.
+            Yields a list which will contain one entry per statement.
+        """
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,109 @@
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from werkzeug.exceptions import ServiceUnavailable
+from houraiteahouse.util import hashing
+from houraiteahouse.util.hashing import PasswordHasher
+from test_util import HouraiTeahouseTestCase
+
+
+class PasswordHasherTest(HouraiTeahouseTestCase):
+
+    def setUp(self):
+        HouraiTeahouseTestCase.setUp(self)
+        self.hasher = PasswordHasher()
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        self.app.config['PASSWORD_HASH_QUEUE_DEPTH'] = 0
+        self.hasher.init_app(self.app)
+
+    def test_hash_can_be_checked(self):
+        pw_hash = self.hasher.generate_password_hash('password')
+        self.assertTrue(self.hasher.check_password_hash(pw_hash, 'password'))
+        self.assertFalse(self.hasher.check_password_hash(pw_hash, 'wrong'))
+
+    def test_hashing_is_measured(self):
+        count = hashing.hash_latency.count
+        queued = hashing.queue_wait.count
+        self.hasher.generate_password_hash('password')
+        self.assertEqual(hashing.hash_latency.count, count + 1)
+        self.assertEqual(hashing.queue_wait.count, queued + 1)
+
+    def test_needs_rehash_compares_cost(self):
+        pw_hash = self.hasher.generate_password_hash('password')
+        self.assertFalse(self.hasher.needs_rehash(pw_hash))
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.hasher.init_app(self.app)
+        self.assertTrue(self.hasher.needs_rehash(pw_hash))
+
+    def test_calibration_respects_budget(self):
+        self.assertEqual(hashing.calibrate_log_rounds(0, 4, 6, samples=1), 4)
+        self.assertEqual(
+            hashing.calibrate_log_rounds(float('inf'), 4, 6, samples=1), 6)
+
+    def test_stronger_hashes_are_kept(self):
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.hasher.init_app(self.app)
+        pw_hash = self.hasher.generate_password_hash('password')
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+        self.hasher.init_app(self.app)
+        self.assertFalse(self.hasher.needs_rehash(pw_hash))
+
+    def test_full_queue_fails_fast(self):
+        rejected = hashing.rejected.value
+        # Occupy the only slot, as an in-flight job would
+        self.hasher._slots.acquire()
+        try:
+            with self.assertRaises(ServiceUnavailable):
+                self.hasher.generate_password_hash('password')
+        finally:
+            self.hasher._slots.release()
+        self.assertEqual(hashing.rejected.value, rejected + 1)
+
+    def test_concurrent_logins_beyond_queue_are_rejected(self):
+        self.app.config['PASSWORD_HASH_QUEUE_DEPTH'] = 1
+        self.hasher.init_app(self.app)
+        release = threading.Event()
+        hash_password = self.hasher._bcrypt.generate_password_hash
+
+        def slow_hash(password):
+            release.wait(5)
+            return hash_password(password)
+
+        results = []
+
+        def login():
+            try:
+                results.append(self.hasher.generate_password_hash('password'))
+            except ServiceUnavailable as e:
+                results.append(e.code)
+
+        with patch.object(self.hasher._bcrypt, 'generate_password_hash',
+                          slow_hash):
+            # One job hashing and one waiting fill both slots
+            threads = [threading.Thread(target=login) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while self.hasher._slots._value and time.monotonic() < deadline:
+                time.sleep(0.01)
+            login()
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results[0], 503)
+        self.assertEqual(sum(result == 503 for result in results), 1)
+
+    def test_jobs_are_capped_below_uwsgi_threads(self):
+        self.app.config['PASSWORD_HASH_WORKERS'] = 2
+        self.app.config['PASSWORD_HASH_QUEUE_DEPTH'] = 8
+        uwsgi = SimpleNamespace(opt={'threads': b'4'})
+        with patch.dict(sys.modules, {'uwsgi': uwsgi}):
+            self.hasher.init_app(self.app)
+        self.assertEqual(self.hasher._slots._value, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
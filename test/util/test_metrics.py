@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+from houraiteahouse.util import metrics
+from houraiteahouse.util.metrics import MultiProcessStore, Registry
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.requests = self.registry.counter(
+            'requests_total', 'Requests', labels=('status',))
+        self.latency = self.registry.histogram(
+            'latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        self.size = self.registry.gauge('size', 'Size')
+
+    def test_labels_are_counted_separately(self):
+        self.requests.inc(status=200)
+        self.requests.inc(2, status=404)
+        self.assertEqual(self.requests.snapshot(),
+                         {('200',): 1, ('404',): 2})
+
+    def test_labels_must_match_declaration(self):
+        with self.assertRaises(ValueError):
+            self.requests.inc()
+        with self.assertRaises(ValueError):
+            self.requests.inc(status=200, method='GET')
+
+    def test_exposition_format(self):
+        self.requests.inc(status=200)
+        self.latency.observe(0.5)
+        self.latency.observe(5)
+        self.size.set(3)
+        text = metrics.exposition(self.registry)
+        self.assertIn('# TYPE latency_seconds histogram\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn('latency_seconds_sum 5.5\n', text)
+        self.assertIn('latency_seconds_count 2\n', text)
+        self.assertIn('requests_total{status="200"} 1\n', text)
+        self.assertIn('size 3\n', text)
+
+    def test_request_timings_are_per_thread(self):
+        metrics.record_time('db', 1.0)
+        timings = metrics.start_request_timings()
+        metrics.record_time('db', 0.5)
+        metrics.record_time('db', 0.25)
+        self.assertIs(metrics.stop_request_timings(), timings)
+        self.assertEqual(timings['db'], 0.75)
+        self.assertEqual(timings['db_count'], 2)
+        self.assertIsNone(metrics.stop_request_timings())
+
+
+class MultiProcessStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.registry = Registry()
+        self.requests = self.registry.counter('requests_total', 'Requests')
+        self.latency = self.registry.histogram(
+            'latency_seconds', 'Latency', buckets=(1.0,))
+        self.size = self.registry.gauge('size', 'Size')
+        self.store = MultiProcessStore(self.directory, self.registry)
+
+    def worker(self, pid, requests, latency, size):
+        worker_registry = Registry()
+        worker_registry.counter('requests_total', 'Requests').inc(requests)
+        worker_registry.histogram('latency_seconds', 'Latency',
+                                  buckets=(1.0,)).observe(latency)
+        worker_registry.gauge('size', 'Size').set(size)
+        store = MultiProcessStore(self.directory, worker_registry)
+        store._pid = pid
+        store.check_fork = lambda: None
+        store.flush()
+
+    def test_workers_are_aggregated(self):
+        self.requests.inc(1)
+        self.latency.observe(0.5)
+        self.size.set(7)
+        self.store.flush()
+        # A worker which has since exited
+        self.worker(2 ** 22 + 1, 2, 2.0, 9)
+
+        values = self.store.collect()
+        self.assertEqual(values['requests_total'], {(): 3})
+        self.assertEqual(values['latency_seconds'][()],
+                         {'counts': [1], 'count': 2, 'sum': 2.5})
+        # Gauges only make sense for live processes
+        self.assertEqual(values['size'], {(str(os.getpid()),): 7})
+        text = metrics.exposition(self.registry, values)
+        self.assertIn('size{{pid="{0}"}} 7\n'.format(os.getpid()), text)
+
+    def test_forked_processes_start_from_zero(self):
+        self.requests.inc(5)
+        self.store._pid = -1
+        self.store.check_fork()
+        self.assertEqual(self.requests.value, 0)
+        self.assertEqual(self.store._pid, os.getpid())
+
+
+if __name__ == "__main__":
+    unittest.main()